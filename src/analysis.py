@@ -0,0 +1,97 @@
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from tools import FileInfo
+
+SAVE_EVERY = 512
+
+
+# Per-file results computed in a process pool and cached as JSON, keyed by
+# path and invalidated by size/mtime, so reruns only analyse new or changed files.
+class AnalysisCache:
+    cache_version = 1
+
+    def __init__(self, cache_path: Path, worker: Callable[[str], Tuple[str, Any]]):
+        self.cache_path = Path(cache_path)
+        self.worker = worker
+        self.records: Dict[str, Tuple[int, int, Any]] = {}
+        self.version = 0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.load()
+
+    def encode(self, value: Any) -> Any:
+        return value
+
+    def decode(self, data: Any) -> Any:
+        return data
+
+    def load(self) -> None:
+        try:
+            with self.cache_path.open(encoding="utf-8") as f:
+                payload = json.load(f)
+        except (OSError, ValueError):
+            return
+        if payload.get("version") != self.cache_version:
+            return
+        with self._lock:
+            for path, (size, mtime_ns, data) in payload.get("records", {}).items():
+                self.records[path] = (size, mtime_ns, self.decode(data))
+            self.version += 1
+
+    def save(self) -> None:
+        with self._lock:
+            records = {
+                path: [size, mtime_ns, self.encode(value)] for path, (size, mtime_ns, value) in self.records.items()
+            }
+        self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.cache_path.with_suffix(".json.tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump({"version": self.cache_version, "records": records}, f, separators=(",", ":"))
+        tmp_path.replace(self.cache_path)
+
+    def get(self, info: FileInfo) -> Optional[Any]:
+        record = self.records.get(str(info.path))
+        if record is None or record[0] != info.size or record[1] != info.mtime_ns:
+            return None
+        return record[2]
+
+    def pending(self, infos: Iterable[FileInfo]) -> List[FileInfo]:
+        return [info for info in infos if self.get(info) is None]
+
+    def update(self, infos: Sequence[FileInfo], workers: Optional[int] = None) -> int:
+        todo = {str(info.path): info for info in self.pending(infos)}
+        if not todo:
+            return 0
+        # spawn: the app process runs threads, which fork() doesn't copy safely
+        ctx = multiprocessing.get_context("spawn")
+        done = 0
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 4, mp_context=ctx) as pool:
+            for path_str, value in pool.map(self.worker, todo, chunksize=16):
+                info = todo[path_str]
+                with self._lock:
+                    self.records[path_str] = (info.size, info.mtime_ns, value)
+                    self.version += 1
+                done += 1
+                if done % SAVE_EVERY == 0:
+                    self.save()
+        self.save()
+        return done
+
+    def update_async(self, infos: Sequence[FileInfo], workers: Optional[int] = None) -> bool:
+        if self.busy or not self.pending(infos):
+            return False
+        self._thread = threading.Thread(
+            target=self.update, args=(list(infos), workers), name=type(self).__name__, daemon=True
+        )
+        self._thread.start()
+        return True
+
+    @property
+    def busy(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
@@ -1,15 +1,64 @@
 from pathlib import Path
-from typing import List, Tuple, Optional, Dict
-import json
-import shutil
+from typing import List, Tuple, Optional, Dict, Union
+import atexit
+import base64
+import time
 import csv
 from datetime import datetime
+from urllib.parse import urlsplit
 
-from PIL import Image, ImageOps
+from PIL import Image
 import streamlit as st
 import streamlit.components.v1 as components
-
-from tools import RAW_EXTS
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+from catalog import CATALOG_PATH, Catalog
+from dedup import DEDUP_LINK, DEDUP_MODES, DEDUP_OFF, DEDUP_SKIP, ContentHashes, DedupReport, dedup_entries
+from decisions import ACTION_DECISION, DISCARD, KEEP, DecisionStore
+from journal import SESSION_VERSION, SessionJournal
+from metadata import SHAPE_LANDSCAPE, SHAPE_PORTRAIT, SHAPE_SQUARE, SHAPES, MetadataIndex, QueueFilter, capture_time
+from plan import PlanEntry, TransferPlan
+from prefetch import Prefetcher
+from preview_server import PreviewServer
+from previews import PreviewCache
+from scanner import MediaScanner
+from scoring import (
+    DEFAULT_CLIPPING_THRESHOLD,
+    DEFAULT_SHARPNESS_THRESHOLD,
+    Score,
+    ScoreIndex,
+    scoring_available,
+    suspects_first,
+)
+from sessions import (
+    MergeResult,
+    assign_shards,
+    catalog_session,
+    clear_shards,
+    list_reviewers,
+    load_shards,
+    merge_sessions,
+    reviewer_label,
+    reviewer_slug,
+    session_paths,
+    sessions_signature,
+)
+from similarity import SimilarityIndex, burst_at
+from timing import BUCKETS_MS, Tracer, bucket_label, percentile, span, timed, use_tracer
+from tools import FileInfo, MediaIndex, format_bytes, format_duration
+from transfer import (
+    COPY_FULL,
+    COPY_HARDLINK,
+    COPY_REFLINK,
+    COPY_STRATEGIES,
+    TransferEngine,
+    TransferProgress,
+    cleanup_originals,
+    extra_bytes,
+    support_version,
+)
+from watcher import BACKEND_INOTIFY, MediaWatcher
+from xmp import SIDECAR_FULL, SIDECAR_STEM, SIDECAR_STYLES, export_sidecars
 
 CARD_CSS = """
 <style>
@@ -96,54 +145,473 @@ st.markdown(CARD_CSS, unsafe_allow_html=True)
 # ---------------------------- Config base ----------------------------
 st.set_page_config(page_title="Tinder de fotos", page_icon="🖼️", layout="centered")
 
-IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".tiff"}
-SESSION_VERSION = 2
+
+def session_tracer() -> Optional[Tracer]:
+    # Button callbacks and the script body run with the session's context;
+    # shared worker threads (prefetch) have none and are not traced
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return None
+    return st.session_state.get("tracer")
 
 
-@st.cache_data(show_spinner=False)
-def load_image_paths(media_dir: str = "media") -> List[Path]:
-    p = Path(media_dir)
-    if not p.exists():
-        return []
-    imgs = [x for x in p.iterdir() if x.suffix.lower() in IMAGE_EXTS and x.is_file()]
-    imgs.sort(key=lambda x: x.name.lower())
-    return imgs
+if "tracer" not in st.session_state:
+    st.session_state.tracer = Tracer()
+use_tracer(session_tracer)
+st.session_state.tracer.enabled = st.session_state.get("trace_timings", False)
+st.session_state.tracer.begin_rerun()
+
+PREVIEW_WIDTH = 1200
+PREFETCH_AHEAD = 4
+PREFETCH_BEHIND = 1
+TRANSFER_WORKERS = 4
+BURST_THUMB_WIDTH = 320
+BURST_MAX_SHOWN = 8
+GRID_COLUMNS = 6
+GRID_THUMB_WIDTH = 320
+# Browser-side review: previews sent ahead, decisions sent back in batches
+DECK_AHEAD = 12
+DECK_BATCH = 8
+DECK_DEBOUNCE_MS = 1200
+DECK_LOW_WATER = 3
+# Seconds between checks for images the folder watcher queued
+WATCH_INTERVAL = 2
+
+review_deck = components.declare_component("review_deck", path=str(Path(__file__).parent / "deck"))
+preview_probe = components.declare_component("preview_probe", path=str(Path(__file__).parent / "probe"))
+# How long the browser gets to load the preview server's probe image
+PREVIEW_PROBE_TIMEOUT_MS = 4000
+
+
+@st.cache_resource(show_spinner=False)
+def get_catalog() -> Catalog:
+    return Catalog(CATALOG_PATH)
+
+
+def active_catalog() -> Optional[Catalog]:
+    return get_catalog() if st.session_state.use_catalog else None
+
+
+def active_session() -> str:
+    return catalog_session(st.session_state.reviewer)
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_scanner(media_dir: str) -> MediaScanner:
+    catalog = get_catalog() if st.session_state.use_catalog else None
+    return MediaScanner(Path(media_dir), catalog=catalog).start()
+
+
+def media_scanner(media_dir: Optional[str] = None) -> MediaScanner:
+    scanner = get_scanner(media_dir or st.session_state.source_dir)
+    if st.session_state.use_catalog and scanner.catalog is None:
+        scanner.attach_catalog(get_catalog())
+    # Picks up added/removed files by comparing directory mtimes
+    scanner.refresh_if_due()
+    return scanner
+
+
+def media_index(media_dir: Optional[str] = None) -> MediaIndex:
+    return media_scanner(media_dir).index
+
+
+@timed()
+def load_image_paths(media_dir: str = "media", wait_all: bool = False) -> List[Path]:
+    scanner = media_scanner(media_dir)
+    if wait_all:
+        scanner.wait_done()
+    else:
+        scanner.wait_first_page()
+    return list(scanner.order)
+
+
+def reset_queue(media_dir: Optional[str] = None) -> None:
+    media_dir = media_dir or st.session_state.source_dir
+    shard = load_shards(media_dir).get(st.session_state.reviewer)
+    if shard is None:
+        st.session_state.images = load_image_paths(media_dir)
+        st.session_state.scan_pos = len(st.session_state.images)
+    else:
+        # A shard is a fixed range of the full review order; files found later belong to nobody
+        order = load_image_paths(media_dir, wait_all=True)
+        st.session_state.images = order[shard.start : shard.end]
+        st.session_state.scan_pos = len(order)
+    st.session_state.shard = shard
+    st.session_state.held_back = []
+    st.session_state.queue_filter = QueueFilter()
+
+
+def queue_matches_decisions() -> bool:
+    images = st.session_state.images
+    for pos in range(min(st.session_state.idx, len(images))):
+        decided = st.session_state.decisions.at(pos)
+        if decided is not None and decided[0] != image_name(images[pos]):
+            return False
+    return True
+
+
+def align_queue() -> None:
+    # The pending tail can be reordered (suspects first), so a reloaded session puts
+    # decided images back at the positions they were decided at. Decided files that
+    # vanished leave no hole: idx then points at the first undecided image.
+    store = st.session_state.decisions
+    idx = st.session_state.idx
+    if queue_matches_decisions():
+        return
+    media_scanner().wait_done()
+    sync_images()
+    decided: Dict[int, Path] = {}
+    rest: List[Path] = []
+    for path in st.session_state.images:
+        pos = store.index_of(image_name(path))
+        if pos is not None and pos < idx and pos not in decided:
+            decided[pos] = path
+        else:
+            rest.append(path)
+    st.session_state.images = [decided[pos] for pos in sorted(decided)] + rest
+    st.session_state.idx = len(decided)
+
+
+def sync_images() -> None:
+    # Append whatever the background scan found since the last rerun
+    if st.session_state.shard is not None:
+        return
+    order = media_scanner().order
+    pos = st.session_state.scan_pos
+    if len(order) > pos:
+        found = order[pos:]
+        if st.session_state.queue_filter.active:
+            found, held = filter_paths(found, st.session_state.queue_filter)
+            st.session_state.held_back.extend(held)
+        st.session_state.images.extend(found)
+        st.session_state.scan_pos = len(order)
+
+
+def image_name(path: Path) -> str:
+    return media_index().name_of(path)
+
+
+@st.cache_resource(show_spinner=False)
+def get_metadata() -> MetadataIndex:
+    return MetadataIndex()
+
+
+@st.cache_resource(show_spinner=False)
+def get_preview_cache() -> PreviewCache:
+    # Orientation comes from the metadata index once it has read the file
+    return PreviewCache(orientation_of=get_metadata().orientation_of)
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def get_watcher(media_dir: str) -> MediaWatcher:
+    cache = get_preview_cache()
+
+    def warm_previews(paths: List[Path]) -> None:
+        # Runs on the watcher's worker thread, so new shots are ready when reached
+        cache.warm(paths, PREVIEW_WIDTH, workers=2)
+
+    return MediaWatcher(get_scanner(media_dir), on_new=warm_previews)
+
+
+@st.fragment(run_every=WATCH_INTERVAL)
+def watch_status() -> None:
+    watcher = get_watcher(st.session_state.source_dir)
+    if st.session_state.shard is None and len(watcher.scanner.order) > st.session_state.scan_pos:
+        # A full rerun: sync_images() appends them after the current queue, idx untouched
+        st.rerun()
+    backend = "inotify" if watcher.backend == BACKEND_INOTIFY else "sondeo"
+    text = f"👀 Vigilando {st.session_state.source_dir} ({backend}): {watcher.found} imágenes nuevas"
+    if st.session_state.shard is not None:
+        text += " · con reparto por rangos las nuevas no se añaden a tu cola"
+    if watcher.error:
+        text += f" · inotify no disponible ({watcher.error})"
+    st.caption(text)
+
+
+@timed()
+def filter_paths(paths: List[Path], queue_filter: QueueFilter) -> Tuple[List[Path], List[Path]]:
+    # (shown, held back); files the index no longer knows stay in the queue
+    index = media_index()
+    metadata = get_metadata()
+    infos = {}
+    for path in paths:
+        info = index.files.get(index.name_of(path))
+        if info is not None:
+            infos[path] = info
+    metadata.update(list(infos.values()))
+    shown: List[Path] = []
+    held: List[Path] = []
+    for path in paths:
+        info = infos.get(path)
+        if info is None or queue_filter.matches(metadata.get(info), info):
+            shown.append(path)
+        else:
+            held.append(path)
+    return shown, held
+
+
+def load_preview(path: Path, max_width: int) -> Image.Image:
+    # Previews are stored already EXIF-oriented and downscaled
+    preview = get_preview_cache().get(path, max_width)
+    with Image.open(preview) as img:
+        img.load()
+        return img
+
+
+@st.cache_resource(show_spinner=False)
+def get_prefetcher() -> Prefetcher:
+    return Prefetcher(load_preview, capacity=4 * (PREFETCH_AHEAD + PREFETCH_BEHIND + 1))
+
+
+@timed()
+def open_image(path: Path, max_width: int = PREVIEW_WIDTH) -> Image.Image:
+    return get_prefetcher().get(path, max_width)
+
+
+@timed()
+def preview_file(path: Path, max_width: int = PREVIEW_WIDTH) -> Path:
+    return get_preview_cache().get(path, max_width)
+
+
+@st.cache_resource(show_spinner=False)
+def get_preview_server() -> Optional[PreviewServer]:
+    try:
+        return PreviewServer(get_preview_cache().root).start(st.get_option("server.address") or "")
+    except OSError:
+        return None
+
+
+def preview_server_host() -> Optional[str]:
+    # Browsers block http images on an https page (reverse proxy); st.image then sends the bytes
+    headers = st.context.headers
+    if get_preview_server() is None or headers.get("X-Forwarded-Proto") == "https":
+        return None
+    return urlsplit("//" + headers.get("Host", "")).hostname or "127.0.0.1"
+
+
+def preview_url(preview: Path) -> Optional[str]:
+    # Only once this browser has loaded the probe image: the server listens on
+    # a random port that a proxy, port forwarding or a firewall may not expose
+    host = preview_server_host()
+    if host is None or st.session_state.preview_server_ok is not True:
+        return None
+    return get_preview_server().url_for(preview, host)
+
+
+def note_preview_probe() -> None:
+    st.session_state.preview_server_ok = bool(st.session_state.preview_probe)
+
+
+def probe_preview_server() -> None:
+    # Until the browser answers, images are sent inline
+    host = preview_server_host()
+    if host is None or st.session_state.preview_server_ok is not None:
+        return
+    preview_probe(
+        url=get_preview_server().probe_url(host),
+        timeout_ms=PREVIEW_PROBE_TIMEOUT_MS,
+        key="preview_probe",
+        on_change=note_preview_probe,
+        default=None,
+    )
 
 
-def open_image(path: Path, max_width: int = 1200) -> Image.Image:
-    img = Image.open(path).convert("RGB")
-    return img
+def image_source(path: Path, max_width: int = PREVIEW_WIDTH) -> Union[str, Image.Image]:
+    # The browser caches a preview URL; decoded pixels are re-encoded on every rerun
+    url = preview_url(preview_file(path, max_width))
+    return url if url is not None else open_image(path, max_width)
 
 
 def session_file() -> Path:
-    return Path(".keep_or_discard") / "session_state.json"
+    return session_paths(st.session_state.reviewer)[0]
 
 
-def save_session_state() -> None:
-    payload = {
+def session_log_file() -> Path:
+    return session_paths(st.session_state.reviewer)[1]
+
+
+@st.cache_resource(show_spinner=False)
+def get_journal(snapshot_path: str, log_path: str) -> SessionJournal:
+    journal = SessionJournal(Path(snapshot_path), Path(log_path))
+    atexit.register(journal.sync)
+    return journal
+
+
+def session_journal() -> SessionJournal:
+    return get_journal(str(session_file()), str(session_log_file()))
+
+
+def session_snapshot() -> Dict:
+    return {
         "version": SESSION_VERSION,
         "source_dir": st.session_state.source_dir,
         "mode": st.session_state.mode,
         "idx": st.session_state.idx,
-        "mantener": st.session_state.mantener,
-        "desechar": st.session_state.desechar,
+        "mantener": list(st.session_state.decisions.names(KEEP)),
+        "desechar": list(st.session_state.decisions.names(DISCARD)),
         "history": st.session_state.history,
     }
-    session_path = session_file()
-    session_path.parent.mkdir(parents=True, exist_ok=True)
-    tmp_path = session_path.with_suffix(".json.tmp")
-    tmp_path.write_text(json.dumps(payload, ensure_ascii=False, indent=2))
-    tmp_path.replace(session_path)
+
+
+@timed()
+def save_session_state() -> None:
+    journal = session_journal()
+    # Refused while another tab has records this one has not replayed yet
+    if not journal.compact(session_snapshot(), st.session_state.journal_seq):
+        sync_session()
+        journal.compact(session_snapshot(), st.session_state.journal_seq)
+
+
+def journal_record(record: Dict) -> None:
+    journal = session_journal()
+    seq = journal.append(record)
+    if seq == st.session_state.journal_seq + 1:
+        st.session_state.journal_seq = seq
+    else:
+        # Another tab wrote in between; sync_session() replays its records and skips ours
+        st.session_state.own_seqs.add(seq)
+    if journal.needs_compaction():
+        save_session_state()
+
+
+def sync_session() -> None:
+    # Tabs of the same reviewer share one log: replay what the others appended.
+    # This tab keeps its own position unless the others are further ahead.
+    catalog = active_catalog()
+    if catalog is not None:
+        sync_catalog_session(catalog)
+        return
+    snapshot, records = session_journal().tail(st.session_state.journal_seq)
+    if snapshot is None and not records:
+        return
+    idx = st.session_state.idx
+    if snapshot is not None:
+        load_session_state()
+        align_queue()
+    else:
+        own = st.session_state.own_seqs
+        for record in records:
+            if int(record["seq"]) not in own:
+                replay_record(record)
+        st.session_state.journal_seq = int(records[-1]["seq"])
+        own.clear()
+    st.session_state.idx = max(idx, st.session_state.idx)
+
+
+def sync_catalog_session(catalog: Catalog) -> None:
+    # The catalog counterpart: every write bumps the session version, so a
+    # version this tab did not produce means another tab wrote; reload from it.
+    if catalog.session_version(active_session()) == st.session_state.catalog_version:
+        return
+    idx = st.session_state.idx
+    if load_catalog_session(catalog):
+        align_queue()
+    else:
+        # Another tab reset the session
+        st.session_state.decisions = DecisionStore()
+        st.session_state.history = []
+        st.session_state.history_seqs = []
+        st.session_state.plan = None
+        st.session_state.catalog_version = 0
+    st.session_state.idx = max(idx, st.session_state.idx)
+
+
+def note_catalog_version(version: int) -> None:
+    # Our own write: only the next version is certainly ours alone; after a
+    # gap the next sync_catalog_session() reloads what the other tab wrote
+    if version == st.session_state.catalog_version + 1:
+        st.session_state.catalog_version = version
+
+
+def update_plan(name: str) -> None:
+    # Only the touched image's entries change; totals are running sums
+    plan = st.session_state.get("plan")
+    if plan is not None and st.session_state.get("plan_source") is None:
+        plan.update(name, st.session_state.decisions.get(name))
+
+
+def apply_decision(action: str, target: str, idx_before: int, batch: Optional[str] = None) -> None:
+    previous = st.session_state.decisions.record(target, ACTION_DECISION[action], idx_before)
+    entry = (action, target, idx_before, previous)
+    # Decisions taken by one group action share a batch id so they undo together
+    st.session_state.history.append(entry + (batch,) if batch is not None else entry)
+    # Catalog history row of the entry, filled in by persist_decision
+    st.session_state.history_seqs.append(None)
+    st.session_state.idx = idx_before + 1
+    update_plan(target)
+
+
+def apply_undo() -> Optional[Tuple]:
+    if not st.session_state.history:
+        return None
+    entry = st.session_state.history.pop()
+    st.session_state.history_seqs.pop()
+    action, target, idx_before = entry[:3]
+    # v2 history entries have no previous decision
+    previous = entry[3] if len(entry) > 3 else None
+    st.session_state.decisions.restore(target, previous, idx_before)
+    st.session_state.idx = idx_before
+    update_plan(target)
+    return entry
+
+
+def replay_record(record: Dict) -> None:
+    op = record.get("op")
+    if op in ("left", "right"):
+        apply_decision(op, record["name"], int(record["idx"]), record.get("batch"))
+    elif op == "undo":
+        apply_undo()
+    elif op == "meta":
+        if "mode" in record:
+            st.session_state.mode = record["mode"]
+        if "source_dir" in record:
+            st.session_state.source_dir = record["source_dir"]
+
+
+def load_catalog_session(catalog: Catalog) -> bool:
+    session = catalog.load_session(active_session())
+    if session is None:
+        return False
+    st.session_state.source_dir = session.source_dir
+    st.session_state.mode = session.mode
+    st.session_state.idx = session.idx
+    store = DecisionStore()
+    for name, decision, position in session.decisions:
+        store.record(name, decision, position)
+    st.session_state.decisions = store
+    st.session_state.history = [tuple(h) for h in session.history]
+    st.session_state.history_seqs = list(session.history_seqs)
+    st.session_state.catalog_version = session.version
+    st.session_state.plan = None
+    return True
+
+
+def save_catalog_session(catalog: Catalog) -> None:
+    store = st.session_state.decisions
+    st.session_state.catalog_version = catalog.save_session(
+        st.session_state.source_dir,
+        st.session_state.mode,
+        st.session_state.idx,
+        ((name, decision, store.index_of(name)) for name, decision in store.items()),
+        st.session_state.history,
+        session=active_session(),
+    )
+    # save_session numbers the history rows from 1
+    st.session_state.history_seqs = list(range(1, len(st.session_state.history) + 1))
 
 
 def load_session_state() -> None:
-    session_path = session_file()
-    if not session_path.exists():
+    catalog = active_catalog()
+    if catalog is not None and load_catalog_session(catalog):
         return
-    try:
-        payload = json.loads(session_path.read_text())
-    except json.JSONDecodeError:
+    # No catalog row for this session yet
+    st.session_state.catalog_version = 0
+    journal = session_journal()
+    snapshot, records = journal.load()
+    st.session_state.journal_seq = journal.seq
+    st.session_state.own_seqs = set()
+    if snapshot is None and not records:
         return
+    payload = snapshot or {"version": SESSION_VERSION}
     version = int(payload.get("version", 1))
     st.session_state.source_dir = payload.get("source_dir", "media")
     st.session_state.mode = payload.get("mode", "copy")
@@ -154,43 +622,41 @@ def load_session_state() -> None:
     if version < 2:
         # v1 stored stems; resolve to actual filenames in source dir
         source_dir = Path(st.session_state.source_dir)
-        imgs = load_image_paths(str(source_dir))
+        imgs = load_image_paths(str(source_dir), wait_all=True)
         stem_map = {}
         for p in imgs:
             stem_map.setdefault(p.stem, p.name)
         mantener = [stem_map.get(x, f"{x}.jpg") for x in mantener]
         desechar = [stem_map.get(x, f"{x}.jpg") for x in desechar]
         history = [(h[0], stem_map.get(h[1], f"{h[1]}.jpg"), h[2]) for h in history]
-    st.session_state.mantener = mantener
-    st.session_state.desechar = desechar
+    history = [tuple(h) for h in history]
+    indices = {h[1]: int(h[2]) for h in history}
+    st.session_state.decisions = DecisionStore.from_lists(mantener, desechar, indices)
     st.session_state.history = history
+    st.session_state.history_seqs = [None] * len(history)
+    st.session_state.plan = None
+    # v3: decisions made after the snapshot live in the log
+    for record in records:
+        replay_record(record)
+    if catalog is not None:
+        # First run with the catalog enabled: import the JSON session
+        save_catalog_session(catalog)
 
 
 def reset_session_state() -> None:
     st.session_state.idx = 0
-    st.session_state.mantener = []
-    st.session_state.desechar = []
+    st.session_state.decisions = DecisionStore()
     st.session_state.history = []
+    st.session_state.history_seqs = []
+    st.session_state.plan = None
     st.session_state.last_action = None
-    session_path = session_file()
-    if session_path.exists():
-        session_path.unlink()
-
-
-def stem_without_ext(path: Path) -> str:
-    return path.stem
-
-
-def resolve_source_file(name: str, source_dir: Path) -> Optional[Path]:
-    direct = source_dir / name
-    if direct.exists():
-        return direct
-    stem = Path(name).stem
-    # Try to match by stem across known image files
-    for p in st.session_state.images:
-        if p.stem == stem:
-            return p
-    return None
+    session_journal().reset()
+    st.session_state.journal_seq = 0
+    st.session_state.own_seqs = set()
+    catalog = active_catalog()
+    if catalog is not None:
+        catalog.reset_session(active_session())
+        st.session_state.catalog_version = 0
 
 
 def ensure_session_flags() -> None:
@@ -199,16 +665,20 @@ def ensure_session_flags() -> None:
 
 
 # ---------------------------- Estado ----------------------------
+if "reviewer" not in st.session_state:
+    # Each reviewer bookmarks their own URL: ?revisor=<nombre>
+    st.session_state.reviewer = reviewer_slug(st.query_params.get("revisor", ""))
+if "use_catalog" not in st.session_state:
+    st.session_state.use_catalog = CATALOG_PATH.exists()
 if "images" not in st.session_state:
-    st.session_state.images = load_image_paths("media")
+    reset_queue("media")
 if "idx" not in st.session_state:
     st.session_state.idx = 0
-if "mantener" not in st.session_state:
-    st.session_state.mantener = []
-if "desechar" not in st.session_state:
-    st.session_state.desechar = []
+if "decisions" not in st.session_state:
+    st.session_state.decisions = DecisionStore()
 if "history" not in st.session_state:
     st.session_state.history = []
+    st.session_state.history_seqs = []
 if "flash" not in st.session_state:
     st.session_state.flash = None  # "left" | "right" | None
 if "kb_seq" not in st.session_state:
@@ -221,6 +691,8 @@ if "confirm_move" not in st.session_state:
     st.session_state.confirm_move = False
 if "confirm_cleanup" not in st.session_state:
     st.session_state.confirm_cleanup = False
+if "cleanup_hash" not in st.session_state:
+    st.session_state.cleanup_hash = False
 if "mode" not in st.session_state:
     st.session_state.mode = "copy"
 if "source_dir" not in st.session_state:
@@ -229,48 +701,146 @@ if "include_ambiguous_raws" not in st.session_state:
     st.session_state.include_ambiguous_raws = True
 if "last_action" not in st.session_state:
     st.session_state.last_action = None
+if "plan" not in st.session_state:
+    st.session_state.plan = None
+if "group_bursts" not in st.session_state:
+    st.session_state.group_bursts = False
+if "review_mode" not in st.session_state:
+    st.session_state.review_mode = "card"
+if "queue_sort" not in st.session_state:
+    st.session_state.queue_sort = "name"
+if "xmp_style" not in st.session_state:
+    st.session_state.xmp_style = SIDECAR_STEM
+if "watch_media" not in st.session_state:
+    st.session_state.watch_media = False
+if "deck" not in st.session_state:
+    st.session_state.deck = True
+if "deck_client" not in st.session_state:
+    st.session_state.deck_client = None
+    st.session_state.deck_acked = 0
+    st.session_state.deck_sent = set()
+if "grid_page_size" not in st.session_state:
+    st.session_state.grid_page_size = 36
+if "score_images" not in st.session_state:
+    st.session_state.score_images = False
+if "sharpness_threshold" not in st.session_state:
+    st.session_state.sharpness_threshold = DEFAULT_SHARPNESS_THRESHOLD
+if "clipping_threshold" not in st.session_state:
+    st.session_state.clipping_threshold = DEFAULT_CLIPPING_THRESHOLD
+if "trace_timings" not in st.session_state:
+    st.session_state.trace_timings = False
+if "journal_seq" not in st.session_state:
+    st.session_state.journal_seq = 0
+if "own_seqs" not in st.session_state:
+    st.session_state.own_seqs = set()
+if "catalog_version" not in st.session_state:
+    st.session_state.catalog_version = 0
+if "preview_server_ok" not in st.session_state:
+    st.session_state.preview_server_ok = None
+if "combine_reviewers" not in st.session_state:
+    st.session_state.combine_reviewers = False
+if "dedup" not in st.session_state:
+    st.session_state.dedup = DEDUP_OFF
+if "copy_strategy" not in st.session_state:
+    st.session_state.copy_strategy = COPY_FULL
 
 ensure_session_flags()
 
-session_exists = session_file().exists()
+catalog = active_catalog()
+session_exists = session_journal().exists() or (catalog is not None and catalog.has_session(active_session()))
 if session_exists and not st.session_state.session_loaded:
     st.warning("Se encontró una sesión guardada.")
     c1, c2 = st.columns(2)
     with c1:
         if st.button("Reabrir sesión", width="stretch"):
             load_session_state()
-            st.session_state.images = load_image_paths(st.session_state.source_dir)
+            reset_queue()
+            align_queue()
             st.session_state.session_loaded = True
             st.rerun()
     with c2:
         if st.button("Empezar desde cero", width="stretch"):
             reset_session_state()
-            st.session_state.images = load_image_paths(st.session_state.source_dir)
+            reset_queue()
             st.session_state.session_loaded = True
             st.rerun()
 else:
     if not st.session_state.session_loaded:
         load_session_state()
-        st.session_state.images = load_image_paths(st.session_state.source_dir)
+        reset_queue()
+        align_queue()
         st.session_state.session_loaded = True
 
+if st.session_state.session_loaded:
+    sync_session()
+    sync_images()
+
 
 # ---------------------------- Helpers acciones ----------------------------
 def can_advance() -> bool:
     return st.session_state.idx < len(st.session_state.images)
 
 
-def persist_if_needed() -> None:
-    save_session_state()
+@timed()
+def persist_decision(
+    action: str, name: str, idx_before: int, previous: Optional[str], batch: Optional[str] = None
+) -> None:
+    catalog = active_catalog()
+    if catalog is not None:
+        seq, version = catalog.record_decision(
+            st.session_state.source_dir,
+            st.session_state.mode,
+            action,
+            name,
+            ACTION_DECISION[action],
+            idx_before,
+            previous,
+            session=active_session(),
+            batch=batch,
+        )
+        st.session_state.history_seqs[-1] = seq
+        note_catalog_version(version)
+    elif batch is not None:
+        journal_record({"op": action, "name": name, "idx": idx_before, "batch": batch})
+    else:
+        journal_record({"op": action, "name": name, "idx": idx_before})
+
+
+def persist_undo(entry: Tuple, seq: Optional[int]) -> None:
+    catalog = active_catalog()
+    if catalog is not None:
+        previous = entry[3] if len(entry) > 3 else None
+        version = catalog.record_undo(
+            st.session_state.source_dir,
+            st.session_state.mode,
+            entry[1],
+            int(entry[2]),
+            previous,
+            session=active_session(),
+            seq=seq,
+        )
+        note_catalog_version(version)
+    else:
+        journal_record({"op": "undo"})
+
+
+def persist_meta() -> None:
+    catalog = active_catalog()
+    if catalog is not None:
+        version = catalog.update_session(
+            st.session_state.source_dir, st.session_state.mode, st.session_state.idx, session=active_session()
+        )
+        note_catalog_version(version)
+    else:
+        journal_record({"op": "meta", "mode": st.session_state.mode})
 
 
 def preload_next_image() -> None:
-    next_idx = st.session_state.idx + 1
-    if next_idx < len(st.session_state.images):
-        try:
-            Image.open(st.session_state.images[next_idx]).convert("RGB")
-        except OSError:
-            pass
+    images = st.session_state.images
+    idx = st.session_state.idx
+    ahead = images[idx : idx + 1 + PREFETCH_AHEAD]
+    behind = images[max(0, idx - PREFETCH_BEHIND) : idx]
+    get_prefetcher().schedule(ahead + behind[::-1], PREVIEW_WIDTH)
 
 
 def current_path() -> Optional[Path]:
@@ -283,12 +853,11 @@ def swipe_left() -> None:
     path = current_path()
     if not path:
         return
-    target = path.name
-    st.session_state.desechar.append(target)
-    st.session_state.history.append(("left", target, st.session_state.idx))
-    st.session_state.idx += 1
+    target = image_name(path)
+    idx_before = st.session_state.idx
+    apply_decision("left", target, idx_before)
     st.session_state.flash = "left"
-    persist_if_needed()
+    persist_decision("left", target, idx_before, st.session_state.history[-1][3])
     preload_next_image()
 
 
@@ -296,148 +865,441 @@ def swipe_right() -> None:
     path = current_path()
     if not path:
         return
-    target = path.name
-    st.session_state.mantener.append(target)
-    st.session_state.history.append(("right", target, st.session_state.idx))
-    st.session_state.idx += 1
+    target = image_name(path)
+    idx_before = st.session_state.idx
+    apply_decision("right", target, idx_before)
     st.session_state.flash = "right"
-    persist_if_needed()
+    persist_decision("right", target, idx_before, st.session_state.history[-1][3])
     preload_next_image()
 
 
 def undo_last() -> None:
-    if not st.session_state.history:
+    seqs = st.session_state.history_seqs
+    seq = seqs[-1] if seqs else None
+    entry = apply_undo()
+    if entry is None:
         return
-    action, target, idx_before = st.session_state.history.pop()
-    if action == "left":
-        if target in st.session_state.desechar:
-            st.session_state.desechar.remove(target)
-    elif action == "right":
-        if target in st.session_state.mantener:
-            st.session_state.mantener.remove(target)
-    st.session_state.idx = idx_before
+    persist_undo(entry, seq)
+    batch = entry[4] if len(entry) > 4 else None
+    history = st.session_state.history
+    while batch is not None and history and len(history[-1]) > 4 and history[-1][4] == batch:
+        seq = seqs[-1]
+        persist_undo(apply_undo(), seq)
     st.session_state.flash = None
-    persist_if_needed()
-
-def list_raw_matches(stem: str, source_dir: Path) -> List[Path]:
-    matches = []
-    for raw_ext in RAW_EXTS:
-        raw = source_dir / f"{stem}{raw_ext}"
-        if raw.exists():
-            matches.append(raw)
-    return matches
-
-
-def unique_destination(path: Path) -> Path:
-    if not path.exists():
-        return path
-    base = path.stem
-    ext = path.suffix
-    parent = path.parent
-    i = 1
-    while True:
-        candidate = parent / f"{base}_{i}{ext}"
-        if not candidate.exists():
-            return candidate
-        i += 1
-
-
-def build_transfer_plan() -> Tuple[List[Tuple[Path, Path]], Dict[str, List[str]]]:
-    source_dir = Path(st.session_state.source_dir)
-    plan = []
-    raw_report: Dict[str, List[str]] = {}
-
-    def add_file(src: Optional[Path], dst: Path):
-        if src and src.exists():
-            plan.append((src, dst))
-
-    for filename in st.session_state.mantener:
-        src = resolve_source_file(filename, source_dir)
-        dst = Path("keep") / filename
-        add_file(src, dst)
-        raw_matches = list_raw_matches(src.stem, source_dir) if src else []
-        raw_report[filename] = [p.name for p in raw_matches] if src else []
-        if len(raw_matches) > 1 and not st.session_state.include_ambiguous_raws:
-            continue
-        for raw in raw_matches:
-            add_file(raw, Path("keep") / raw.name)
-
-    for filename in st.session_state.desechar:
-        src = resolve_source_file(filename, source_dir)
-        dst = Path("discard") / filename
-        add_file(src, dst)
-        raw_matches = list_raw_matches(src.stem, source_dir) if src else []
-        raw_report[filename] = [p.name for p in raw_matches] if src else []
-        if len(raw_matches) > 1 and not st.session_state.include_ambiguous_raws:
+    preload_next_image()
+
+
+@timed("deck.apply")
+def apply_deck_batch() -> None:
+    # The browser already showed these; apply them in order and stop at the first
+    # one whose image is no longer current (another tab or a group action moved it)
+    value = st.session_state.get("review_deck") or {}
+    client = value.get("client")
+    if client is None:
+        return
+    if client != st.session_state.deck_client:
+        st.session_state.deck_client = client
+        st.session_state.deck_acked = 0
+    st.session_state.deck_sent = set(value.get("have", []))
+    n = int(value.get("n", 0))
+    if n <= st.session_state.deck_acked:
+        return
+    st.session_state.deck_acked = n
+    for op in value.get("ops", []):
+        action = op.get("op")
+        if action == "undo":
+            undo_last()
             continue
-        for raw in raw_matches:
-            add_file(raw, Path("discard") / raw.name)
+        path = current_path()
+        if action not in ACTION_DECISION or path is None or image_name(path) != op.get("name"):
+            break
+        idx_before = st.session_state.idx
+        apply_decision(action, op["name"], idx_before)
+        persist_decision(action, op["name"], idx_before, st.session_state.history[-1][3])
+        st.session_state.flash = action
+    preload_next_image()
 
-    return plan, raw_report
 
+@st.cache_data(show_spinner=False, max_entries=4 * DECK_AHEAD)
+def preview_data_uri(preview: str) -> str:
+    # Preview file names hash the source size and mtime, so the content never changes
+    mime = "image/webp" if preview.endswith(".webp") else "image/jpeg"
+    return f"data:{mime};base64," + base64.b64encode(Path(preview).read_bytes()).decode("ascii")
+
+
+def deck_item(path: Path, pos: int, current: bool) -> Dict:
+    item = {"name": image_name(path), "pos": pos, "key": None}
+    cache = get_preview_cache()
+    try:
+        # Only the current image may block on decoding; the rest come when cached
+        preview = preview_file(path) if current else cache.cached_path(path, PREVIEW_WIDTH)
+    except OSError:
+        item["error"] = True
+        return item
+    if not preview.exists():
+        return item
+    item["key"] = preview.stem
+    url = preview_url(preview)
+    if url is not None:
+        item["src"] = url
+    elif preview.stem not in st.session_state.deck_sent:
+        item["src"] = preview_data_uri(str(preview))
+        st.session_state.deck_sent.add(preview.stem)
+    return item
+
+
+@timed("deck.window")
+def deck_args() -> Dict:
+    images = st.session_state.images
+    idx = st.session_state.idx
+    window = images[idx : idx + 1 + DECK_AHEAD]
+    get_prefetcher().schedule(window, PREVIEW_WIDTH)
+    items = [deck_item(path, pos, pos == idx) for pos, path in enumerate(window, start=idx)]
+    # Where one undo lands: group actions go back to their first image
+    history = st.session_state.history
+    undo_to = None
+    if history:
+        first = len(history) - 1
+        batch = history[first][4] if len(history[first]) > 4 else None
+        while batch is not None and first > 0 and len(history[first - 1]) > 4 and history[first - 1][4] == batch:
+            first -= 1
+        undo_to = int(history[first][2])
+        if undo_to < len(images):
+            items.append(deck_item(images[undo_to], undo_to, False))
+    return {
+        "idx": idx,
+        "total": len(images),
+        "images": items,
+        "undo_to": undo_to,
+        "client": st.session_state.deck_client,
+        "acked": st.session_state.deck_acked,
+        "fit": st.session_state.fit_to_window,
+        "batch": DECK_BATCH,
+        "debounce_ms": DECK_DEBOUNCE_MS,
+        "low_water": DECK_LOW_WATER,
+    }
+
+
+@st.cache_resource(show_spinner=False)
+def get_similarity() -> SimilarityIndex:
+    return SimilarityIndex()
+
+
+def queue_infos(paths: List[Path]) -> List[FileInfo]:
+    index = media_index()
+    return [info for info in (index.files.get(index.name_of(p)) for p in paths) if info]
+
+
+def current_burst() -> List[Path]:
+    # Perceptual hashes are computed in a background process pool; until they
+    # are ready the queue simply shows single images.
+    infos = queue_infos(st.session_state.images)
+    similarity = get_similarity()
+    similarity.update_async(infos)
+    return burst_at(st.session_state.images, st.session_state.idx, similarity.clusters(infos))
+
+
+def apply_batch(actions: List[str], batch: str) -> None:
+    # One decision per queue position from idx on, recorded like swipe_left/right
+    # and sharing a batch id so undo_last reverts the group in one step
+    idx_before = st.session_state.idx
+    for offset, action in enumerate(actions):
+        target = image_name(st.session_state.images[idx_before + offset])
+        apply_decision(action, target, idx_before + offset, batch)
+        persist_decision(action, target, idx_before + offset, st.session_state.history[-1][3], batch)
+    preload_next_image()
+
+
+def keep_best_of_burst(members: List[Path], best: str) -> None:
+    if members[:1] != [current_path()]:
+        return  # stale widget from a previous rerun
+    actions = ["right" if image_name(path) == best else "left" for path in members]
+    apply_batch(actions, f"burst:{image_name(members[0])}:{st.session_state.idx}")
+    st.session_state.flash = "right"
+
+
+@st.cache_resource(show_spinner=False)
+def get_scores() -> ScoreIndex:
+    return ScoreIndex()
+
+
+def current_suspects() -> Dict[Path, Score]:
+    infos = queue_infos(st.session_state.images[st.session_state.idx :])
+    scores = get_scores()
+    scores.update_async(infos)
+    return scores.suspects(infos, st.session_state.sharpness_threshold, st.session_state.clipping_threshold)
+
+
+def review_suspects_first() -> None:
+    # Only the pending tail moves; decided positions stay where they are
+    idx = st.session_state.idx
+    st.session_state.images[idx:] = suspects_first(st.session_state.images[idx:], current_suspects())
+    preload_next_image()
 
-def total_size_bytes(pairs: List[Tuple[Path, Path]]) -> int:
-    total = 0
-    for src, _ in pairs:
-        try:
-            total += src.stat().st_size
-        except OSError:
-            pass
-    return total
 
+def apply_queue_view(sort: str, queue_filter: QueueFilter) -> None:
+    # Only the pending tail changes, together with whatever an earlier filter held back
+    idx = st.session_state.idx
+    pending = st.session_state.images[idx:] + st.session_state.held_back
+    shown, held = filter_paths(pending, queue_filter)
+    if sort == "taken":
+        index = media_index()
+        metadata = get_metadata()
 
-def format_bytes(num: int) -> str:
-    for unit in ["B", "KB", "MB", "GB", "TB"]:
-        if num < 1024:
-            return f"{num:.1f} {unit}"
-        num /= 1024
-    return f"{num:.1f} PB"
+        def key(path: Path) -> Tuple[str, str]:
+            info = index.files.get(index.name_of(path))
+            return capture_time(metadata.get(info), info) if info is not None else "", image_name(path).lower()
 
+        shown.sort(key=key)
+    else:
+        shown.sort(key=lambda path: image_name(path).lower())
+    st.session_state.images[idx:] = shown
+    st.session_state.held_back = held
+    st.session_state.queue_filter = queue_filter
+    st.session_state.queue_sort = sort
+    preload_next_image()
+
+
+def queue_choices() -> Tuple[List[str], List[str]]:
+    # Cameras and lenses in the folder; headers are read in the background
+    metadata = get_metadata()
+    key = (len(st.session_state.images), len(st.session_state.held_back), metadata.version)
+    cached = st.session_state.get("queue_choices")
+    if cached is None or cached[0] != key:
+        infos = queue_infos(st.session_state.images + st.session_state.held_back)
+        metadata.update_async(infos)
+        cached = (key, metadata.values(infos))
+        st.session_state.queue_choices = cached
+    return cached[1]
 
+
+def discard_suspects() -> None:
+    suspects = current_suspects()
+    if not suspects:
+        return
+    review_suspects_first()
+    apply_batch(["left"] * len(suspects), f"suspects:{st.session_state.idx}:{len(suspects)}")
+    st.session_state.flash = "left"
+
+
+def grid_page() -> List[Path]:
+    idx = st.session_state.idx
+    return st.session_state.images[idx : idx + st.session_state.grid_page_size]
+
+
+def grid_key(path: Path) -> str:
+    return f"grid_sel_{image_name(path)}"
+
+
+def decide_grid(selected_action: str, rest_action: Optional[str] = None) -> None:
+    # Marked images move to the front of the page so the batch covers consecutive
+    # positions; with rest_action the whole page is decided at once.
+    page = grid_page()
+    selected = [p for p in page if st.session_state.get(grid_key(p))]
+    others = [p for p in page if not st.session_state.get(grid_key(p))]
+    idx = st.session_state.idx
+    st.session_state.images[idx : idx + len(page)] = selected + others
+    actions = [selected_action] * len(selected)
+    if rest_action is not None:
+        actions += [rest_action] * len(others)
+    if actions:
+        apply_batch(actions, f"grid:{idx}:{len(actions)}")
+    for path in selected:
+        st.session_state.pop(grid_key(path), None)
+
+def merged_decisions() -> MergeResult:
+    catalog = active_catalog()
+    reviewers = list_reviewers(catalog)
+    signature = sessions_signature(reviewers, catalog)
+    cached = st.session_state.get("merged")
+    if cached is None or cached[0] != signature:
+        cached = (signature, merge_sessions(reviewers, catalog))
+        st.session_state.merged = cached
+    return cached[1]
+
+
+def switch_reviewer(reviewer: str) -> None:
+    st.session_state.reviewer = reviewer
+    if reviewer:
+        st.query_params["revisor"] = reviewer
+    else:
+        st.query_params.pop("revisor", None)
+    # The next rerun loads (or offers to reopen) this reviewer's own session
+    st.session_state.idx = 0
+    st.session_state.decisions = DecisionStore()
+    st.session_state.history = []
+    st.session_state.history_seqs = []
+    st.session_state.plan = None
+    st.session_state.journal_seq = 0
+    st.session_state.own_seqs = set()
+    st.session_state.catalog_version = 0
+    st.session_state.session_loaded = False
+
+
+def shard_folder(names: str) -> None:
+    reviewers = [reviewer_slug(name) for name in names.split(",") if reviewer_slug(name)]
+    if not reviewers:
+        st.warning("Escribe al menos un nombre de revisor.")
+        return
+    scanner = media_scanner()
+    # Ranges index the complete review order, identical for every reviewer
+    scanner.wait_done()
+    assign_shards(st.session_state.source_dir, [image_name(path) for path in scanner.order], reviewers)
+    reset_queue()
+    align_queue()
+
+
+@timed()
+def current_plan() -> TransferPlan:
+    # Full rebuild only when the folder contents or the ambiguous-RAW option change,
+    # or, for the combined plan, when any reviewer's session does
+    scanner = media_scanner()
+    include_ambiguous = st.session_state.include_ambiguous_raws
+    source = merged_decisions() if st.session_state.combine_reviewers else None
+    plan = st.session_state.get("plan")
+    if (
+        plan is None
+        or st.session_state.get("plan_source") is not source
+        or not plan.matches(scanner.index, include_ambiguous, scanner.generation)
+    ):
+        rows = source.decisions if source is not None else st.session_state.decisions.items()
+        with span("plan.rebuild"):
+            plan = TransferPlan.build(scanner.index, rows, include_ambiguous, scanner.generation)
+        st.session_state.plan = plan
+        st.session_state.plan_source = source
+    return plan
+
+
+@st.cache_resource(show_spinner=False)
+def get_content_hashes() -> ContentHashes:
+    return ContentHashes()
+
+
+@timed("dedup")
+def dedup_plan(plan: TransferPlan) -> Tuple[List[PlanEntry], DedupReport]:
+    # Moves are renames, so only copies are deduplicated
+    policy = st.session_state.dedup if st.session_state.mode == "copy" else DEDUP_OFF
+    entries, report = dedup_entries(list(plan.entries()), get_content_hashes(), policy, workers=TRANSFER_WORKERS)
+    st.session_state.dedup_report = (plan, plan.version, policy, report)
+    return entries, report
+
+
+def current_dedup_report(plan: TransferPlan) -> Optional[DedupReport]:
+    cached = st.session_state.get("dedup_report")
+    if cached is None or cached[0] is not plan or cached[1] != plan.version or cached[2] != st.session_state.dedup:
+        return None
+    return cached[3]
+
+
+@timed()
+def disk_impact(plan: TransferPlan, report: Optional[DedupReport]) -> Tuple[int, bool]:
+    # Bytes the copy will really allocate: minus duplicates, minus clones/hardlinks.
+    # False while reflink/hardlink support is unknown: the total is an upper bound.
+    strategy = st.session_state.copy_strategy
+    key = (plan.version, strategy, id(report), support_version())
+    cached = st.session_state.get("disk_impact")
+    if cached is not None and cached[0] is plan and cached[1] == key:
+        return cached[2]
+    excluded = set()
+    if report is not None:
+        excluded = {entry.src for entry in report.skipped + report.linked}
+    entries = [entry for entry in plan.entries() if entry.src not in excluded]
+    impact = extra_bytes(entries, strategy)
+    st.session_state.disk_impact = (plan, key, impact)
+    return impact
+
+
+@timed("transfer")
 def apply_action() -> None:
     if not st.session_state.confirm_move:
         st.warning("Confirma la casilla antes de ejecutar.")
         return
 
-    keep_path = Path("keep")
-    discard_path = Path("discard")
-    keep_path.mkdir(parents=True, exist_ok=True)
-    discard_path.mkdir(parents=True, exist_ok=True)
-
-    for file in st.session_state.mantener:
-        src = Path("media") / f"{file}.jpg"
-        src2 = Path("media") / f"{file}.png"
-        src3 = Path("media") / f"{file}.jpeg"
-        raw = Path("media") / f"{file}.{raw_type}"
-        dst = keep_path / f"{file}.jpg"
-        raw_dst = keep_path / f"{file}.{raw_type}"
-        srcs = [src, src2, src3]
-        for src in srcs:
-            if src.exists():
-                dst.parent.mkdir(parents=True, exist_ok=True)
-                shutil.move(str(src), str(dst))
-        if raw.exists():
-            raw_dst.parent.mkdir(parents=True, exist_ok=True)
-            shutil.move(str(raw), str(raw_dst))
-
-    for file in st.session_state.desechar:
-        src = Path("media") / f"{file}.jpg"
-        src2 = Path("media") / f"{file}.png"
-        src3 = Path("media") / f"{file}.jpeg"
-        dst = discard_path / f"{file}.jpg"
-        raw = Path("media") / f"{file}.{raw_type}"
-        raw_dst = discard_path / f"{file}.{raw_type}"
-        srcs = [src, src2, src3]
-        for src in srcs:
-            if src.exists():
-                dst.parent.mkdir(parents=True, exist_ok=True)
-                shutil.move(str(src), str(dst))
-        if raw.exists():
-            raw_dst.parent.mkdir(parents=True, exist_ok=True)
-            shutil.move(str(raw), str(raw_dst))
+    plan = current_plan()
+    with st.spinner("Buscando duplicados exactos…"):
+        entries, report = dedup_plan(plan)
+    if report.skipped or report.linked:
+        st.info(
+            f"Duplicados: {len(report.skipped)} omitidos y {len(report.linked)} enlazados "
+            f"({format_bytes(report.saved_bytes)} sin copiar)."
+        )
+    engine = TransferEngine(
+        entries, st.session_state.mode, workers=TRANSFER_WORKERS, strategy=st.session_state.copy_strategy
+    )
+    bar = st.progress(0.0, text="Preparando transferencia…")
+    last_update = [0.0]
+
+    def on_progress(p: TransferProgress) -> None:
+        now = time.monotonic()
+        finished = p.files_done + p.failed >= p.files_total
+        if not finished and now - last_update[0] < 0.25:
+            return
+        last_update[0] = now
+        fraction = p.bytes_done / p.bytes_total if p.bytes_total else 1.0
+        eta = format_duration(p.eta) if p.eta is not None else "—"
+        bar.progress(
+            min(fraction, 1.0),
+            text=(
+                f"{p.files_done}/{p.files_total} archivos · "
+                f"{format_bytes(p.bytes_done)} de {format_bytes(p.bytes_total)} · "
+                f"{p.files_per_sec:.1f} archivos/s · {format_bytes(p.bytes_per_sec)}/s · ETA {eta}"
+            ),
+        )
+
+    with span("transfer.run"):
+        result = engine.run(on_progress)
+    catalog = active_catalog()
+    if catalog is not None:
+        catalog.record_transfer(result.plan_id, result.mode, result.done, result.failed)
+    st.session_state.last_action = {
+        "mode": result.mode,
+        "plan_id": result.plan_id,
+        "journal": str(result.journal),
+        "items": [(str(src), str(dst)) for src, dst in result.done],
+        "failed": [(str(src), error) for src, error in result.failed],
+    }
+    if result.resumed:
+        st.info(f"Reanudado: {result.resumed} archivos ya estaban transferidos.")
+    if result.failed:
+        st.error(f"{len(result.failed)} archivos fallaron. Detalle en {result.journal}")
+    verb = "copiados" if result.mode == "copy" else "movidos"
+    st.success(f"{len(result.done) - result.resumed} archivos {verb}.")
+    methods = result.methods or {}
+    if methods.get(COPY_REFLINK) or methods.get(COPY_HARDLINK):
+        st.caption(
+            f"{methods.get(COPY_REFLINK, 0)} clonados (reflink), {methods.get(COPY_HARDLINK, 0)} enlazados (hardlink), "
+            f"{methods.get(COPY_FULL, 0)} copiados byte a byte."
+        )
+
+
+@timed("cleanup_originals")
+def run_cleanup_originals() -> None:
+    last_action = st.session_state.last_action
+    if not st.session_state.confirm_cleanup:
+        st.warning("Confirma la casilla antes de limpiar originales.")
+        return
+    with st.spinner("Verificando copias…"):
+        result = cleanup_originals(
+            last_action["items"],
+            check_hash=st.session_state.cleanup_hash,
+            workers=TRANSFER_WORKERS,
+        )
+    last_action["cleaned"] = True
+    st.table(
+        [
+            {"Resultado": "Verificados", "Archivos": str(result.verified)},
+            {"Resultado": "Movidos a discard/_originals", "Archivos": str(len(result.moved))},
+            {"Resultado": "Omitidos (ya no están en origen)", "Archivos": str(len(result.skipped))},
+            {"Resultado": "Fallidos", "Archivos": str(len(result.failed))},
+        ]
+    )
+    if result.failed:
+        st.code("\n".join(f"{src}: {error}" for src, error in result.failed), language="text")
+
 
 # ---------------------------- UI ----------------------------
 st.title("Keep or Discard")
+probe_preview_server()
 
 imgs = st.session_state.images
 total = len(imgs)
@@ -450,16 +1312,18 @@ with c1:
     )
 with c2:
     st.markdown(
-        f"<div class='counter'>❤️ {len(st.session_state.mantener)}</div>",
+        f"<div class='counter'>❤️ {st.session_state.decisions.count(KEEP)}</div>",
         unsafe_allow_html=True,
     )
 with c3:
     st.markdown(
-        f"<div class='counter'>❌ {len(st.session_state.desechar)}</div>",
+        f"<div class='counter'>❌ {st.session_state.decisions.count(DISCARD)}</div>",
         unsafe_allow_html=True,
     )
 with c4:
     st.markdown(f"<div class='counter'>📍 {pos}/{total}</div>", unsafe_allow_html=True)
+if not media_scanner().done.is_set():
+    st.caption("Indexando subcarpetas en segundo plano; las nuevas imágenes se añaden al final de la cola.")
 
 st.write("---")
 
@@ -467,40 +1331,339 @@ with st.expander("⚙️ Preferencias rápidas"):
     st.session_state.fit_to_window = st.checkbox(
         "Ajustar imagen a ventana", value=st.session_state.fit_to_window
     )
+    st.session_state.review_mode = st.selectbox(
+        "Vista de revisión",
+        options=["card", "grid"],
+        format_func=lambda x: "Una imagen" if x == "card" else "Cuadrícula (hoja de contactos)",
+        index=0 if st.session_state.review_mode == "card" else 1,
+    )
+    if st.session_state.review_mode == "card":
+        st.session_state.deck = st.checkbox(
+            "Decidir en el navegador (guarda por lotes)",
+            value=st.session_state.deck,
+            help="Las decisiones se aplican al instante en el navegador y se envían en grupos, "
+            "sin recargar la página en cada tecla.",
+        )
+    if st.session_state.review_mode == "grid":
+        st.session_state.grid_page_size = st.slider(
+            "Imágenes por página", min_value=24, max_value=64, step=6, value=st.session_state.grid_page_size
+        )
     st.session_state.dry_run = st.checkbox(
         "Modo simulación (no mover archivos)", value=st.session_state.dry_run
     )
-    st.session_state.mode = st.selectbox(
+    mode = st.selectbox(
         "Modo de acción",
         options=["copy", "move"],
         format_func=lambda x: "Copiar a keep/discard" if x == "copy" else "Mover a keep/discard",
         index=0 if st.session_state.mode == "copy" else 1,
     )
+    if mode != st.session_state.mode:
+        st.session_state.mode = mode
+        persist_meta()
+    if st.session_state.mode == "copy":
+        st.session_state.dedup = st.selectbox(
+            "Archivos idénticos (por contenido)",
+            options=list(DEDUP_MODES),
+            format_func=lambda x: {
+                DEDUP_OFF: "Copiar siempre",
+                DEDUP_SKIP: "Omitir si ya están en el destino",
+                DEDUP_LINK: "Enlazar (hardlink) en lugar de copiar",
+            }[x],
+            index=DEDUP_MODES.index(st.session_state.dedup),
+        )
+        st.session_state.copy_strategy = st.selectbox(
+            "Cómo copiar",
+            options=list(COPY_STRATEGIES),
+            format_func=lambda x: {
+                COPY_FULL: "Copia completa",
+                COPY_REFLINK: "Clon reflink (btrfs/XFS) o copia",
+                COPY_HARDLINK: "Hardlink, clon o copia",
+            }[x],
+            index=COPY_STRATEGIES.index(st.session_state.copy_strategy),
+            help="Clones y hardlinks no ocupan espacio extra; se usan solo si origen y destino "
+            "están en el mismo sistema de archivos y, si no, se copia archivo por archivo.",
+        )
     st.session_state.include_ambiguous_raws = st.checkbox(
         "Incluir RAWs cuando hay múltiples coincidencias",
         value=st.session_state.include_ambiguous_raws,
     )
+    st.session_state.group_bursts = st.checkbox(
+        "Agrupar ráfagas y casi duplicados", value=st.session_state.group_bursts
+    )
+    st.session_state.watch_media = st.checkbox(
+        "Vigilar la carpeta y añadir fotos nuevas (sesión en directo)",
+        value=st.session_state.watch_media,
+        help="Las fotos que llegan a la carpeta (por ejemplo, disparando con cable) se añaden al final "
+        "de la cola cuando terminan de escribirse, y su vista previa se prepara en segundo plano.",
+    )
     st.session_state.confirm_move = st.checkbox(
         "Confirmo que quiero ejecutar la acción", value=st.session_state.confirm_move
     )
+    use_catalog = st.checkbox(
+        "Usar catálogo SQLite (.keep_or_discard/catalog.sqlite3)", value=st.session_state.use_catalog
+    )
+    if use_catalog != st.session_state.use_catalog:
+        st.session_state.use_catalog = use_catalog
+        if use_catalog:
+            save_catalog_session(get_catalog())
+        else:
+            # Hand the full session back to the JSON journal
+            save_session_state()
     if st.button("Reiniciar sesión", width="stretch"):
         if st.session_state.session_loaded:
             reset_session_state()
             st.rerun()
+    stats = get_prefetcher().stats()
+    st.caption(
+        f"Precarga: {stats['hits']} aciertos · {stats['late_hits']} en curso · "
+        f"{stats['misses']} fallos · {stats['cached']} en memoria"
+    )
+
+if st.session_state.watch_media:
+    get_watcher(st.session_state.source_dir).start()
+    watch_status()
+elif get_watcher(st.session_state.source_dir).running:
+    get_watcher(st.session_state.source_dir).stop()
+
+with st.expander("🔎 Sospechosos (desenfoque / exposición)"):
+    if not scoring_available():
+        st.caption("Falta NumPy: ejecuta `uv sync` (o `pip install numpy`) para puntuar nitidez y exposición.")
+    else:
+        st.session_state.score_images = st.checkbox(
+            "Puntuar nitidez y exposición en segundo plano", value=st.session_state.score_images
+        )
+        if st.session_state.score_images:
+            st.session_state.sharpness_threshold = st.slider(
+                "Nitidez mínima (varianza del Laplaciano)",
+                min_value=0.0,
+                max_value=500.0,
+                value=float(st.session_state.sharpness_threshold),
+                step=5.0,
+            )
+            st.session_state.clipping_threshold = st.slider(
+                "Máximo de píxeles negros o quemados",
+                min_value=0.05,
+                max_value=1.0,
+                value=float(st.session_state.clipping_threshold),
+                step=0.05,
+            )
+            suspects = current_suspects()
+            if get_scores().busy:
+                st.caption("Puntuando imágenes en segundo plano…")
+            pending = len(st.session_state.images) - st.session_state.idx
+            st.caption(f"{len(suspects)} sospechosos entre {pending} pendientes.")
+            s1, s2 = st.columns(2)
+            with s1:
+                if st.button(
+                    "Revisar sospechosos primero",
+                    width="stretch",
+                    key="btn_suspects_first",
+                    disabled=not suspects,
+                    on_click=review_suspects_first,
+                ):
+                    st.rerun()
+            with s2:
+                if st.button(
+                    f"Descartar todos los sospechosos ({len(suspects)})",
+                    width="stretch",
+                    key="btn_discard_suspects",
+                    disabled=not suspects,
+                    on_click=discard_suspects,
+                ):
+                    st.rerun()
+
+with st.expander("🗂️ Orden y filtros de la cola"):
+    cameras, lenses = queue_choices()
+    if get_metadata().busy:
+        st.caption("Leyendo cabeceras EXIF en segundo plano…")
+    current_filter = st.session_state.queue_filter
+    queue_sort = st.selectbox(
+        "Ordenar las pendientes por",
+        options=["name", "taken"],
+        format_func=lambda x: "Nombre de archivo" if x == "name" else "Fecha de captura (EXIF)",
+        index=0 if st.session_state.queue_sort == "name" else 1,
+    )
+    q1, q2 = st.columns(2)
+    with q1:
+        chosen_cameras = st.multiselect(
+            "Cámara", options=cameras, default=[c for c in current_filter.cameras if c in cameras]
+        )
+        date_from = st.date_input(
+            "Desde",
+            value=datetime.strptime(current_filter.date_from, "%Y:%m:%d").date() if current_filter.date_from else None,
+        )
+    with q2:
+        chosen_lenses = st.multiselect(
+            "Objetivo", options=lenses, default=[lens for lens in current_filter.lenses if lens in lenses]
+        )
+        date_to = st.date_input(
+            "Hasta",
+            value=datetime.strptime(current_filter.date_to, "%Y:%m:%d").date() if current_filter.date_to else None,
+        )
+    shape_options = [None, *SHAPES]
+    shape = st.selectbox(
+        "Orientación",
+        options=shape_options,
+        format_func=lambda x: {
+            None: "Todas",
+            SHAPE_LANDSCAPE: "Horizontal",
+            SHAPE_PORTRAIT: "Vertical",
+            SHAPE_SQUARE: "Cuadrada",
+        }[x],
+        index=shape_options.index(current_filter.shape),
+    )
+    queue_filter = QueueFilter(
+        tuple(chosen_cameras),
+        tuple(chosen_lenses),
+        date_from.strftime("%Y:%m:%d") if date_from else None,
+        date_to.strftime("%Y:%m:%d") if date_to else None,
+        shape,
+    )
+    f1, f2 = st.columns(2)
+    with f1:
+        if st.button(
+            "Aplicar a las pendientes",
+            width="stretch",
+            key="btn_queue_view",
+            on_click=apply_queue_view,
+            args=(queue_sort, queue_filter),
+        ):
+            st.rerun()
+    with f2:
+        if st.button(
+            "Quitar filtros",
+            width="stretch",
+            key="btn_queue_clear",
+            disabled=not current_filter.active and not st.session_state.held_back,
+            on_click=apply_queue_view,
+            args=(queue_sort, QueueFilter()),
+        ):
+            st.rerun()
+    if st.session_state.held_back:
+        st.caption(f"{len(st.session_state.held_back)} imágenes pendientes ocultas por el filtro.")
+
+with st.expander("👥 Revisores y reparto"):
+    reviewer = reviewer_slug(
+        st.text_input("Tu nombre de revisor (vacío = sesión compartida)", value=st.session_state.reviewer)
+    )
+    if reviewer != st.session_state.reviewer:
+        switch_reviewer(reviewer)
+        st.rerun()
+    st.caption(
+        "Cada revisor guarda su sesión en `.keep_or_discard/sessions/<nombre>/`; "
+        "cada uno puede abrir la app con `?revisor=<nombre>` en la URL."
+    )
+    shard = st.session_state.shard
+    if shard is not None:
+        st.caption(f"Tu parte: imágenes {shard.start + 1}–{shard.end} de {shard.total}.")
+        order = media_scanner().order
+        first = image_name(order[shard.start]) if shard.start < len(order) else None
+        if len(order) != shard.total or first != shard.first:
+            st.warning("La carpeta cambió desde el reparto; vuelve a repartirla si faltan imágenes.")
+    shard_names = st.text_input("Repartir la carpeta entre (nombres separados por comas)", key="shard_names")
+    r1, r2 = st.columns(2)
+    with r1:
+        if st.button("Repartir por rangos", width="stretch", key="btn_shard", disabled=not shard_names.strip()):
+            shard_folder(shard_names)
+            st.rerun()
+    with r2:
+        if st.button(
+            "Quitar reparto",
+            width="stretch",
+            key="btn_unshard",
+            disabled=not load_shards(st.session_state.source_dir),
+        ):
+            clear_shards()
+            reset_queue()
+            align_queue()
+            st.rerun()
+    combine = st.checkbox("Plan combinado de todos los revisores", value=st.session_state.combine_reviewers)
+    if combine != st.session_state.combine_reviewers:
+        st.session_state.combine_reviewers = combine
+        st.session_state.plan = None
+    if st.session_state.combine_reviewers:
+        merged = merged_decisions()
+        st.caption(" · ".join(f"{reviewer_label(r)}: {n} decisiones" for r, n in merged.counts.items()))
+        if merged.conflicts:
+            st.warning(f"{len(merged.conflicts)} imágenes con decisiones distintas; en el plan se mantienen.")
+            st.code(
+                "\n".join(
+                    f"{name}: " + ", ".join(f"{reviewer_label(r)}={d}" for r, d in votes.items())
+                    for name, votes in list(merged.conflicts.items())[:20]
+                ),
+                language="text",
+            )
 
 if total == 0:
     st.info("No se encontraron imágenes en `./media`. Añade archivos .jpg/.png/.webp y recarga.")
+elif st.session_state.review_mode == "grid":
+    page = grid_page()
+    if not page:
+        st.success("Has terminado 🎉. Revisa/descarga las listas o usa **Deshacer**.")
+        if st.button("Deshacer", width="stretch", key="btn_undo", disabled=not st.session_state.history, on_click=undo_last):
+            st.rerun()
+    else:
+        # One batch through the preview cache: only uncached thumbnails are decoded
+        thumbs = get_preview_cache().get_many(page, GRID_THUMB_WIDTH)
+        first = st.session_state.idx + 1
+        st.caption(f"Imágenes {first}–{first + len(page) - 1} de {total}. Marca las que quieras separar del resto.")
+        for start in range(0, len(page), GRID_COLUMNS):
+            cols = st.columns(GRID_COLUMNS)
+            for col, path, thumb in zip(cols, page[start : start + GRID_COLUMNS], thumbs[start : start + GRID_COLUMNS]):
+                with col:
+                    if thumb is None:
+                        st.caption("⚠️ sin vista previa")
+                    else:
+                        st.image(preview_url(thumb) or str(thumb), width="stretch")
+                    st.checkbox(image_name(path), key=grid_key(path))
+        g1, g2, g3, g4 = st.columns(4)
+        with g1:
+            if st.button(
+                "Desechar marcadas", width="stretch", key="btn_grid_left", on_click=decide_grid, args=("left",)
+            ):
+                st.rerun()
+        with g2:
+            if st.button(
+                "Deshacer",
+                width="stretch",
+                key="btn_undo",
+                disabled=(len(st.session_state.history) == 0),
+                on_click=undo_last,
+            ):
+                st.rerun()
+        with g3:
+            if st.button(
+                "Mantener marcadas", width="stretch", key="btn_grid_right", on_click=decide_grid, args=("right",)
+            ):
+                st.rerun()
+        with g4:
+            if st.button(
+                "Cerrar página (marcadas ✗ · resto ✓)",
+                width="stretch",
+                key="btn_grid_page",
+                on_click=decide_grid,
+                args=("left", "right"),
+            ):
+                st.rerun()
 else:
     path = current_path()
-    if path is None:
+    if st.session_state.deck:
+        review_deck(**deck_args(), key="review_deck", on_change=apply_deck_batch, default=None)
+    elif path is None:
         st.success("Has terminado 🎉. Revisa/descarga las listas o usa **Deshacer**.")
     else:
-        img = open_image(path)
-        img = ImageOps.exif_transpose(img)
-        if st.session_state.fit_to_window:
-            st.image(img, width="stretch", caption=f"{path.name}")
+        name = image_name(path)
+        try:
+            img = image_source(path)
+        except OSError:
+            img = None
+        preload_next_image()
+        if img is None:
+            st.warning(f"No se pudo abrir `{name}`; puede que se haya movido o borrado.")
+        elif st.session_state.fit_to_window:
+            st.image(img, width="stretch", caption=name)
         else:
-            st.image(img, caption=f"{path.name}")
+            st.image(img, caption=name)
 
         st.caption("Atajos: ←/A = Desechar · →/D/Espacio = Mantener · U/Z = Deshacer")
 
@@ -532,43 +1695,94 @@ else:
             ):
                 st.rerun()
 
+    if path is not None and st.session_state.group_bursts:
+        members = current_burst()
+        if get_similarity().busy:
+            st.caption("Calculando huellas perceptuales en segundo plano…")
+        if members:
+            shown = members[:BURST_MAX_SHOWN]
+            st.markdown(f"**Ráfaga de {len(members)} fotos**")
+            if len(members) > len(shown):
+                st.caption(f"Mostrando {len(shown)} de {len(members)}.")
+            cols = st.columns(min(len(shown), 4))
+            for i, member in enumerate(shown):
+                with cols[i % len(cols)]:
+                    try:
+                        st.image(image_source(member, BURST_THUMB_WIDTH), caption=image_name(member), width="stretch")
+                    except OSError:
+                        st.caption(image_name(member))
+            # Largest file as the default pick: more detail usually compresses worse
+            index = media_index()
+            sizes = [index.size_of(member) or 0 for member in members]
+            best = st.selectbox(
+                "Mejor foto",
+                options=[image_name(member) for member in members],
+                index=sizes.index(max(sizes)),
+                key=f"burst_best_{st.session_state.idx}",
+            )
+            if st.button(
+                f"Conservar la mejor y descartar el resto ({len(members) - 1})",
+                width="stretch",
+                key="btn_burst",
+                on_click=keep_best_of_burst,
+                args=(members, best),
+            ):
+                st.rerun()
+
 st.subheader("Resumen previo")
-    plan, raw_report = build_transfer_plan()
-keep_count = len(st.session_state.mantener)
-discard_count = len(st.session_state.desechar)
-total_files = len(plan)
-size_bytes = total_size_bytes(plan)
+plan = current_plan()
+if st.session_state.combine_reviewers:
+    st.caption(f"Plan combinado de {len(merged_decisions().counts)} sesiones de revisión.")
+keep_count = st.session_state.decisions.count(KEEP)
+discard_count = st.session_state.decisions.count(DISCARD)
+total_files = plan.total_files
+size_bytes = plan.total_bytes
+dedup_active = st.session_state.mode == "copy" and st.session_state.dedup != DEDUP_OFF
+dedup_report = current_dedup_report(plan) if dedup_active else None
+impact_exact = True
+if st.session_state.mode == "copy" and (dedup_report is not None or st.session_state.copy_strategy != COPY_FULL):
+    size_bytes, impact_exact = disk_impact(plan, dedup_report)
 impact = format_bytes(size_bytes) if st.session_state.mode == "copy" else "0 B"
-    st.table(
-        [
-            {"Métrica": "Mantener", "Valor": str(keep_count)},
-            {"Métrica": "Desechar", "Valor": str(discard_count)},
-            {"Métrica": "Archivos a procesar (incl. RAW)", "Valor": str(total_files)},
-            {"Métrica": "Impacto estimado en disco", "Valor": str(impact)},
-        ]
+if not impact_exact:
+    # Clones and hardlinks are only counted once a copy has tried them on this disk
+    impact = f"hasta {impact}"
+summary_rows = [
+    {"Métrica": "Mantener", "Valor": str(keep_count)},
+    {"Métrica": "Desechar", "Valor": str(discard_count)},
+    {"Métrica": "Archivos a procesar (incl. RAW)", "Valor": str(total_files)},
+    {"Métrica": "Impacto estimado en disco", "Valor": str(impact)},
+]
+if dedup_report is not None:
+    summary_rows.append(
+        {
+            "Métrica": "Duplicados exactos (omitidos / enlazados)",
+            "Valor": f"{len(dedup_report.skipped)} / {len(dedup_report.linked)}",
+        }
     )
-    if (keep_count + discard_count) > 0 and total_files == 0:
-        st.warning("No se encontraron archivos para procesar. Revisa extensiones o sesión guardada.")
+st.table(summary_rows)
+if dedup_active and dedup_report is None and total_files:
+    if st.button("Buscar duplicados exactos", width="stretch", key="btn_dedup"):
+        with st.spinner("Comparando tamaños y hashes…"):
+            dedup_plan(plan)
+        st.rerun()
+if (keep_count + discard_count) > 0 and total_files == 0:
+    st.warning("No se encontraron archivos para procesar. Revisa extensiones o sesión guardada.")
 
 with st.expander("Ver ejemplos y RAWs detectados"):
     st.write("Ejemplos Mantener:")
-    if st.session_state.mantener:
-        st.code("\n".join(st.session_state.mantener[:5]), language="text")
+    if keep_count:
+        st.code("\n".join(st.session_state.decisions.head(KEEP, 5)), language="text")
     else:
         st.caption("Vacío.")
     st.write("Ejemplos Desechar:")
-    if st.session_state.desechar:
-        st.code("\n".join(st.session_state.desechar[:5]), language="text")
+    if discard_count:
+        st.code("\n".join(st.session_state.decisions.head(DISCARD, 5)), language="text")
     else:
         st.caption("Vacío.")
     st.write("RAWs detectados por archivo:")
-    if raw_report:
-        lines = []
-        for k, v in raw_report.items():
-            if v:
-                lines.append(f"{k}: {', '.join(v)}")
-        if lines:
-            st.code("\n".join(lines), language="text")
+    if keep_count + discard_count:
+        if plan.raw_report:
+            st.code(plan.raw_report_text(), language="text")
         else:
             st.caption("No se detectaron RAWs.")
     else:
@@ -578,30 +1792,37 @@ if st.session_state.dry_run:
     st.warning("Modo simulación activo. Desactívalo para copiar o mover archivos.")
 
 disable_execute = st.session_state.dry_run or (total_files == 0) or (not st.session_state.confirm_move)
-st.button("Ejecutar acción", width="stretch", on_click=apply_action, disabled=disable_execute)
+if st.button("Ejecutar acción", width="stretch", disabled=disable_execute):
+    apply_action()
 
-if st.session_state.last_action and st.session_state.last_action.get("mode") == "copy":
+last_action = st.session_state.last_action
+if last_action and last_action.get("mode") == "copy" and not last_action.get("cleaned"):
     st.session_state.confirm_cleanup = st.checkbox(
         "Confirmo que quiero limpiar originales (se moverán a discard/_originals)",
         value=st.session_state.confirm_cleanup,
     )
-    st.button("Limpiar originales", width="stretch", on_click=cleanup_originals)
+    st.session_state.cleanup_hash = st.checkbox(
+        "Verificar también el contenido (hash, más lento)",
+        value=st.session_state.cleanup_hash,
+    )
+    if st.button("Limpiar originales", width="stretch", disabled=not st.session_state.confirm_cleanup):
+        run_cleanup_originals()
 
 st.write("")
 
 with st.expander("📋 Ver lista MANTENER (archivos)"):
-    mantener = st.session_state.mantener
-    if mantener:
-        st.code("\n".join(mantener), language="text")
-    else:
+    if not keep_count:
         st.caption("Vacío.")
+    # Collapsed expanders still run: join and send the list only when asked for
+    elif st.checkbox("Mostrar la lista", key="show_keep_list"):
+        st.code(st.session_state.decisions.joined(KEEP), language="text")
 
 with st.expander("🗑️ Ver lista DESECHAR (archivos)"):
-    desechar = st.session_state.desechar
-    if desechar:
-        st.code("\n".join(desechar), language="text")
-    else:
+    if not discard_count:
         st.caption("Vacío.")
+    # Collapsed expanders still run: join and send the list only when asked for
+    elif st.checkbox("Mostrar la lista", key="show_discard_list"):
+        st.code(st.session_state.decisions.joined(DISCARD), language="text")
 
 if st.button("Exportar decisiones (CSV)", width="stretch"):
     export_dir = Path(".keep_or_discard") / "exports"
@@ -611,17 +1832,107 @@ if st.button("Exportar decisiones (CSV)", width="stretch"):
     with export_path.open("w", newline="", encoding="utf-8") as f:
         writer = csv.writer(f)
         writer.writerow(["filename", "decision"])
-        for name in st.session_state.mantener:
-            writer.writerow([name, "keep"])
-        for name in st.session_state.desechar:
-            writer.writerow([name, "discard"])
+        catalog = active_catalog()
+        rows = catalog.decisions(active_session()) if catalog is not None else st.session_state.decisions.items()
+        for name, decision in rows:
+            writer.writerow([name, decision])
     st.success(f"Exportado a {export_path}")
 
+with st.expander("🏷️ Sidecars XMP para otras aplicaciones"):
+    st.caption(
+        "Escribe junto a cada imagen y sus RAW un .xmp con valoración, etiqueta y marca "
+        "(mantener: 1 estrella, verde, elegida; desechar: rechazada, roja). "
+        "Solo se reescriben los que cambiaron desde la última exportación."
+    )
+    xmp_styles = {
+        SIDECAR_STEM: "IMG_0001.xmp (Lightroom, Capture One, Bridge)",
+        SIDECAR_FULL: "IMG_0001.CR2.xmp (darktable, digiKam)",
+    }
+    st.session_state.xmp_style = st.selectbox(
+        "Nombre del sidecar",
+        SIDECAR_STYLES,
+        index=SIDECAR_STYLES.index(st.session_state.xmp_style),
+        format_func=xmp_styles.get,
+    )
+    xmp_force = st.checkbox("Reemplazar sidecars que no escribió esta app", value=False)
+    if st.button("Escribir sidecars XMP", width="stretch", key="btn_xmp", disabled=not len(st.session_state.decisions)):
+        catalog = active_catalog()
+        rows = catalog.decisions(active_session()) if catalog is not None else st.session_state.decisions.items()
+        with st.spinner("Escribiendo sidecars XMP…"), span("xmp.export"):
+            report = export_sidecars(media_index(), rows, style=st.session_state.xmp_style, force=xmp_force)
+        st.success(
+            f"XMP: {report.written} escritos, {report.unchanged} sin cambios, {report.removed} eliminados"
+        )
+        if report.foreign:
+            st.warning(
+                f"{len(report.foreign)} sidecars no los escribió esta app o se editaron después; no se han tocado: "
+                + ", ".join(p.name for p in report.foreign[:5])
+            )
+        if report.missing:
+            st.caption(f"{len(report.missing)} imágenes decididas ya no están en la carpeta de origen.")
+        for path, error in report.failed[:5]:
+            st.error(f"{path}: {error}")
+
+with st.expander("⏱️ Rendimiento (tiempos por ejecución)"):
+    trace = st.checkbox("Medir tiempos de las operaciones", value=st.session_state.trace_timings)
+    if trace != st.session_state.trace_timings:
+        st.session_state.trace_timings = trace
+        st.session_state.tracer.enabled = trace
+    if st.session_state.trace_timings:
+        tracer = st.session_state.tracer
+        last = tracer.last_rerun()
+        if last is None:
+            st.caption("Aún no hay ejecuciones medidas; interactúa con la app.")
+        else:
+            suffix = " (interrumpida por un rerun)" if last.interrupted else ""
+            st.caption(f"Última ejecución #{last.number}: {last.total_ms:.1f} ms{suffix}")
+            rows = [
+                {"Operación": name, "Llamadas": calls, "Total ms": f"{total:.1f}", "Máx ms": f"{worst:.1f}"}
+                for name, (calls, total, worst) in sorted(last.summary().items(), key=lambda kv: -kv[1][1])
+            ]
+            rows.append(
+                {"Operación": "resto (Streamlit y UI)", "Llamadas": 1, "Total ms": f"{last.untracked_ms():.1f}", "Máx ms": ""}
+            )
+            st.table(rows)
+            st.write(f"Histograma de las últimas {len(tracer.reruns)} ejecuciones (ms por llamada):")
+            hist_rows = []
+            for name, (values, counts) in sorted(tracer.histograms().items()):
+                row = {
+                    "Operación": name,
+                    "n": len(values),
+                    "p50": f"{percentile(values, 50):.1f}",
+                    "p90": f"{percentile(values, 90):.1f}",
+                    "máx": f"{values[-1]:.1f}",
+                }
+                for i in range(len(BUCKETS_MS) + 1):
+                    row[bucket_label(i)] = counts[i]
+                hist_rows.append(row)
+            st.table(hist_rows)
+        t1, t2, t3 = st.columns(3)
+        with t1:
+            if st.button("Exportar traza JSON", width="stretch", disabled=last is None):
+                st.success(f"Exportado a {tracer.export('json')}")
+        with t2:
+            if st.button("Exportar traza CSV", width="stretch", disabled=last is None):
+                st.success(f"Exportado a {tracer.export('csv')}")
+        with t3:
+            if st.button("Perfilar la próxima ejecución", width="stretch", key="btn_profile"):
+                tracer.profile_next_rerun()
+                st.rerun()
+        if tracer.last_profile is not None:
+            profile_path, profile_text = tracer.last_profile
+            st.caption(f"cProfile guardado en {profile_path} (ábrelo con snakeviz o pstats).")
+            st.code(profile_text, language="text")
+
 # Listener
 
+@st.cache_data(show_spinner=False)
 def read_html():
-    with open("src/index.html") as f:
+    with open(Path(__file__).parent / "index.html") as f:
         return f.read()
 
 
-components.html(read_html(), height=0, width=0)
+# The browser-side deck has its own keyboard handling
+if st.session_state.review_mode == "grid" or not st.session_state.deck:
+    components.html(read_html(), height=0, width=0)
+st.session_state.tracer.end_rerun()
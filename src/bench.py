@@ -0,0 +1,335 @@
+import argparse
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import struct
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple
+
+from PIL import Image
+
+from decisions import ACTION_DECISION, DISCARD, KEEP, DecisionStore
+from journal import SESSION_VERSION, SessionJournal
+from plan import TransferPlan
+from previews import PreviewCache
+from scanner import MediaScanner
+from timing import percentile
+from tools import format_bytes
+from transfer import TransferEngine
+
+# Benchmarks for the review and transfer hot paths on a synthetic library.
+# The app functions live on st.session_state, so each one is measured through
+# the module it delegates to: load_image_paths -> MediaScanner, open_image ->
+# PreviewCache, save_session_state -> SessionJournal, current_plan ->
+# TransferPlan, undo_last -> DecisionStore.restore + TransferPlan.update.
+
+DEFAULT_SIZES = "1000,10000"
+FILES_PER_FOLDER = 500
+
+
+class LibraryStats(NamedTuple):
+    images: int
+    raws: int
+    ambiguous: int
+    folders: int
+    bytes: int
+
+
+class Timings:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {}
+        self.work: Dict[str, float] = {}
+
+    def add(self, op: str, seconds: float, work: float = 1.0) -> None:
+        self.samples.setdefault(op, []).append(seconds)
+        self.work[op] = self.work.get(op, 0.0) + work
+
+    @contextmanager
+    def timed(self, op: str, work: float = 1.0) -> Iterator[None]:
+        t0 = time.perf_counter()
+        yield
+        self.add(op, time.perf_counter() - t0, work)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        out = {}
+        for op, samples in self.samples.items():
+            ordered = sorted(samples)
+            total = sum(ordered)
+            out[op] = {
+                "n": len(ordered),
+                "p50": percentile(ordered, 50),
+                "p90": percentile(ordered, 90),
+                "p99": percentile(ordered, 99),
+                "max": ordered[-1],
+                "per_sec": self.work[op] / total if total > 0 else 0.0,
+            }
+        return out
+
+
+def peak_rss() -> int:
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def encode_sample(width: int, height: int, fmt: str, seed: int) -> bytes:
+    rng = random.Random(seed)
+    img = Image.new("RGB", (width, height), (rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+    # A little structure so JPEG sizes and decode times are realistic
+    noise = Image.effect_noise((width, height), 64).convert("RGB")
+    img = Image.blend(img, noise, 0.5)
+    buf = io.BytesIO()
+    img.save(buf, format=fmt, quality=90)
+    return buf.getvalue()
+
+
+def fake_raw(preview: bytes) -> bytes:
+    # Minimal little-endian TIFF with one IFD pointing at an embedded JPEG
+    ifd = struct.pack("<H", 2)
+    ifd += struct.pack("<HHII", 0x0201, 4, 1, 8 + 2 + 2 * 12 + 4)
+    ifd += struct.pack("<HHII", 0x0202, 4, 1, len(preview))
+    ifd += struct.pack("<I", 0)
+    return b"II*\x00" + struct.pack("<I", 8) + ifd + preview
+
+
+def generate_library(
+    root: Path,
+    count: int,
+    width: int = 640,
+    height: int = 480,
+    png_ratio: float = 0.1,
+    raw_ratio: float = 0.3,
+    ambiguous_ratio: float = 0.05,
+    hardlink: bool = False,
+    seed: int = 0,
+) -> LibraryStats:
+    rng = random.Random(seed)
+    templates = {
+        ".jpg": [encode_sample(width, height, "JPEG", seed + i) for i in range(4)],
+        ".png": [encode_sample(width, height, "PNG", seed + i) for i in range(2)],
+    }
+    raw_template = fake_raw(templates[".jpg"][0])
+    sources: Dict[bytes, Path] = {}
+
+    def write(path: Path, data: bytes) -> int:
+        source = sources.get(data)
+        if hardlink and source is not None:
+            os.link(source, path)
+        else:
+            path.write_bytes(data)
+            sources.setdefault(data, path)
+        return len(data)
+
+    raws = ambiguous = total = 0
+    folders = set()
+    for i in range(count):
+        # Nested folders: day/card, FILES_PER_FOLDER images each
+        folder = root / f"day{i // (FILES_PER_FOLDER * 4):03d}" / f"card{(i // FILES_PER_FOLDER) % 4}"
+        if folder not in folders:
+            folder.mkdir(parents=True, exist_ok=True)
+            folders.add(folder)
+        ext = ".png" if rng.random() < png_ratio else ".jpg"
+        stem = f"IMG_{i:06d}"
+        total += write(folder / f"{stem}{ext}", rng.choice(templates[ext]))
+        if rng.random() < raw_ratio:
+            total += write(folder / f"{stem}.CR2", raw_template)
+            raws += 1
+            if rng.random() < ambiguous_ratio / max(raw_ratio, 1e-9):
+                total += write(folder / f"{stem}.dng", raw_template)
+                raws += 1
+                ambiguous += 1
+    return LibraryStats(count, raws, ambiguous, len(folders), total)
+
+
+def bench_library(root: Path, work: Path, args: argparse.Namespace) -> Dict:
+    timings = Timings()
+    rss: Dict[str, int] = {}
+    rng = random.Random(args.seed)
+
+    # load_image_paths: first page latency and full background scan
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        scanner = MediaScanner(root).start()
+        scanner.wait_first_page()
+        timings.add("scan.first_page", time.perf_counter() - t0)
+        scanner.wait_done()
+        timings.add("scan.full", time.perf_counter() - t0, len(scanner.index.files))
+    index = scanner.index
+    images = index.images()
+    for _ in range(args.repeat * 10):
+        with timings.timed("scan.refresh_unchanged"):
+            scanner.refresh()
+    rss["scan"] = peak_rss()
+
+    # open_image: cold (render + cache write) and warm (cache hit + decode)
+    cache = PreviewCache(work / "previews")
+    sample = rng.sample(images, min(args.decode_sample, len(images)))
+    for phase in ("open_image.cold", "open_image.warm"):
+        for path in sample:
+            with timings.timed(phase):
+                with Image.open(cache.get(path, args.preview_width)) as img:
+                    img.load()
+    rss["open_image"] = peak_rss()
+
+    # Decisions: what swipe_left/right do per keypress, then save_session_state
+    names = [index.name_of(p) for p in images]
+    store = DecisionStore()
+    journal = SessionJournal(work / "session_state.json", work / "session_log.jsonl")
+    history = []
+    plan = TransferPlan.build(index, [], True)
+    for idx, name in enumerate(names):
+        action = "right" if rng.random() < 0.7 else "left"
+        with timings.timed("decide"):
+            previous = store.record(name, ACTION_DECISION[action], idx)
+            history.append((action, name, idx, previous))
+            plan.update(name, store.get(name))
+            journal.append({"op": action, "name": name, "idx": idx})
+    journal.sync()
+    for _ in range(args.repeat):
+        with timings.timed("save_session_state"):
+            journal.compact(
+                {
+                    "version": SESSION_VERSION,
+                    "mantener": list(store.names(KEEP)),
+                    "desechar": list(store.names(DISCARD)),
+                    "history": history,
+                }
+            )
+    rss["decisions"] = peak_rss()
+
+    # current_plan: full rebuild (folder changed) vs the incremental plan
+    for _ in range(args.repeat):
+        with timings.timed("current_plan.full", len(names)):
+            TransferPlan.build(index, store.items(), True)
+        with timings.timed("current_plan.incremental"):
+            plan.pairs()
+
+    # undo_last: restore the previous decision and patch the plan
+    for action, name, idx, previous in reversed(history[-min(len(history), args.undo_sample) :]):
+        with timings.timed("undo_last"):
+            store.restore(name, previous, idx)
+            plan.update(name, store.get(name))
+        # Redo so the transfer below still has the whole plan
+        store.record(name, ACTION_DECISION[action], idx)
+        plan.update(name, store.get(name))
+    rss["plan"] = peak_rss()
+
+    # Transfer: copy a sample of the plan with the parallel engine
+    entries = list(TransferPlan.build(index, store.items(), True).entries())[: args.transfer_sample]
+    entries = [e._replace(dst=work / "out" / e.dst) for e in entries]
+    engine = TransferEngine(entries, "copy", workers=args.workers, journal_dir=work / "transfers")
+    t0 = time.perf_counter()
+    result = engine.run()
+    elapsed = time.perf_counter() - t0
+    copied = sum(e.size for e in entries)
+    timings.add("transfer.copy", elapsed, len(result.done))
+    rss["transfer"] = peak_rss()
+
+    return {
+        "timings": timings.summary(),
+        "transfer": {"files": len(result.done), "bytes": copied, "bytes_per_sec": copied / elapsed if elapsed else 0},
+        "peak_rss": rss,
+    }
+
+
+def print_report(count: int, stats: LibraryStats, report: Dict) -> None:
+    print(
+        f"\n== {count} imágenes · {stats.raws} RAW ({stats.ambiguous} ambiguos) · "
+        f"{stats.folders} carpetas · {format_bytes(stats.bytes)} =="
+    )
+    print(f"{'operación':34} {'n':>6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'máx ms':>9} {'por s':>11}")
+    for op, s in report["timings"].items():
+        print(
+            f"{op:34} {s['n']:>6} {s['p50'] * 1000:>9.3f} {s['p90'] * 1000:>9.3f} "
+            f"{s['p99'] * 1000:>9.3f} {s['max'] * 1000:>9.3f} {s['per_sec']:>11.1f}"
+        )
+    transfer = report["transfer"]
+    print(f"copia: {transfer['files']} archivos, {format_bytes(transfer['bytes_per_sec'])}/s")
+    print("RSS máximo: " + ", ".join(f"{k} {format_bytes(v)}" for k, v in report["peak_rss"].items()))
+
+
+def run(args: argparse.Namespace) -> int:
+    results = {}
+    for count in [int(n) for n in args.sizes.split(",") if n]:
+        base = Path(tempfile.mkdtemp(prefix=f"kod-bench-{count}-", dir=args.tmp))
+        try:
+            t0 = time.perf_counter()
+            stats = generate_library(
+                base / "media",
+                count,
+                args.width,
+                args.height,
+                args.png_ratio,
+                args.raw_ratio,
+                args.ambiguous_ratio,
+                args.hardlink,
+                args.seed,
+            )
+            print(f"Biblioteca de {count} generada en {time.perf_counter() - t0:.1f}s en {base}", file=sys.stderr)
+            report = bench_library(base / "media", base / "work", args)
+            print_report(count, stats, report)
+            results[count] = {"library": stats._asdict(), **report}
+        finally:
+            if not args.keep:
+                shutil.rmtree(base, ignore_errors=True)
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"\nResultados en {args.json}")
+    return 0
+
+
+def generate(args: argparse.Namespace) -> int:
+    stats = generate_library(
+        Path(args.folder),
+        args.count,
+        args.width,
+        args.height,
+        args.png_ratio,
+        args.raw_ratio,
+        args.ambiguous_ratio,
+        args.hardlink,
+        args.seed,
+    )
+    print(f"{stats.images} imágenes, {stats.raws} RAW, {stats.folders} carpetas, {format_bytes(stats.bytes)}")
+    return 0
+
+
+def parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(prog="bench", description="Benchmarks de revisión y transferencia")
+    sub = p.add_subparsers(dest="command", required=True)
+    for name, func in (("run", run), ("generate", generate)):
+        cmd = sub.add_parser(name)
+        cmd.set_defaults(func=func)
+        cmd.add_argument("--width", type=int, default=640)
+        cmd.add_argument("--height", type=int, default=480)
+        cmd.add_argument("--png-ratio", type=float, default=0.1)
+        cmd.add_argument("--raw-ratio", type=float, default=0.3)
+        cmd.add_argument("--ambiguous-ratio", type=float, default=0.05, help="imágenes con dos RAW")
+        cmd.add_argument("--hardlink", action="store_true", help="enlazar archivos repetidos para ahorrar disco")
+        cmd.add_argument("--seed", type=int, default=0)
+    gen = sub.choices["generate"]
+    gen.add_argument("folder")
+    gen.add_argument("--count", type=int, default=1000)
+    bench = sub.choices["run"]
+    bench.add_argument("--sizes", default=DEFAULT_SIZES, help="p. ej. 1000,10000,100000")
+    bench.add_argument("--repeat", type=int, default=3)
+    bench.add_argument("--decode-sample", type=int, default=200)
+    bench.add_argument("--undo-sample", type=int, default=1000)
+    bench.add_argument("--transfer-sample", type=int, default=2000)
+    bench.add_argument("--preview-width", type=int, default=1200)
+    bench.add_argument("--workers", type=int, default=4)
+    bench.add_argument("--tmp", help="directorio temporal (por defecto el del sistema)")
+    bench.add_argument("--keep", action="store_true", help="no borrar la biblioteca generada")
+    bench.add_argument("--json", help="guardar resultados en JSON")
+    return p
+
+
+if __name__ == "__main__":
+    args = parser().parse_args()
+    sys.exit(args.func(args))
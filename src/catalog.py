@@ -0,0 +1,407 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+CATALOG_PATH = Path(".keep_or_discard") / "catalog.sqlite3"
+DEFAULT_SESSION = "default"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    source_dir TEXT NOT NULL,
+    path TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    PRIMARY KEY (source_dir, path)
+);
+CREATE TABLE IF NOT EXISTS images (
+    source_dir TEXT NOT NULL,
+    name TEXT NOT NULL,
+    stem TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    is_image INTEGER NOT NULL,
+    position INTEGER,
+    PRIMARY KEY (source_dir, name)
+);
+CREATE INDEX IF NOT EXISTS images_stem ON images (source_dir, stem);
+CREATE TABLE IF NOT EXISTS sessions (
+    session TEXT PRIMARY KEY,
+    source_dir TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    version INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS decisions (
+    session TEXT NOT NULL,
+    name TEXT NOT NULL,
+    decision TEXT NOT NULL,
+    idx INTEGER,
+    decided_at REAL NOT NULL,
+    PRIMARY KEY (session, name)
+);
+CREATE INDEX IF NOT EXISTS decisions_order ON decisions (session, decided_at);
+CREATE TABLE IF NOT EXISTS history (
+    session TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    action TEXT NOT NULL,
+    name TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    previous TEXT,
+    batch TEXT,
+    PRIMARY KEY (session, seq)
+);
+CREATE TABLE IF NOT EXISTS transfers (
+    run_id TEXT NOT NULL,
+    mode TEXT NOT NULL,
+    src TEXT NOT NULL,
+    dst TEXT,
+    status TEXT NOT NULL,
+    error TEXT,
+    finished_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS transfers_run ON transfers (run_id);
+CREATE INDEX IF NOT EXISTS transfers_src ON transfers (src);
+"""
+
+
+class InventoryRow(NamedTuple):
+    name: str
+    size: int
+    mtime_ns: int
+    is_image: bool
+    position: Optional[int] = None
+
+
+class CatalogSession(NamedTuple):
+    source_dir: str
+    mode: str
+    idx: int
+    decisions: List[Tuple[str, str, Optional[int]]]
+    history: List[Tuple]
+    # history row seq of each history entry, for undo
+    history_seqs: List[int]
+    # Bumped by every write to the session, so tabs notice each other's changes
+    version: int
+
+
+class Catalog:
+    def __init__(self, path: Path = CATALOG_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._migrate()
+        self._lock = threading.Lock()
+
+    def _migrate(self) -> None:
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(history)")}
+        if "batch" not in columns:
+            self._conn.execute("ALTER TABLE history ADD COLUMN batch TEXT")
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(sessions)")}
+        if "version" not in columns:
+            self._conn.execute("ALTER TABLE sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    @contextmanager
+    def _write(self) -> Iterator[sqlite3.Cursor]:
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute("BEGIN")
+            try:
+                yield cur
+            except BaseException:
+                cur.execute("ROLLBACK")
+                raise
+            cur.execute("COMMIT")
+
+    def _transaction(self, statements: Iterable[Tuple[str, Tuple]]) -> None:
+        with self._write() as cur:
+            for sql, params in statements:
+                cur.execute(sql, params)
+
+    def _session_write(self, session: str, statements: Iterable[Tuple[str, Tuple]]) -> int:
+        # Statements that end with _session_upsert; returns the new session version
+        with self._write() as cur:
+            for sql, params in statements:
+                cur.execute(sql, params)
+            return int(cur.execute("SELECT version FROM sessions WHERE session = ?", (session,)).fetchone()[0])
+
+    # ---------------- inventory ----------------
+    def load_inventory(self, source_dir: str) -> Tuple[Dict[str, int], List[InventoryRow]]:
+        with self._lock:
+            dirs = dict(
+                self._conn.execute("SELECT path, mtime_ns FROM dirs WHERE source_dir = ?", (source_dir,))
+            )
+            rows = [
+                InventoryRow(name, size, mtime_ns, bool(is_image), position)
+                for name, size, mtime_ns, is_image, position in self._conn.execute(
+                    "SELECT name, size, mtime_ns, is_image, position FROM images WHERE source_dir = ? "
+                    "ORDER BY position IS NULL, position, name",
+                    (source_dir,),
+                )
+            ]
+        return dirs, rows
+
+    def save_inventory(
+        self,
+        source_dir: str,
+        dir_mtimes: Dict[str, int],
+        rows: Iterable[Tuple[str, str, int, int, bool, Optional[int]]],
+    ) -> None:
+        with self._write() as cur:
+            cur.execute("DELETE FROM dirs WHERE source_dir = ?", (source_dir,))
+            cur.execute("DELETE FROM images WHERE source_dir = ?", (source_dir,))
+            cur.executemany(
+                "INSERT INTO dirs (source_dir, path, mtime_ns) VALUES (?, ?, ?)",
+                ((source_dir, path, mtime_ns) for path, mtime_ns in dir_mtimes.items()),
+            )
+            cur.executemany(
+                "INSERT INTO images (source_dir, name, stem, size, mtime_ns, is_image, position) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((source_dir, *row) for row in rows),
+            )
+
+    def update_inventory(
+        self,
+        source_dir: str,
+        dir_mtimes: Dict[str, int],
+        removed_dirs: Iterable[str],
+        rows: Iterable[Tuple[str, str, int, int, bool, Optional[int]]],
+        removed: Iterable[str],
+    ) -> None:
+        # What changed since the last save: only the rows of rescanned folders
+        with self._write() as cur:
+            cur.executemany(
+                "DELETE FROM dirs WHERE source_dir = ? AND path = ?", ((source_dir, path) for path in removed_dirs)
+            )
+            cur.executemany(
+                "INSERT INTO dirs (source_dir, path, mtime_ns) VALUES (?, ?, ?) "
+                "ON CONFLICT(source_dir, path) DO UPDATE SET mtime_ns = excluded.mtime_ns",
+                ((source_dir, path, mtime_ns) for path, mtime_ns in dir_mtimes.items()),
+            )
+            cur.executemany(
+                "DELETE FROM images WHERE source_dir = ? AND name = ?", ((source_dir, name) for name in removed)
+            )
+            cur.executemany(
+                "INSERT INTO images (source_dir, name, stem, size, mtime_ns, is_image, position) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(source_dir, name) DO UPDATE SET stem = excluded.stem, size = excluded.size, "
+                "mtime_ns = excluded.mtime_ns, is_image = excluded.is_image, position = excluded.position",
+                ((source_dir, *row) for row in rows),
+            )
+
+    def find_by_stem(self, source_dir: str, stem: str) -> List[InventoryRow]:
+        with self._lock:
+            return [
+                InventoryRow(name, size, mtime_ns, bool(is_image))
+                for name, size, mtime_ns, is_image in self._conn.execute(
+                    "SELECT name, size, mtime_ns, is_image FROM images WHERE source_dir = ? AND stem = ?",
+                    (source_dir, stem),
+                )
+            ]
+
+    # ---------------- sessions and decisions ----------------
+    def has_session(self, session: str = DEFAULT_SESSION) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM sessions WHERE session = ?", (session,)).fetchone()
+        return row is not None
+
+    def sessions(self) -> List[Tuple[str, float]]:
+        with self._lock:
+            return self._conn.execute("SELECT session, updated_at FROM sessions ORDER BY session").fetchall()
+
+    def load_session(self, session: str = DEFAULT_SESSION) -> Optional[CatalogSession]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT source_dir, mode, idx, version FROM sessions WHERE session = ?", (session,)
+            ).fetchone()
+            if row is None:
+                return None
+            decisions = self._conn.execute(
+                "SELECT name, decision, idx FROM decisions WHERE session = ? ORDER BY decided_at",
+                (session,),
+            ).fetchall()
+            rows = self._conn.execute(
+                "SELECT seq, action, name, idx, previous, batch FROM history WHERE session = ? ORDER BY seq",
+                (session,),
+            ).fetchall()
+        history = [
+            # Batch entries (one group action) carry their batch id as a fifth field
+            (action, name, idx, previous, batch) if batch is not None else (action, name, idx, previous)
+            for _, action, name, idx, previous, batch in rows
+        ]
+        return CatalogSession(row[0], row[1], int(row[2]), decisions, history, [r[0] for r in rows], int(row[3]))
+
+    def session_version(self, session: str = DEFAULT_SESSION) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT version FROM sessions WHERE session = ?", (session,)).fetchone()
+        return int(row[0]) if row is not None else 0
+
+    def _session_upsert(self, session: str, source_dir: str, mode: str, idx: int) -> Tuple[str, Tuple]:
+        return (
+            "INSERT INTO sessions (session, source_dir, mode, idx, updated_at, version) VALUES (?, ?, ?, ?, ?, 1) "
+            "ON CONFLICT(session) DO UPDATE SET source_dir = excluded.source_dir, mode = excluded.mode, "
+            "idx = excluded.idx, updated_at = excluded.updated_at, version = sessions.version + 1",
+            (session, source_dir, mode, idx, time.time()),
+        )
+
+    def save_session(
+        self,
+        source_dir: str,
+        mode: str,
+        idx: int,
+        decisions: Iterable[Tuple[str, str, Optional[int]]],
+        history: Iterable[Tuple],
+        session: str = DEFAULT_SESSION,
+    ) -> int:
+        # Full replace; used on import and reset, not per decision. History
+        # rows are numbered from 1 in order.
+        now = time.time()
+        statements = [
+            ("DELETE FROM decisions WHERE session = ?", (session,)),
+            ("DELETE FROM history WHERE session = ?", (session,)),
+            self._session_upsert(session, source_dir, mode, idx),
+        ]
+        for offset, (name, decision, position) in enumerate(decisions):
+            statements.append(
+                (
+                    "INSERT INTO decisions (session, name, decision, idx, decided_at) VALUES (?, ?, ?, ?, ?)",
+                    (session, name, decision, position, now + offset * 1e-6),
+                )
+            )
+        for seq, entry in enumerate(history, start=1):
+            previous = entry[3] if len(entry) > 3 else None
+            batch = entry[4] if len(entry) > 4 else None
+            statements.append(
+                (
+                    "INSERT INTO history (session, seq, action, name, idx, previous, batch) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (session, seq, entry[0], entry[1], int(entry[2]), previous, batch),
+                )
+            )
+        return self._session_write(session, statements)
+
+    def record_decision(
+        self,
+        source_dir: str,
+        mode: str,
+        action: str,
+        name: str,
+        decision: str,
+        idx_before: int,
+        previous: Optional[str],
+        session: str = DEFAULT_SESSION,
+        batch: Optional[str] = None,
+    ) -> Tuple[int, int]:
+        # (history seq of this decision, new session version)
+        with self._write() as cur:
+            cur.execute(
+                "INSERT INTO decisions (session, name, decision, idx, decided_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(session, name) DO UPDATE SET decision = excluded.decision, "
+                "idx = excluded.idx, decided_at = excluded.decided_at",
+                (session, name, decision, idx_before, time.time()),
+            )
+            (seq,) = cur.execute(
+                "SELECT COALESCE(MAX(seq), 0) + 1 FROM history WHERE session = ?", (session,)
+            ).fetchone()
+            cur.execute(
+                "INSERT INTO history (session, seq, action, name, idx, previous, batch) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (session, seq, action, name, idx_before, previous, batch),
+            )
+            cur.execute(*self._session_upsert(session, source_dir, mode, idx_before + 1))
+            (version,) = cur.execute("SELECT version FROM sessions WHERE session = ?", (session,)).fetchone()
+        return int(seq), int(version)
+
+    def record_undo(
+        self,
+        source_dir: str,
+        mode: str,
+        name: str,
+        idx_before: int,
+        previous: Optional[str],
+        session: str = DEFAULT_SESSION,
+        seq: Optional[int] = None,
+    ) -> int:
+        # seq is the history row the caller recorded for this decision; other
+        # tabs' rows are never touched. Without it, the newest row for this
+        # name and position goes.
+        if previous is None:
+            restore = ("DELETE FROM decisions WHERE session = ? AND name = ?", (session, name))
+        else:
+            restore = (
+                "UPDATE decisions SET decision = ?, idx = ?, decided_at = ? WHERE session = ? AND name = ?",
+                (previous, idx_before, time.time(), session, name),
+            )
+        if seq is not None:
+            forget = ("DELETE FROM history WHERE session = ? AND seq = ?", (session, seq))
+        else:
+            forget = (
+                "DELETE FROM history WHERE session = ? AND seq = (SELECT MAX(seq) FROM history "
+                "WHERE session = ? AND name = ? AND idx = ?)",
+                (session, session, name, idx_before),
+            )
+        return self._session_write(
+            session, [restore, forget, self._session_upsert(session, source_dir, mode, idx_before)]
+        )
+
+    def update_session(self, source_dir: str, mode: str, idx: int, session: str = DEFAULT_SESSION) -> int:
+        return self._session_write(session, [self._session_upsert(session, source_dir, mode, idx)])
+
+    def reset_session(self, session: str = DEFAULT_SESSION) -> None:
+        self._transaction(
+            [
+                ("DELETE FROM decisions WHERE session = ?", (session,)),
+                ("DELETE FROM history WHERE session = ?", (session,)),
+                ("DELETE FROM sessions WHERE session = ?", (session,)),
+            ]
+        )
+
+    def decisions(self, session: Optional[str] = DEFAULT_SESSION) -> Iterator[Tuple[str, str]]:
+        # session=None queries across every stored session
+        with self._lock:
+            if session is None:
+                rows = self._conn.execute(
+                    "SELECT name, decision FROM decisions ORDER BY decision DESC, decided_at"
+                ).fetchall()
+            else:
+                rows = self._conn.execute(
+                    "SELECT name, decision FROM decisions WHERE session = ? ORDER BY decision DESC, decided_at",
+                    (session,),
+                ).fetchall()
+        return iter(rows)
+
+    # ---------------- transfers ----------------
+    def record_transfer(
+        self,
+        run_id: str,
+        mode: str,
+        done: Iterable[Tuple[Path, Path]],
+        failed: Iterable[Tuple[Path, str]],
+    ) -> None:
+        now = time.time()
+        with self._write() as cur:
+            cur.executemany(
+                "INSERT INTO transfers (run_id, mode, src, dst, status, error, finished_at) "
+                "VALUES (?, ?, ?, ?, 'done', NULL, ?)",
+                ((run_id, mode, str(src), str(dst), now) for src, dst in done),
+            )
+            cur.executemany(
+                "INSERT INTO transfers (run_id, mode, src, dst, status, error, finished_at) "
+                "VALUES (?, ?, ?, NULL, 'failed', ?, ?)",
+                ((run_id, mode, str(src), error, now) for src, error in failed),
+            )
+
+    def transfers_for(self, src: Path) -> List[Tuple[str, str, Optional[str], str, float]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT run_id, mode, dst, status, finished_at FROM transfers WHERE src = ? ORDER BY finished_at",
+                (str(src),),
+            ).fetchall()
@@ -0,0 +1,418 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+# Only stdlib at import time: Streamlit is never imported here and Pillow only
+# by the subcommands that decode images (warm-previews).
+from catalog import CATALOG_PATH, Catalog
+from decisions import DECISIONS, DISCARD, KEEP, DecisionStore
+from journal import SESSION_VERSION, SessionJournal
+from sessions import (
+    assign_shards,
+    catalog_session,
+    clear_shards,
+    list_reviewers,
+    load_reviewer_session,
+    merge_sessions,
+    reviewer_label,
+    reviewer_slug,
+    session_paths,
+)
+from tools import MediaIndex, format_bytes, format_duration
+
+
+def open_catalog(enabled: Optional[bool]) -> Optional[Catalog]:
+    # Same default as the app: the catalog is used once it exists
+    if enabled is None:
+        enabled = CATALOG_PATH.exists()
+    return Catalog(CATALOG_PATH) if enabled else None
+
+
+def load_session(catalog: Optional[Catalog], reviewer: str = "") -> Tuple[str, str, DecisionStore]:
+    session = load_reviewer_session(reviewer, catalog)
+    if session is None:
+        return "media", "copy", DecisionStore()
+    return session.source_dir, session.mode, session.decisions
+
+
+def read_decisions(path: Path) -> List[Tuple[str, str]]:
+    # CSV from "Exportar decisiones" or a session_state.json snapshot
+    if path.suffix.lower() == ".csv":
+        import csv
+
+        with path.open(newline="", encoding="utf-8") as f:
+            rows = [(row["filename"], row["decision"]) for row in csv.DictReader(f)]
+    else:
+        import json
+
+        payload = json.loads(path.read_text(encoding="utf-8"))
+        rows = [(name, KEEP) for name in payload.get("mantener", [])]
+        rows += [(name, DISCARD) for name in payload.get("desechar", [])]
+    unknown = sorted({decision for _, decision in rows if decision not in DECISIONS})
+    if unknown:
+        raise ValueError(f"Decisiones desconocidas en {path}: {', '.join(unknown)}")
+    return rows
+
+
+def session_decisions(args: argparse.Namespace) -> Tuple[str, str, List[Tuple[str, str]]]:
+    catalog = open_catalog(args.catalog)
+    source_dir, mode, store = load_session(catalog, args.reviewer)
+    if args.decisions:
+        return source_dir, mode, read_decisions(Path(args.decisions))
+    if args.all_reviewers:
+        merged = merge_sessions(list_reviewers(catalog), catalog)
+        if merged.conflicts:
+            print(f"{len(merged.conflicts)} imágenes con decisiones distintas; se mantienen", file=sys.stderr)
+        return source_dir, mode, merged.decisions
+    return source_dir, mode, list(store.items())
+
+
+def build_plan(args: argparse.Namespace):
+    from plan import TransferPlan
+
+    source_dir, mode, rows = session_decisions(args)
+    source = Path(args.source or source_dir)
+    index = MediaIndex.build(source)
+    return TransferPlan.build(index, rows, not args.no_ambiguous_raws), mode
+
+
+def cmd_scan(args: argparse.Namespace) -> int:
+    folder = Path(args.folder)
+    if not folder.is_dir():
+        print(f"No existe la carpeta {folder}", file=sys.stderr)
+        return 1
+    t0 = time.monotonic()
+    catalog = open_catalog(args.catalog)
+    if catalog is not None:
+        from scanner import MediaScanner
+
+        scanner = MediaScanner(folder, recursive=not args.flat, catalog=catalog).start()
+        scanner.wait_done()
+        index = scanner.index
+    else:
+        index = MediaIndex.build(folder, recursive=not args.flat)
+    images = index.images()
+    raw_only = sum(1 for g in index.stems.values() if not g.images and g.raws)
+    raws = sum(len(g.raws) for g in index.stems.values())
+    size = sum(info.size for info in index.files.values())
+    print(f"{len(images)} imágenes a revisar ({raw_only} solo RAW), {raws} RAW, {format_bytes(size)}")
+    print(f"Indexado en {time.monotonic() - t0:.2f}s" + (" y guardado en el catálogo" if catalog else ""))
+    return 0
+
+
+def cmd_import(args: argparse.Namespace) -> int:
+    rows = read_decisions(Path(args.file))
+    catalog = open_catalog(args.catalog)
+    session = load_reviewer_session(args.reviewer, catalog)
+    source_dir, mode = (session.source_dir, session.mode) if session is not None else ("media", "copy")
+    if args.merge and session is not None:
+        # Merging keeps the reviewer's place in the queue and their undo history
+        store, idx, history = session.decisions, session.idx, session.history
+    else:
+        store, idx, history = DecisionStore(), 0, []
+    for name, decision in rows:
+        store.record(name, decision)
+    source_dir = args.source or source_dir
+    mode = args.mode or mode
+    if catalog is not None:
+        catalog.save_session(
+            source_dir,
+            mode,
+            idx,
+            ((n, d, store.index_of(n)) for n, d in store.items()),
+            history,
+            session=catalog_session(args.reviewer),
+        )
+    else:
+        journal = SessionJournal(*session_paths(args.reviewer))
+        journal.reset()
+        keep, discard = store.to_lists()
+        journal.compact(
+            {
+                "version": SESSION_VERSION,
+                "source_dir": source_dir,
+                "mode": mode,
+                "idx": idx,
+                "mantener": keep,
+                "desechar": discard,
+                "history": history,
+            }
+        )
+    print(f"{len(rows)} decisiones importadas: {store.count(KEEP)} mantener, {store.count(DISCARD)} desechar")
+    return 0
+
+
+def plan_entries(args: argparse.Namespace, plan, mode: str) -> list:
+    entries = list(plan.entries())
+    if args.dedup == "off" or mode != "copy":
+        return entries
+    from dedup import ContentHashes, dedup_entries
+
+    entries, report = dedup_entries(entries, ContentHashes(), args.dedup)
+    print(
+        f"Duplicados: {len(report.skipped)} omitidos, {len(report.linked)} enlazados, "
+        f"{format_bytes(report.saved_bytes)} sin copiar ({report.hashed} hashes nuevos)",
+        file=sys.stderr,
+    )
+    return entries
+
+
+def cmd_plan(args: argparse.Namespace) -> int:
+    plan, mode = build_plan(args)
+    entries = plan_entries(args, plan, mode)
+    if not args.summary:
+        for entry in entries:
+            link = f"\t= {entry.link}" if entry.link is not None else ""
+            print(f"{entry.src}\t{entry.dst}\t{format_bytes(entry.size)}{link}")
+    if plan.raw_report:
+        ambiguous = {k: v for k, v in plan.raw_report.items() if len(v) > 1}
+        if ambiguous:
+            print(f"{len(ambiguous)} imágenes con varios RAW coincidentes", file=sys.stderr)
+    # After dedup: the same totals apply would report
+    print(f"{len(entries)} archivos, {format_bytes(sum(entry.size for entry in entries))}", file=sys.stderr)
+    if args.copy != "copy" and mode == "copy":
+        from transfer import extra_bytes
+
+        size, exact = extra_bytes(entries, args.copy)
+        bound = "" if exact else "hasta "
+        print(f"Espacio nuevo en disco ({args.copy}): {bound}{format_bytes(size)}", file=sys.stderr)
+    return 0
+
+
+def cmd_apply(args: argparse.Namespace) -> int:
+    from transfer import TransferEngine, TransferProgress, extra_bytes
+
+    plan, session_mode = build_plan(args)
+    mode = args.mode or session_mode
+    entries = plan_entries(args, plan, mode)
+    size, exact = extra_bytes(entries, args.copy) if mode == "copy" else (sum(entry.size for entry in entries), True)
+    bound = "" if exact else "hasta "
+    print(f"{len(entries)} archivos, {bound}{format_bytes(size)} ({mode})", file=sys.stderr)
+    if not entries:
+        return 0
+    if not args.yes:
+        print("Añade --yes para ejecutar la acción.", file=sys.stderr)
+        return 2
+    engine = TransferEngine(entries, mode, workers=args.workers, strategy=args.copy)
+    last_update = [0.0]
+
+    def on_progress(p: TransferProgress) -> None:
+        now = time.monotonic()
+        if now - last_update[0] < 0.5 and p.files_done + p.failed < p.files_total:
+            return
+        last_update[0] = now
+        eta = format_duration(p.eta) if p.eta is not None else "—"
+        print(
+            f"\r{p.files_done}/{p.files_total} archivos · {format_bytes(p.bytes_done)} · "
+            f"{format_bytes(p.bytes_per_sec)}/s · ETA {eta}   ",
+            end="",
+            file=sys.stderr,
+        )
+
+    result = engine.run(on_progress)
+    print(file=sys.stderr)
+    catalog = open_catalog(args.catalog)
+    if catalog is not None:
+        catalog.record_transfer(result.plan_id, result.mode, result.done, result.failed)
+    for src, error in result.failed:
+        print(f"{src}: {error}", file=sys.stderr)
+    verb = "copiados" if mode == "copy" else "movidos"
+    print(f"{len(result.done) - result.resumed} archivos {verb}, {result.resumed} reanudados, {len(result.failed)} fallidos")
+    if result.methods:
+        print("Método: " + ", ".join(f"{method} {count}" for method, count in sorted(result.methods.items())))
+    print(f"Diario: {result.journal}")
+    return 1 if result.failed else 0
+
+
+def cmd_export(args: argparse.Namespace) -> int:
+    import csv
+    from datetime import datetime
+
+    catalog = open_catalog(args.catalog)
+    if catalog is not None:
+        rows = list(catalog.decisions(catalog_session(args.reviewer)))
+    else:
+        rows = list(load_session(None, args.reviewer)[2].items())
+    if args.output:
+        export_path = Path(args.output)
+    else:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        export_path = Path(".keep_or_discard") / "exports" / f"decisions_{timestamp}.csv"
+    export_path.parent.mkdir(parents=True, exist_ok=True)
+    with export_path.open("w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["filename", "decision"])
+        writer.writerows(rows)
+    print(f"Exportado a {export_path}")
+    return 0
+
+
+def cmd_xmp(args: argparse.Namespace) -> int:
+    from xmp import export_sidecars
+
+    source_dir, _, rows = session_decisions(args)
+    index = MediaIndex.build(Path(args.source or source_dir))
+    t0 = time.monotonic()
+    report = export_sidecars(index, rows, style=args.style, full=args.full, force=args.force, workers=args.workers)
+    for path, error in report.failed:
+        print(f"{path}: {error}", file=sys.stderr)
+    for path in report.foreign:
+        print(f"{path}: no lo escribió esta app o se editó después; no se ha tocado (--force reemplaza los que siguen decididos)", file=sys.stderr)
+    if report.missing:
+        print(f"{len(report.missing)} imágenes decididas ya no están en la carpeta de origen", file=sys.stderr)
+    print(
+        f"XMP: {report.written} escritos, {report.unchanged} sin cambios, {report.removed} eliminados, "
+        f"{len(report.foreign)} ajenos, {len(report.failed)} fallidos en {time.monotonic() - t0:.2f}s"
+    )
+    return 1 if report.failed else 0
+
+
+def cmd_merge(args: argparse.Namespace) -> int:
+    catalog = open_catalog(args.catalog)
+    merged = merge_sessions(list_reviewers(catalog), catalog)
+    for reviewer, count in merged.counts.items():
+        print(f"{reviewer_label(reviewer)}: {count} decisiones")
+    for name, votes in sorted(merged.conflicts.items()):
+        detail = ", ".join(f"{reviewer_label(r)}={d}" for r, d in votes.items())
+        print(f"conflicto {name}: {detail} -> keep", file=sys.stderr)
+    keep = sum(1 for _, d in merged.decisions if d == KEEP)
+    print(f"{len(merged.decisions)} imágenes: {keep} mantener, {len(merged.decisions) - keep} desechar")
+    if args.output:
+        import csv
+
+        with Path(args.output).open("w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["filename", "decision"])
+            writer.writerows(merged.decisions)
+        print(f"Exportado a {args.output}")
+    return 0
+
+
+def cmd_shard(args: argparse.Namespace) -> int:
+    if args.clear:
+        clear_shards()
+        print("Reparto eliminado")
+        return 0
+    reviewers = [reviewer_slug(r) for r in args.reviewers.split(",") if reviewer_slug(r)]
+    folder = Path(args.folder)
+    catalog = open_catalog(args.catalog)
+    from scanner import MediaScanner
+
+    # Same review order as the app, so the ranges line up with every reviewer's queue
+    scanner = MediaScanner(folder, catalog=catalog).start()
+    scanner.wait_done()
+    names = [scanner.index.name_of(path) for path in scanner.order]
+    for reviewer, shard in assign_shards(args.folder, names, reviewers).items():
+        print(f"{reviewer}: imágenes {shard.start + 1}–{shard.end} de {shard.total}")
+    return 0
+
+
+def cmd_warm_previews(args: argparse.Namespace) -> int:
+    from tools import warm_preview_cache
+
+    ok, failed = warm_preview_cache(Path(args.folder), max_width=args.width)
+    print(f"{ok} previsualizaciones listas, {failed} errores")
+    return 0
+
+
+def parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(prog="keep-or-discard", description="Keep or Discard sin interfaz")
+    p.add_argument(
+        "--catalog",
+        action=argparse.BooleanOptionalAction,
+        default=None,
+        help="usar el catálogo SQLite (por defecto, si ya existe)",
+    )
+    p.add_argument("--reviewer", type=reviewer_slug, default="", help="sesión de este revisor (por defecto, la compartida)")
+    sub = p.add_subparsers(dest="command", required=True)
+
+    scan = sub.add_parser("scan", help="indexar una carpeta")
+    scan.add_argument("folder", nargs="?", default="media")
+    scan.add_argument("--flat", action="store_true", help="no entrar en subcarpetas")
+    scan.set_defaults(func=cmd_scan)
+
+    imp = sub.add_parser("import", help="importar decisiones (CSV exportado o session_state.json)")
+    imp.add_argument("file")
+    imp.add_argument("--source", help="carpeta de origen de la sesión")
+    imp.add_argument("--mode", choices=["copy", "move"])
+    imp.add_argument("--merge", action="store_true", help="combinar con la sesión actual en vez de reemplazarla")
+    imp.set_defaults(func=cmd_import)
+
+    for name, func, help_text in (
+        ("plan", cmd_plan, "mostrar el plan de transferencia"),
+        ("apply", cmd_apply, "ejecutar el plan de transferencia"),
+    ):
+        cmd = sub.add_parser(name, help=help_text)
+        cmd.add_argument("--decisions", help="CSV o JSON en lugar de la sesión guardada")
+        cmd.add_argument("--source", help="carpeta de origen (por defecto, la de la sesión)")
+        cmd.add_argument("--no-ambiguous-raws", action="store_true", help="omitir RAWs con varias coincidencias")
+        cmd.add_argument("--all-reviewers", action="store_true", help="combinar las decisiones de todos los revisores")
+        cmd.add_argument(
+            "--dedup",
+            choices=["off", "skip", "link"],
+            default="off",
+            help="al copiar, omitir o enlazar archivos idénticos a otros del plan o de keep/discard",
+        )
+        cmd.add_argument(
+            "--copy",
+            choices=["copy", "reflink", "hardlink"],
+            default="copy",
+            help="al copiar, clonar (reflink) o enlazar (hardlink) si origen y destino comparten sistema de archivos",
+        )
+        cmd.set_defaults(func=func)
+        if name == "plan":
+            cmd.add_argument("--summary", action="store_true", help="solo totales")
+        else:
+            cmd.add_argument("--mode", choices=["copy", "move"], help="por defecto, el modo de la sesión")
+            cmd.add_argument("--workers", type=int, default=4)
+            cmd.add_argument("--yes", action="store_true", help="confirmar la ejecución")
+
+    export = sub.add_parser("export", help="exportar decisiones a CSV")
+    export.add_argument("--output")
+    export.set_defaults(func=cmd_export)
+
+    xmp = sub.add_parser("xmp", help="escribir sidecars XMP (valoración, etiqueta, marca) junto a cada imagen y sus RAW")
+    xmp.add_argument("--decisions", help="CSV o JSON en lugar de la sesión guardada")
+    xmp.add_argument("--source", help="carpeta de origen (por defecto, la de la sesión)")
+    xmp.add_argument("--all-reviewers", action="store_true", help="combinar las decisiones de todos los revisores")
+    xmp.add_argument(
+        "--style",
+        choices=["stem", "full"],
+        default="stem",
+        help="stem: IMG_0001.xmp compartido (Lightroom, Capture One); full: IMG_0001.CR2.xmp (darktable, digiKam)",
+    )
+    xmp.add_argument("--full", action="store_true", help="comprobar todos los sidecars, no solo las decisiones cambiadas")
+    xmp.add_argument("--force", action="store_true", help="reemplazar sidecars que no escribió esta app")
+    xmp.add_argument("--workers", type=int, default=0)
+    xmp.set_defaults(func=cmd_xmp)
+
+    merge = sub.add_parser("merge", help="combinar las sesiones de todos los revisores")
+    merge.add_argument("--output", help="CSV con las decisiones combinadas")
+    merge.set_defaults(func=cmd_merge)
+
+    shard = sub.add_parser("shard", help="repartir una carpeta entre revisores por rangos")
+    shard.add_argument("reviewers", nargs="?", default="", help="nombres separados por comas")
+    shard.add_argument("folder", nargs="?", default="media")
+    shard.add_argument("--clear", action="store_true", help="quitar el reparto")
+    shard.set_defaults(func=cmd_shard)
+
+    warm = sub.add_parser("warm-previews", help="generar previsualizaciones")
+    warm.add_argument("folder", nargs="?", default="media")
+    warm.add_argument("width", nargs="?", type=int, default=1200)
+    warm.set_defaults(func=cmd_warm_previews)
+    return p
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except (OSError, ValueError) as exc:
+        print(f"Error: {exc}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+KEEP = "keep"
+DISCARD = "discard"
+DECISIONS = (KEEP, DISCARD)
+ACTION_DECISION = {"right": KEEP, "left": DISCARD}
+DECISION_ACTION = {KEEP: "right", DISCARD: "left"}
+
+
+class DecisionStore:
+    def __init__(self):
+        self._decision: Dict[str, str] = {}
+        # dicts used as insertion-ordered sets, one per decision
+        self._names: Dict[str, Dict[str, None]] = {KEEP: {}, DISCARD: {}}
+        self._name_at: Dict[int, str] = {}
+        self._index_of: Dict[str, int] = {}
+        self.version = 0
+        self._joined: Dict[str, Tuple[int, str]] = {}
+
+    def __len__(self) -> int:
+        return len(self._decision)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._decision
+
+    def _drop(self, name: str) -> Optional[str]:
+        previous = self._decision.pop(name, None)
+        if previous is not None:
+            self._names[previous].pop(name, None)
+        idx = self._index_of.pop(name, None)
+        if idx is not None and self._name_at.get(idx) == name:
+            del self._name_at[idx]
+        return previous
+
+    def record(self, name: str, decision: str, idx: Optional[int] = None) -> Optional[str]:
+        if decision not in self._names:
+            raise ValueError(f"Unknown decision: {decision}")
+        previous = self._drop(name)
+        self._decision[name] = decision
+        self._names[decision][name] = None
+        if idx is not None:
+            stale = self._name_at.get(idx)
+            if stale is not None and stale != name:
+                self._index_of.pop(stale, None)
+            self._name_at[idx] = name
+            self._index_of[name] = idx
+        self.version += 1
+        return previous
+
+    def restore(self, name: str, previous: Optional[str], idx: Optional[int] = None) -> None:
+        # Undo a record(): put back whatever was decided before, if anything
+        if previous is None:
+            self._drop(name)
+            self.version += 1
+        else:
+            self.record(name, previous, idx)
+
+    def get(self, name: str) -> Optional[str]:
+        return self._decision.get(name)
+
+    def at(self, idx: int) -> Optional[Tuple[str, str]]:
+        name = self._name_at.get(idx)
+        if name is None:
+            return None
+        return name, self._decision[name]
+
+    def index_of(self, name: str) -> Optional[int]:
+        return self._index_of.get(name)
+
+    def count(self, decision: str) -> int:
+        return len(self._names[decision])
+
+    def names(self, decision: str) -> Iterator[str]:
+        return iter(self._names[decision])
+
+    def head(self, decision: str, n: int) -> List[str]:
+        out = []
+        for name in self._names[decision]:
+            if len(out) >= n:
+                break
+            out.append(name)
+        return out
+
+    def items(self) -> Iterator[Tuple[str, str]]:
+        for decision in DECISIONS:
+            for name in self._names[decision]:
+                yield name, decision
+
+    def joined(self, decision: str) -> str:
+        cached = self._joined.get(decision)
+        if cached is None or cached[0] != self.version:
+            cached = (self.version, "\n".join(self._names[decision]))
+            self._joined[decision] = cached
+        return cached[1]
+
+    def to_lists(self) -> Tuple[List[str], List[str]]:
+        return list(self._names[KEEP]), list(self._names[DISCARD])
+
+    @classmethod
+    def from_lists(
+        cls,
+        keep: Iterable[str],
+        discard: Iterable[str],
+        indices: Optional[Dict[str, int]] = None,
+    ) -> "DecisionStore":
+        store = cls()
+        indices = indices or {}
+        for name in keep:
+            store.record(name, KEEP, indices.get(name))
+        for name in discard:
+            store.record(name, DISCARD, indices.get(name))
+        return store
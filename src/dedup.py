@@ -0,0 +1,184 @@
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from analysis import AnalysisCache
+from plan import DEST_DIRS, PlanEntry
+from tools import FileInfo, scan_media
+from transfer import file_hash
+
+HASH_CACHE = Path(".keep_or_discard") / "content_hashes.json"
+# First and last block: cheap to read and enough to split most same-size files
+PARTIAL_BLOCK = 64 * 1024
+DEDUP_OFF = "off"
+DEDUP_SKIP = "skip"
+DEDUP_LINK = "link"
+DEDUP_MODES = (DEDUP_OFF, DEDUP_SKIP, DEDUP_LINK)
+
+
+class ContentHash(NamedTuple):
+    partial: Optional[str]
+    full: Optional[str] = None
+
+
+class DedupReport(NamedTuple):
+    skipped: List[PlanEntry]
+    linked: List[PlanEntry]
+    saved_bytes: int
+    hashed: int
+
+
+def partial_hash(path: Path, size: int) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        digest.update(f.read(PARTIAL_BLOCK))
+        if size > 2 * PARTIAL_BLOCK:
+            f.seek(size - PARTIAL_BLOCK)
+            digest.update(f.read(PARTIAL_BLOCK))
+    return digest.hexdigest()
+
+
+def content_hash(path_str: str) -> Tuple[str, ContentHash]:
+    path = Path(path_str)
+    return path_str, ContentHash(partial_hash(path, path.stat().st_size), file_hash(path))
+
+
+class ContentHashes(AnalysisCache):
+    # update() hashes everything in full through the process pool; duplicates()
+    # only reads what it needs, on threads, since hashing is I/O bound.
+    def __init__(self, cache_path: Path = HASH_CACHE):
+        super().__init__(cache_path, content_hash)
+
+    def encode(self, value: ContentHash) -> list:
+        return list(value)
+
+    def decode(self, data: list) -> ContentHash:
+        return ContentHash(*data)
+
+    def _fill(self, infos: Sequence[FileInfo], stage: str, workers: Optional[int]) -> int:
+        def compute(info: FileInfo) -> Optional[ContentHash]:
+            known = self.get(info) or ContentHash(None)
+            if getattr(known, stage) is not None:
+                return None
+            try:
+                if stage == "partial":
+                    return known._replace(partial=partial_hash(info.path, info.size))
+                return known._replace(full=file_hash(info.path))
+            except OSError:
+                return None
+
+        computed = 0
+        workers = workers or min(8, os.cpu_count() or 4)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dedup") as pool:
+            for info, value in zip(infos, pool.map(compute, infos)):
+                if value is None:
+                    continue
+                with self._lock:
+                    self.records[str(info.path)] = (info.size, info.mtime_ns, value)
+                    self.version += 1
+                computed += 1
+        return computed
+
+    def duplicates(
+        self, infos: Sequence[FileInfo], workers: Optional[int] = None
+    ) -> Tuple[List[List[FileInfo]], int]:
+        # Size, then first/last blocks, then the whole file: each stage only
+        # looks at files that still collide with something.
+        def collisions(items: Sequence[FileInfo], key: Callable[[FileInfo], object]) -> List[FileInfo]:
+            groups: Dict[object, List[FileInfo]] = {}
+            for info in items:
+                value = key(info)
+                if value is not None:
+                    groups.setdefault(value, []).append(info)
+            return [info for group in groups.values() if len(group) > 1 for info in group]
+
+        def stage_key(stage: str) -> Callable[[FileInfo], object]:
+            def key(info: FileInfo) -> object:
+                record = self.get(info)
+                value = getattr(record, stage) if record is not None else None
+                return (info.size, value) if value is not None else None
+
+            return key
+
+        candidates = collisions([info for info in infos if info.size > 0], lambda info: info.size)
+        hashed = self._fill(candidates, "partial", workers)
+        candidates = collisions(candidates, stage_key("partial"))
+        hashed += self._fill(candidates, "full", workers)
+        groups: Dict[object, List[FileInfo]] = {}
+        for info in candidates:
+            key = stage_key("full")(info)
+            if key is not None:
+                groups.setdefault(key, []).append(info)
+        if hashed:
+            self.save()
+        return [group for group in groups.values() if len(group) > 1], hashed
+
+
+def existing_files(dest_dirs: Sequence[Path]) -> List[FileInfo]:
+    return [info for folder in dest_dirs if folder.is_dir() for info, _ in scan_media(folder)]
+
+
+def dest_root(path: Path) -> Path:
+    return Path(path.parts[0]) if path.parts else path
+
+
+def dedup_entries(
+    entries: Sequence[PlanEntry],
+    hashes: ContentHashes,
+    policy: str = DEDUP_SKIP,
+    dest_dirs: Sequence[Path] = tuple(DEST_DIRS.values()),
+    workers: Optional[int] = None,
+) -> Tuple[List[PlanEntry], DedupReport]:
+    # skip: content already in (or headed to) the same destination folder is
+    # not transferred again. link: it is hardlinked instead, so every name
+    # still exists. Content that only exists in the other folder is always
+    # linked, never skipped, so deleting discard/ cannot lose a kept photo.
+    if policy not in DEDUP_MODES:
+        raise ValueError(f"Unknown dedup policy: {policy}")
+    if policy == DEDUP_OFF or not entries:
+        return list(entries), DedupReport([], [], 0, 0)
+    sources: List[FileInfo] = []
+    for entry in entries:
+        try:
+            st = entry.src.stat()
+        except OSError:
+            continue
+        sources.append(FileInfo(entry.src, st.st_size, st.st_mtime_ns))
+    existing = existing_files(dest_dirs)
+    groups, hashed = hashes.duplicates(sources + existing, workers)
+    order = {entry.src: i for i, entry in enumerate(entries)}
+    by_src = {entry.src: entry for entry in entries}
+    replaced: Dict[Path, Optional[PlanEntry]] = {}
+    skipped: List[PlanEntry] = []
+    linked: List[PlanEntry] = []
+    for group in groups:
+        # Where this content already is (or will be) per destination folder. A
+        # planned holder is named by its source; the engine maps it to its dst.
+        holders: Dict[Path, Path] = {}
+        for info in group:
+            if info.path not in by_src:
+                holders.setdefault(dest_root(info.path), info.path)
+        origin = next(iter(holders.values()), None)
+        planned = sorted((by_src[info.path] for info in group if info.path in by_src), key=lambda e: order[e.src])
+        for entry in planned:
+            root = dest_root(entry.dst)
+            if root in holders and policy == DEDUP_SKIP:
+                replaced[entry.src] = None
+                skipped.append(entry)
+            elif root in holders or origin is not None:
+                target = holders.get(root, origin)
+                replaced[entry.src] = entry._replace(link=target)
+                linked.append(replaced[entry.src])
+                holders[root] = target
+            else:
+                holders[root] = origin = entry.src
+    result = []
+    for entry in entries:
+        if entry.src not in replaced:
+            result.append(entry)
+        elif replaced[entry.src] is not None:
+            result.append(replaced[entry.src])
+    saved = sum(entry.size for entry in skipped) + sum(entry.size for entry in linked)
+    return result, DedupReport(skipped, linked, saved, hashed)
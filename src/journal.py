@@ -0,0 +1,235 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock applies
+    fcntl = None
+
+Record = Dict[str, Any]
+
+SESSION_VERSION = 3
+SESSION_SNAPSHOT = Path(".keep_or_discard") / "session_state.json"
+SESSION_LOG = Path(".keep_or_discard") / "session_log.jsonl"
+
+
+# Snapshot + append-only log. Every record carries a sequence number so a
+# crash between writing the snapshot and truncating the log never replays
+# records twice. Writers (tabs, reviewers, the CLI) serialise on an flock of
+# a sibling .lock file and pick up each other's sequence numbers.
+class SessionJournal:
+    def __init__(
+        self,
+        snapshot_path: Path,
+        log_path: Path,
+        fsync_every: int = 32,
+        fsync_interval: float = 2.0,
+        compact_every: int = 5000,
+    ):
+        self.snapshot_path = Path(snapshot_path)
+        self.log_path = Path(log_path)
+        self.lock_path = self.snapshot_path.with_suffix(".lock")
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.seq = 0
+        self.log_records = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._fh = None
+        self._lock = threading.Lock()
+        # (inode, size) of the log as this object last left it; anything else
+        # means another process appended or compacted in between
+        self._log_state: Optional[Tuple[int, int]] = None
+        self._snapshot_cache: Tuple[Optional[Tuple[int, int, int]], int] = (None, 0)
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+            with self.lock_path.open("a") as lock_fh:
+                fcntl.flock(lock_fh.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_fh.fileno(), fcntl.LOCK_UN)
+
+    def _handle(self):
+        if self._fh is None:
+            self.log_path.parent.mkdir(parents=True, exist_ok=True)
+            self._fh = self.log_path.open("a", encoding="utf-8")
+        return self._fh
+
+    def _disk_state(self) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(self.log_path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_size
+
+    def _snapshot_seq(self) -> int:
+        try:
+            st = os.stat(self.snapshot_path)
+        except OSError:
+            return 0
+        signature = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if self._snapshot_cache[0] != signature:
+            try:
+                seq = int(json.loads(self.snapshot_path.read_text(encoding="utf-8")).get("seq", 0))
+            except (OSError, ValueError, AttributeError):
+                seq = 0
+            self._snapshot_cache = (signature, seq)
+        return self._snapshot_cache[1]
+
+    def _last_log_seq(self) -> int:
+        try:
+            with self.log_path.open("rb") as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - 4096))
+                lines = f.read().splitlines()
+        except OSError:
+            return 0
+        for line in reversed(lines):
+            try:
+                return int(json.loads(line).get("seq", 0))
+            except (ValueError, AttributeError):
+                continue
+        return 0
+
+    def _catch_up(self) -> None:
+        # Called with the lock held: follow appends and compactions made elsewhere
+        state = self._disk_state()
+        if state is not None and state == self._log_state:
+            return
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+        self.seq = max(self.seq, self._snapshot_seq(), self._last_log_seq())
+        self._log_state = state
+
+    def append(self, record: Record) -> int:
+        with self._locked():
+            self._catch_up()
+            self.seq += 1
+            line = json.dumps({"seq": self.seq, **record}, ensure_ascii=False, separators=(",", ":"))
+            fh = self._handle()
+            fh.write(line + "\n")
+            fh.flush()
+            self._log_state = self._disk_state()
+            self.log_records += 1
+            self._unsynced += 1
+            now = time.monotonic()
+            if self._unsynced >= self.fsync_every or now - self._last_sync >= self.fsync_interval:
+                os.fsync(fh.fileno())
+                self._unsynced = 0
+                self._last_sync = now
+            return self.seq
+
+    def sync(self) -> None:
+        with self._lock:
+            if self._fh is not None and self._unsynced:
+                self._fh.flush()
+                os.fsync(self._fh.fileno())
+                self._unsynced = 0
+                self._last_sync = time.monotonic()
+
+    def needs_compaction(self) -> bool:
+        return self.log_records >= self.compact_every
+
+    def compact(self, snapshot: Record, seen_seq: Optional[int] = None) -> bool:
+        # seen_seq is the last record the caller's state includes; a snapshot
+        # missing someone else's records would silently drop them
+        with self._locked():
+            self._catch_up()
+            if seen_seq is not None and seen_seq < self.seq:
+                return False
+            payload = {**snapshot, "seq": self.seq}
+            self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.snapshot_path.with_suffix(".json.tmp")
+            with tmp_path.open("w", encoding="utf-8") as f:
+                json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
+                f.flush()
+                os.fsync(f.fileno())
+            tmp_path.replace(self.snapshot_path)
+            # Records up to seq now live in the snapshot; start a fresh log
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+            self.log_path.unlink(missing_ok=True)
+            self._log_state = None
+            self.log_records = 0
+            self._unsynced = 0
+            return True
+
+    def _read_log(self, after_seq: int) -> List[Record]:
+        records: List[Record] = []
+        if not self.log_path.exists():
+            return records
+        data = self.log_path.read_bytes()
+        if data and not data.endswith(b"\n"):
+            # Drop a torn tail from a crash so new appends start on a clean line
+            data = data[: data.rfind(b"\n") + 1]
+            with self.log_path.open("r+b") as f:
+                f.truncate(len(data))
+        for line in data.decode("utf-8").splitlines():
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if int(record.get("seq", 0)) > after_seq:
+                records.append(record)
+        return records
+
+    def tail(self, after_seq: int) -> Tuple[Optional[Record], List[Record]]:
+        # Records other writers added after after_seq. When they were already
+        # compacted away, the new snapshot comes back and the caller reloads.
+        with self._locked():
+            self._catch_up()
+            if after_seq >= self.seq:
+                return None, []
+            snapshot = None
+            if self._snapshot_seq() > after_seq:
+                snapshot = json.loads(self.snapshot_path.read_text(encoding="utf-8"))
+                after_seq = int(snapshot.get("seq", 0))
+            return snapshot, self._read_log(after_seq)
+
+    def load(self) -> Tuple[Optional[Record], List[Record]]:
+        with self._locked():
+            snapshot = None
+            if self.snapshot_path.exists():
+                try:
+                    snapshot = json.loads(self.snapshot_path.read_text(encoding="utf-8"))
+                except json.JSONDecodeError:
+                    snapshot = None
+            base_seq = int(snapshot.get("seq", 0)) if snapshot else 0
+            records = self._read_log(base_seq)
+            self.seq = int(records[-1]["seq"]) if records else base_seq
+            self.log_records = len(records)
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+            self._log_state = self._disk_state()
+            return snapshot, records
+
+    def exists(self) -> bool:
+        return self.snapshot_path.exists() or self.log_path.exists()
+
+    def reset(self) -> None:
+        with self._locked():
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+            self.snapshot_path.unlink(missing_ok=True)
+            self.log_path.unlink(missing_ok=True)
+            self._log_state = None
+            self.seq = 0
+            self.log_records = 0
+            self._unsynced = 0
@@ -0,0 +1,308 @@
+import mmap
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from analysis import SAVE_EVERY, AnalysisCache
+from rawpreview import TAG_EXIF_IFD, TAG_ORIENTATION, TiffReader, find_candidates
+from tools import RAW_EXTS, FileInfo
+
+METADATA_CACHE = Path(".keep_or_discard") / "metadata.json"
+TAG_IMAGE_WIDTH = 0x0100
+TAG_IMAGE_LENGTH = 0x0101
+TAG_MAKE = 0x010F
+TAG_MODEL = 0x0110
+TAG_DATETIME = 0x0132
+TAG_DATETIME_ORIGINAL = 0x9003
+TAG_SUBSEC_ORIGINAL = 0x9291
+TAG_PIXEL_X = 0xA002
+TAG_PIXEL_Y = 0xA003
+TAG_LENS_MODEL = 0xA434
+EXIF_DATE_FORMAT = "%Y:%m:%d %H:%M:%S"
+SHAPE_LANDSCAPE = "landscape"
+SHAPE_PORTRAIT = "portrait"
+SHAPE_SQUARE = "square"
+SHAPES = (SHAPE_LANDSCAPE, SHAPE_PORTRAIT, SHAPE_SQUARE)
+
+
+class ExifInfo(NamedTuple):
+    # taken as written by the camera: "YYYY:MM:DD HH:MM:SS", plus ".subsec" when known
+    taken: Optional[str] = None
+    make: str = ""
+    model: str = ""
+    lens: str = ""
+    # 0 when no EXIF was read (none, or a header we could not parse): unknown, not upright
+    orientation: int = 0
+    # Stored pixel size, before orientation
+    width: int = 0
+    height: int = 0
+
+    @property
+    def camera(self) -> str:
+        if not self.make or self.model.lower().startswith(self.make.split()[0].lower()):
+            return self.model or self.make
+        return f"{self.make} {self.model}".strip()
+
+    @property
+    def shape(self) -> Optional[str]:
+        if not self.width or not self.height:
+            return None
+        width, height = (self.height, self.width) if self.orientation in (5, 6, 7, 8) else (self.width, self.height)
+        if width == height:
+            return SHAPE_SQUARE
+        return SHAPE_LANDSCAPE if width > height else SHAPE_PORTRAIT
+
+
+def valid_date(text: str) -> Optional[str]:
+    # Unset clocks write "0000:00:00 00:00:00" or blanks
+    try:
+        datetime.strptime(text[:19], EXIF_DATE_FORMAT)
+    except ValueError:
+        return None
+    return text
+
+
+def parse_tiff(buf, base: int = 0) -> ExifInfo:
+    # IFD0 and the Exif IFD only: no strips, no maker notes
+    reader = TiffReader(buf, base)
+    (first,) = reader.unpack("I", 4)
+    ifd0, _ = reader.read_ifd(first)
+    exif = {}
+    if TAG_EXIF_IFD in ifd0:
+        offsets = reader.values(ifd0[TAG_EXIF_IFD])
+        if offsets:
+            try:
+                exif, _ = reader.read_ifd(offsets[0])
+            except struct.error:
+                exif = {}
+
+    def text(entries, tag: int) -> str:
+        return reader.text(entries[tag]) if tag in entries else ""
+
+    def number(entries, tag: int) -> int:
+        values = reader.values(entries[tag]) if tag in entries else []
+        return values[0] if values else 0
+
+    taken = text(exif, TAG_DATETIME_ORIGINAL) or text(ifd0, TAG_DATETIME)
+    subsec = text(exif, TAG_SUBSEC_ORIGINAL)
+    if taken and subsec.isdigit():
+        taken = f"{taken}.{subsec}"
+    width = number(exif, TAG_PIXEL_X) or number(ifd0, TAG_IMAGE_WIDTH)
+    height = number(exif, TAG_PIXEL_Y) or number(ifd0, TAG_IMAGE_LENGTH)
+    return ExifInfo(
+        valid_date(taken),
+        text(ifd0, TAG_MAKE),
+        text(ifd0, TAG_MODEL),
+        text(exif, TAG_LENS_MODEL),
+        number(ifd0, TAG_ORIENTATION) or 1,
+        width,
+        height,
+    )
+
+
+def parse_jpeg(buf, start: int = 0, end: Optional[int] = None) -> ExifInfo:
+    # Markers up to the first frame header: APP1 "Exif" holds a TIFF block, SOF the size
+    end = len(buf) if end is None else min(end, len(buf))
+    info = ExifInfo()
+    pos = start + 2
+    while pos + 4 <= end:
+        if buf[pos] != 0xFF:
+            break
+        marker = buf[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        (seg_len,) = struct.unpack_from(">H", buf, pos + 2)
+        if marker == 0xE1 and bytes(buf[pos + 4 : pos + 10]) == b"Exif\x00\x00":
+            try:
+                info = parse_tiff(buf, pos + 10)
+            except (ValueError, struct.error):
+                pass
+        elif 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack_from(">HH", buf, pos + 5)
+            return info._replace(width=width, height=height)
+        elif marker == 0xDA:
+            break
+        pos += 2 + seg_len
+    return info
+
+
+def parse_png(buf) -> ExifInfo:
+    info = ExifInfo()
+    pos = 8
+    while pos + 8 <= len(buf):
+        length, kind = struct.unpack_from(">I4s", buf, pos)
+        if kind == b"IHDR":
+            width, height = struct.unpack_from(">II", buf, pos + 8)
+            info = info._replace(width=width, height=height)
+        elif kind == b"eXIf":
+            info = parse_tiff(buf, pos + 8)._replace(width=info.width, height=info.height)
+        elif kind == b"IDAT":
+            break
+        pos += 12 + length
+    return info
+
+
+def parse_webp(buf) -> ExifInfo:
+    info = ExifInfo()
+    width = height = 0
+    pos = 12
+    while pos + 8 <= len(buf):
+        kind, length = struct.unpack_from("<4sI", buf, pos)
+        data = pos + 8
+        if kind == b"VP8X":
+            width = 1 + int.from_bytes(bytes(buf[data + 4 : data + 7]), "little")
+            height = 1 + int.from_bytes(bytes(buf[data + 7 : data + 10]), "little")
+        elif kind == b"VP8 " and not width:
+            w, h = struct.unpack_from("<HH", buf, data + 6)
+            width, height = w & 0x3FFF, h & 0x3FFF
+        elif kind == b"VP8L" and not width:
+            (bits,) = struct.unpack_from("<I", buf, data + 1)
+            width, height = (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        elif kind == b"EXIF":
+            base = data + 6 if bytes(buf[data : data + 6]) == b"Exif\x00\x00" else data
+            info = parse_tiff(buf, base)
+        pos = data + length + (length & 1)
+    return info._replace(width=width or info.width, height=height or info.height)
+
+
+def parse_raw(buf) -> ExifInfo:
+    candidates, orientation = find_candidates(buf)
+    if bytes(buf[:15]) == b"FUJIFILMCCD-RAW":
+        # RAF: the embedded JPEG carries the EXIF
+        (offset, length) = struct.unpack_from(">II", buf, 84)
+        info = parse_jpeg(buf, offset, offset + length)
+    else:
+        info = parse_tiff(buf)
+    if candidates:
+        # Previews share the sensor's aspect ratio, which is all shape needs
+        best = max(candidates, key=lambda c: c.width * c.height)
+        if best.width and best.height:
+            info = info._replace(width=best.width, height=best.height)
+    return info._replace(orientation=info.orientation if info.orientation > 1 else orientation)
+
+
+def read_metadata(path: Path) -> ExifInfo:
+    # mmap: only the pages holding headers are ever read from disk
+    try:
+        f = open(path, "rb")
+    except OSError:
+        return ExifInfo()
+    with f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return ExifInfo()  # empty file
+        try:
+            head = bytes(buf[:12])
+            if path.suffix.lower() in RAW_EXTS:
+                return parse_raw(buf)
+            if head[:2] == b"\xff\xd8":
+                return parse_jpeg(buf)
+            if head[:8] == b"\x89PNG\r\n\x1a\n":
+                return parse_png(buf)
+            if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+                return parse_webp(buf)
+            if head[:2] in (b"II", b"MM"):
+                return parse_tiff(buf)
+            return ExifInfo()
+        except (ValueError, struct.error, IndexError):
+            return ExifInfo()
+        finally:
+            buf.close()
+
+
+def metadata_file(path_str: str) -> Tuple[str, ExifInfo]:
+    return path_str, read_metadata(Path(path_str))
+
+
+def capture_time(meta: Optional[ExifInfo], info: FileInfo) -> str:
+    # Files without EXIF fall back to their modification time, in the same format
+    if meta is not None and meta.taken:
+        return meta.taken
+    return datetime.fromtimestamp(info.mtime_ns / 1e9).strftime(EXIF_DATE_FORMAT)
+
+
+class QueueFilter(NamedTuple):
+    cameras: Tuple[str, ...] = ()
+    lenses: Tuple[str, ...] = ()
+    # Inclusive days, "YYYY:MM:DD" like EXIF
+    date_from: Optional[str] = None
+    date_to: Optional[str] = None
+    shape: Optional[str] = None
+
+    @property
+    def active(self) -> bool:
+        return any(self)
+
+    def matches(self, meta: Optional[ExifInfo], info: FileInfo) -> bool:
+        meta = meta or ExifInfo()
+        if self.cameras and meta.camera not in self.cameras:
+            return False
+        if self.lenses and meta.lens not in self.lenses:
+            return False
+        day = capture_time(meta, info)[:10]
+        if self.date_from and day < self.date_from:
+            return False
+        if self.date_to and day > self.date_to:
+            return False
+        return self.shape is None or meta.shape == self.shape
+
+
+class MetadataIndex(AnalysisCache):
+    # Parsing headers mostly waits on the disk, so update() uses threads instead
+    # of the process pool the pixel analyses need
+    cache_version = 2
+
+    def __init__(self, cache_path: Path = METADATA_CACHE):
+        super().__init__(cache_path, metadata_file)
+
+    def encode(self, value: ExifInfo) -> list:
+        return list(value)
+
+    def decode(self, data: list) -> ExifInfo:
+        return ExifInfo(*data)
+
+    def update(self, infos: Sequence[FileInfo], workers: Optional[int] = None) -> int:
+        todo = self.pending(infos)
+        if not todo:
+            return 0
+        done = 0
+        with ThreadPoolExecutor(max_workers=workers or min(16, 2 * (os.cpu_count() or 4)), thread_name_prefix="exif") as pool:
+            for info, meta in zip(todo, pool.map(lambda i: read_metadata(i.path), todo)):
+                with self._lock:
+                    self.records[str(info.path)] = (info.size, info.mtime_ns, meta)
+                    self.version += 1
+                done += 1
+                if done % SAVE_EVERY == 0:
+                    self.save()
+        self.save()
+        return done
+
+    def orientation_of(self, path: Path) -> Optional[int]:
+        record = self.records.get(str(path))
+        if record is None:
+            return None
+        try:
+            st = path.stat()
+        except OSError:
+            return None
+        if (st.st_size, st.st_mtime_ns) != record[:2]:
+            return None
+        # Unknown: the preview reads it with Pillow instead
+        return record[2].orientation or None
+
+    def values(self, infos: Iterable[FileInfo]) -> Tuple[List[str], List[str]]:
+        # Cameras and lenses present, for filter choices
+        cameras, lenses = set(), set()
+        for info in infos:
+            meta = self.get(info)
+            if meta is not None:
+                if meta.camera:
+                    cameras.add(meta.camera)
+                if meta.lens:
+                    lenses.add(meta.lens)
+        return sorted(cameras), sorted(lenses)
@@ -0,0 +1,100 @@
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from decisions import DISCARD, KEEP
+from tools import MediaIndex
+
+DEST_DIRS = {KEEP: Path("keep"), DISCARD: Path("discard")}
+
+
+class PlanEntry(NamedTuple):
+    src: Path
+    dst: Path
+    size: int
+    # Identical content to hardlink from instead of copying (see dedup.py)
+    link: Optional[Path] = None
+
+
+class TransferPlan:
+    def __init__(self, index: MediaIndex, include_ambiguous_raws: bool = True, generation: int = 0):
+        self.index = index
+        self.include_ambiguous_raws = include_ambiguous_raws
+        # Bumped by the scanner whenever the index contents change
+        self.generation = generation
+        self._entries: Dict[str, List[PlanEntry]] = {}
+        self.raw_report: Dict[str, List[str]] = {}
+        self.total_files = 0
+        self.total_bytes = 0
+        self.version = 0
+        self._report_text: Tuple[int, str] = (-1, "")
+
+    @classmethod
+    def build(
+        cls,
+        index: MediaIndex,
+        decisions: Iterable[Tuple[str, str]],
+        include_ambiguous_raws: bool = True,
+        generation: int = 0,
+    ) -> "TransferPlan":
+        plan = cls(index, include_ambiguous_raws, generation)
+        for name, decision in decisions:
+            plan.add(name, decision)
+        return plan
+
+    def matches(self, index: MediaIndex, include_ambiguous_raws: bool, generation: int = 0) -> bool:
+        return (
+            self.index is index
+            and self.include_ambiguous_raws == include_ambiguous_raws
+            and self.generation == generation
+        )
+
+    def _entries_for(self, name: str, decision: str) -> Tuple[List[PlanEntry], List[str]]:
+        src = self.index.resolve(name)
+        if src is None:
+            return [], []
+        dest = DEST_DIRS[decision]
+        entries = [PlanEntry(src.path, dest / name, src.size)]
+        # A RAW-only shot is its own review item, so it is not its own sibling
+        raws = [raw for raw in self.index.raws(self.index.stem_of(src.path)) if raw.path != src.path]
+        if len(raws) <= 1 or self.include_ambiguous_raws:
+            # dest mirrors the source subfolders
+            entries.extend(PlanEntry(raw.path, dest / self.index.name_of(raw.path), raw.size) for raw in raws)
+        return entries, [raw.path.name for raw in raws]
+
+    def add(self, name: str, decision: str) -> None:
+        self.remove(name)
+        entries, raw_names = self._entries_for(name, decision)
+        self._entries[name] = entries
+        if raw_names:
+            self.raw_report[name] = raw_names
+        self.total_files += len(entries)
+        self.total_bytes += sum(e.size for e in entries)
+        self.version += 1
+
+    def remove(self, name: str) -> None:
+        entries = self._entries.pop(name, None)
+        if entries is None:
+            return
+        self.raw_report.pop(name, None)
+        self.total_files -= len(entries)
+        self.total_bytes -= sum(e.size for e in entries)
+        self.version += 1
+
+    def update(self, name: str, decision: Optional[str]) -> None:
+        if decision is None:
+            self.remove(name)
+        else:
+            self.add(name, decision)
+
+    def entries(self) -> Iterator[PlanEntry]:
+        for entries in self._entries.values():
+            yield from entries
+
+    def pairs(self) -> List[Tuple[Path, Path]]:
+        return [(e.src, e.dst) for e in self.entries()]
+
+    def raw_report_text(self) -> str:
+        if self._report_text[0] != self.version:
+            lines = [f"{k}: {', '.join(v)}" for k, v in self.raw_report.items()]
+            self._report_text = (self.version, "\n".join(lines))
+        return self._report_text[1]
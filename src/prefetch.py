@@ -0,0 +1,107 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from PIL import Image
+
+CacheKey = Tuple[str, int, int]
+
+
+class Prefetcher:
+    def __init__(
+        self,
+        loader: Callable[[Path, int], Image.Image],
+        capacity: int = 24,
+        workers: int = 4,
+    ):
+        self._loader = loader
+        self.capacity = capacity
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self._lock = threading.Lock()
+        self._images: "OrderedDict[CacheKey, Image.Image]" = OrderedDict()
+        self._pending: Dict[CacheKey, Future] = {}
+        self.hits = 0
+        self.late_hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    @staticmethod
+    def _key(path: Path, max_width: int) -> Optional[CacheKey]:
+        try:
+            mtime_ns = path.stat().st_mtime_ns
+        except OSError:
+            return None
+        return str(path), mtime_ns, max_width
+
+    def _store(self, key: CacheKey, img: Image.Image) -> None:
+        with self._lock:
+            self._images[key] = img
+            self._images.move_to_end(key)
+            while len(self._images) > self.capacity:
+                self._images.popitem(last=False)
+
+    def _load(self, key: CacheKey, path: Path, max_width: int) -> Image.Image:
+        try:
+            img = self._loader(path, max_width)
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+        self._store(key, img)
+        return img
+
+    def get(self, path: Path, max_width: int) -> Image.Image:
+        key = self._key(path, max_width)
+        if key is None:
+            return self._loader(path, max_width)
+        with self._lock:
+            img = self._images.get(key)
+            if img is not None:
+                self._images.move_to_end(key)
+                self.hits += 1
+                return img
+            future = self._pending.get(key)
+            if future is not None:
+                self.late_hits += 1
+            else:
+                self.misses += 1
+        if future is not None:
+            try:
+                return future.result()
+            except OSError:
+                pass
+        return self._load(key, path, max_width)
+
+    def schedule(self, paths: Iterable[Path], max_width: int) -> int:
+        submitted = 0
+        for path in paths:
+            key = self._key(path, max_width)
+            if key is None:
+                continue
+            with self._lock:
+                if key in self._images or key in self._pending:
+                    continue
+                if len(self._pending) >= self.capacity:
+                    break
+                future = self._pool.submit(self._load, key, path, max_width)
+                self._pending[key] = future
+            future.add_done_callback(self._count_error)
+            submitted += 1
+        return submitted
+
+    def _count_error(self, future: Future) -> None:
+        if future.exception() is not None:
+            with self._lock:
+                self.errors += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "late_hits": self.late_hits,
+                "misses": self.misses,
+                "errors": self.errors,
+                "cached": len(self._images),
+                "pending": len(self._pending),
+            }
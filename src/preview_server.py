@@ -0,0 +1,175 @@
+import mimetypes
+import os
+import re
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional, Tuple
+from urllib.parse import quote, unquote, urlsplit
+
+from previews import PREVIEW_DIR
+
+# Preview names hash the source size and mtime, so a URL never changes content
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)$")
+# Loaded by the browser to check it can reach the server at all
+PROBE_PATH = "/.probe.gif"
+PROBE_GIF = b"GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;"
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    # One "bytes=a-b" range, inclusive; None means send the whole file.
+    # Raises ValueError when the range cannot be satisfied.
+    match = RANGE_RE.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError(header)
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+class PreviewHandler(BaseHTTPRequestHandler):
+    server: "PreviewHTTPServer"
+
+    def do_HEAD(self) -> None:
+        self._serve(send_body=False)
+
+    def do_GET(self) -> None:
+        self._serve(send_body=True)
+
+    def _resolve(self) -> Optional[Path]:
+        relative = unquote(urlsplit(self.path).path).lstrip("/")
+        root = self.server.root.resolve()
+        path = (root / relative).resolve()
+        if root not in path.parents or not path.is_file():
+            return None
+        return path
+
+    def _serve(self, send_body: bool) -> None:
+        if urlsplit(self.path).path == PROBE_PATH:
+            self._serve_probe(send_body)
+            return
+        path = self._resolve()
+        if path is None:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        try:
+            f = open(path, "rb")
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND)
+            return
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            etag = f'"{path.stem}-{size}"'
+            if etag in (tag.strip() for tag in self.headers.get("If-None-Match", "").split(",")):
+                self.send_response(HTTPStatus.NOT_MODIFIED)
+                self.send_header("ETag", etag)
+                self.send_header("Cache-Control", CACHE_CONTROL)
+                self.end_headers()
+                return
+            byte_range = None
+            range_header = self.headers.get("Range")
+            # A stale If-Range means the client's partial copy is useless: send it all
+            if range_header and self.headers.get("If-Range", etag) == etag:
+                try:
+                    byte_range = parse_range(range_header, size)
+                except ValueError:
+                    self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                    self.send_header("Content-Range", f"bytes */{size}")
+                    self.end_headers()
+                    return
+            start, end = byte_range if byte_range is not None else (0, size - 1)
+            self.send_response(HTTPStatus.PARTIAL_CONTENT if byte_range is not None else HTTPStatus.OK)
+            self.send_header("Content-Type", mimetypes.guess_type(path.name)[0] or "application/octet-stream")
+            self.send_header("Content-Length", str(end - start + 1))
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("ETag", etag)
+            self.send_header("Cache-Control", CACHE_CONTROL)
+            if byte_range is not None:
+                self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+            self.end_headers()
+            if send_body and end >= start:
+                try:
+                    # socket.sendfile: os.sendfile where available, so the bytes never enter Python
+                    self.connection.sendfile(f, start, end - start + 1)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+    def _serve_probe(self, send_body: bool) -> None:
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "image/gif")
+        self.send_header("Content-Length", str(len(PROBE_GIF)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        if send_body:
+            self.wfile.write(PROBE_GIF)
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+class PreviewHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], root: Path):
+        super().__init__(address, PreviewHandler)
+        self.root = Path(root)
+
+
+class PreviewServer:
+    # Serves the preview cache read-only so the browser caches each preview by
+    # URL instead of Streamlit re-encoding and resending it on every rerun
+    def __init__(self, root: Path = PREVIEW_DIR):
+        self.root = Path(root)
+        self._httpd: Optional[PreviewHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> Optional[int]:
+        return self._httpd.server_address[1] if self._httpd is not None else None
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> "PreviewServer":
+        if self._httpd is None:
+            self.root.mkdir(parents=True, exist_ok=True)
+            self._httpd = PreviewHTTPServer((host, port), self.root)
+            self._thread = threading.Thread(target=self._httpd.serve_forever, name="preview-server", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+            self._thread = None
+
+    def base_url(self, host: str = "127.0.0.1") -> str:
+        if ":" in host:
+            host = f"[{host}]"
+        return f"http://{host}:{self.port}"
+
+    def url_for(self, preview: Path, host: str = "127.0.0.1") -> Optional[str]:
+        if self._httpd is None:
+            return None
+        try:
+            relative = Path(preview).resolve().relative_to(self.root.resolve())
+        except ValueError:
+            return None
+        return f"{self.base_url(host)}/{quote(relative.as_posix())}"
+
+    def probe_url(self, host: str = "127.0.0.1") -> Optional[str]:
+        if self._httpd is None:
+            return None
+        return self.base_url(host) + PROBE_PATH
@@ -0,0 +1,222 @@
+import hashlib
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Sequence, Tuple
+
+from PIL import Image
+
+from rawpreview import iter_previews
+from timing import span
+from tools import RAW_EXTS
+
+PREVIEW_DIR = Path(".keep_or_discard") / "previews"
+DEFAULT_MAX_WIDTH = 1200
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+PREVIEW_FORMATS = {"JPEG": ".jpg", "WEBP": ".webp"}
+PREVIEW_QUALITY = 85
+ORIENTATION_TAG = 0x0112
+
+# Same mapping ImageOps.exif_transpose uses, applied after downscaling.
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT,
+    3: Image.Transpose.ROTATE_180,
+    4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE,
+    6: Image.Transpose.ROTATE_270,
+    7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+
+def source_signature(path: Path) -> Tuple[int, int]:
+    st = path.stat()
+    return st.st_size, st.st_mtime_ns
+
+
+def preview_key(path: Path, size: int, mtime_ns: int, max_width: int) -> str:
+    raw = f"{path.resolve()}|{size}|{mtime_ns}|{max_width}"
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def read_orientation(img: Image.Image) -> int:
+    try:
+        return int(img.getexif().get(ORIENTATION_TAG, 1))
+    except (ValueError, TypeError, OSError):
+        return 1
+
+
+def downscale(img: Image.Image, max_width: int, orientation: int = 1) -> Image.Image:
+    # max_width applies to the oriented image, so rotated shots limit the height here
+    swapped = orientation in (5, 6, 7, 8)
+    current = img.height if swapped else img.width
+    if current > max_width:
+        factor = current // max_width
+        if factor >= 2:
+            img = img.reduce(factor)
+            current = img.height if swapped else img.width
+        if current > max_width:
+            ratio = max_width / current
+            size = (max(1, round(img.width * ratio)), max(1, round(img.height * ratio)))
+            with span("preview.resize"):
+                img = img.resize(size, Image.Resampling.LANCZOS)
+    method = ORIENTATION_TRANSPOSE.get(orientation)
+    if method is not None:
+        with span("preview.exif_transpose"):
+            img = img.transpose(method)
+    return img
+
+
+def render_raw_preview(
+    path: Path, max_width: int = DEFAULT_MAX_WIDTH, orientation: Optional[int] = None
+) -> Image.Image:
+    # Embedded JPEG instead of a full RAW develop; smaller previews are the fallback
+    for preview in iter_previews(path, max_width):
+        try:
+            with span("preview.decode_raw"), Image.open(io.BytesIO(preview.data)) as img:
+                img.draft("RGB", (max_width, max_width))
+                frame = img.convert("RGB")
+        except (OSError, SyntaxError):
+            continue
+        return downscale(frame, max_width, orientation or preview.orientation)
+    raise OSError(f"No usable embedded preview in {path.name}")
+
+
+def render_preview(path: Path, max_width: int = DEFAULT_MAX_WIDTH, orientation: Optional[int] = None) -> Image.Image:
+    # orientation: already known from the metadata index, so EXIF is not parsed again
+    if path.suffix.lower() in RAW_EXTS:
+        return render_raw_preview(path, max_width, orientation)
+    with span("preview.decode"), Image.open(path) as img:
+        if orientation is None:
+            orientation = read_orientation(img)
+        if img.format == "JPEG":
+            # draft() lets libjpeg decode at 1/2, 1/4 or 1/8 scale directly
+            img.draft("RGB", (max_width, max_width))
+        frame = img.convert("RGB")
+    return downscale(frame, max_width, orientation)
+
+
+class PreviewCache:
+    def __init__(
+        self,
+        root: Path = PREVIEW_DIR,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        fmt: str = "JPEG",
+        quality: int = PREVIEW_QUALITY,
+        orientation_of: Optional[Callable[[Path], Optional[int]]] = None,
+    ):
+        if fmt not in PREVIEW_FORMATS:
+            raise ValueError(f"Unsupported preview format: {fmt}")
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.fmt = fmt
+        self.quality = quality
+        self.orientation_of = orientation_of
+        self._lock = threading.Lock()
+        self._total_bytes: Optional[int] = None
+
+    def cached_path(self, src: Path, max_width: int = DEFAULT_MAX_WIDTH) -> Path:
+        size, mtime_ns = source_signature(src)
+        key = preview_key(src, size, mtime_ns, max_width)
+        return self.root / key[:2] / f"{key}{PREVIEW_FORMATS[self.fmt]}"
+
+    def get(self, src: Path, max_width: int = DEFAULT_MAX_WIDTH) -> Path:
+        target = self.cached_path(src, max_width)
+        if target.exists():
+            try:
+                # mtime doubles as the LRU clock
+                os.utime(target)
+            except OSError:
+                pass
+            return target
+        orientation = self.orientation_of(src) if self.orientation_of is not None else None
+        img = render_preview(src, max_width, orientation)
+        with span("preview.write"):
+            self._write(img, target)
+        return target
+
+    def _write(self, img: Image.Image, target: Path) -> None:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = target.with_name(f"{target.name}.{threading.get_ident()}.tmp")
+        img.save(tmp_path, format=self.fmt, quality=self.quality)
+        written = tmp_path.stat().st_size
+        tmp_path.replace(target)
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_total()
+            else:
+                self._total_bytes += written
+            over_budget = self._total_bytes > self.max_bytes
+        if over_budget:
+            self.evict(keep=target)
+
+    def _entries(self) -> List[Tuple[float, int, Path]]:
+        entries = []
+        if not self.root.exists():
+            return entries
+        for bucket in os.scandir(self.root):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                if entry.name.endswith(".tmp"):
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, Path(entry.path)))
+        return entries
+
+    def _scan_total(self) -> int:
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self, keep: Optional[Path] = None) -> int:
+        # Trim to 90% of the budget so we don't evict on every write
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            limit = int(self.max_bytes * 0.9)
+            removed = 0
+            for _, size, path in entries:
+                if total <= limit:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    path.unlink()
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+            self._total_bytes = total
+        return removed
+
+    def get_many(
+        self,
+        paths: Sequence[Path],
+        max_width: int = DEFAULT_MAX_WIDTH,
+        workers: Optional[int] = None,
+    ) -> List[Optional[Path]]:
+        # Batches (grid pages, warm-up): hits return at once, misses render in parallel
+        def build(path: Path) -> Optional[Path]:
+            try:
+                return self.get(path, max_width)
+            except OSError:
+                return None
+
+        if not paths:
+            return []
+        with ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 4, thread_name_prefix="previews") as pool:
+            return list(pool.map(build, paths))
+
+    def warm(
+        self,
+        paths: Iterable[Path],
+        max_width: int = DEFAULT_MAX_WIDTH,
+        workers: Optional[int] = None,
+    ) -> Tuple[int, int]:
+        results = self.get_many(list(paths), max_width, workers)
+        ok = sum(1 for r in results if r is not None)
+        return ok, len(results) - ok
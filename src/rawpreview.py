@@ -0,0 +1,245 @@
+import mmap
+import struct
+from pathlib import Path
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+# TIFF tags used to locate embedded JPEGs
+TAG_COMPRESSION = 0x0103
+TAG_STRIP_OFFSETS = 0x0111
+TAG_ORIENTATION = 0x0112
+TAG_STRIP_BYTE_COUNTS = 0x0117
+TAG_SUB_IFDS = 0x014A
+TAG_JPEG_OFFSET = 0x0201
+TAG_JPEG_LENGTH = 0x0202
+TAG_EXIF_IFD = 0x8769
+TAG_RW2_JPEG = 0x002E  # Panasonic JpgFromRaw
+
+TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+# Old-style JPEG (6) in most RAW formats; DNG previews use JPEG (7), which
+# also covers the lossless raw data itself, so candidates are checked by SOF
+JPEG_COMPRESSION = {6, 7}
+# Baseline, extended and progressive Huffman JPEG; lossless (SOF3) and
+# arithmetic-coded frames do not decode with Pillow
+DECODABLE_SOF = {0xC0, 0xC1, 0xC2}
+TIFF_MAGIC = {42, 0x4F52, 0x5352, 0x55}  # standard, ORF (IIRO / IIRS), RW2
+MAX_IFDS = 64
+
+
+class Candidate(NamedTuple):
+    offset: int
+    length: int
+    width: int
+    height: int
+
+
+class RawPreview(NamedTuple):
+    data: bytes
+    orientation: int
+    width: int
+    height: int
+
+
+class TiffReader:
+    def __init__(self, buf, base: int = 0):
+        self.buf = buf
+        self.base = base
+        order = bytes(buf[base : base + 2])
+        if order == b"II":
+            self.endian = "<"
+        elif order == b"MM":
+            self.endian = ">"
+        else:
+            raise ValueError("not a TIFF container")
+        (magic,) = self.unpack("H", 2)
+        if magic not in TIFF_MAGIC:
+            raise ValueError("unsupported TIFF magic")
+
+    def unpack(self, fmt: str, offset: int) -> Tuple:
+        return struct.unpack_from(self.endian + fmt, self.buf, self.base + offset)
+
+    def read_ifd(self, offset: int) -> Tuple[Dict[int, Tuple[int, int, int]], int]:
+        (count,) = self.unpack("H", offset)
+        entries = {}
+        for i in range(count):
+            tag, typ, n = self.unpack("HHI", offset + 2 + i * 12)
+            entries[tag] = (typ, n, offset + 2 + i * 12 + 8)
+        (next_ifd,) = self.unpack("I", offset + 2 + count * 12)
+        return entries, next_ifd
+
+    def values(self, entry: Tuple[int, int, int]) -> List[int]:
+        typ, n, value_pos = entry
+        size = TYPE_SIZES.get(typ, 1)
+        fmt = {1: "B", 3: "H", 4: "I", 7: "B", 13: "I"}.get(typ)
+        if fmt is None:
+            return []
+        pos = value_pos
+        if size * n > 4:
+            (pos,) = self.unpack("I", value_pos)
+        if typ in (1, 7) and n > 4:
+            return []  # blobs are handled separately
+        return list(self.unpack(f"{n}{fmt}", pos))
+
+    def text(self, entry: Tuple[int, int, int]) -> str:
+        typ, n, value_pos = entry
+        if typ != 2 or n == 0:
+            return ""
+        pos = self.base + value_pos
+        if n > 4:
+            (offset,) = self.unpack("I", value_pos)
+            pos = self.base + offset
+        return bytes(self.buf[pos : pos + n]).split(b"\0", 1)[0].decode("utf-8", "replace").strip()
+
+    def blob(self, entry: Tuple[int, int, int]) -> Tuple[int, int]:
+        typ, n, value_pos = entry
+        if n <= 4:
+            return self.base + value_pos, n
+        (pos,) = self.unpack("I", value_pos)
+        return self.base + pos, n
+
+    def walk(self) -> List[Dict[int, Tuple[int, int, int]]]:
+        (first,) = self.unpack("I", 4)
+        pending = [first]
+        seen: Set[int] = set()
+        ifds = []
+        while pending and len(ifds) < MAX_IFDS:
+            offset = pending.pop(0)
+            if offset == 0 or offset in seen or self.base + offset >= len(self.buf):
+                continue
+            seen.add(offset)
+            try:
+                entries, next_ifd = self.read_ifd(offset)
+            except struct.error:
+                continue
+            ifds.append(entries)
+            pending.append(next_ifd)
+            for tag in (TAG_SUB_IFDS, TAG_EXIF_IFD):
+                if tag in entries:
+                    try:
+                        pending.extend(self.values(entries[tag]))
+                    except struct.error:
+                        pass
+        return ifds
+
+
+def jpeg_frame(buf, offset: int, length: int) -> Tuple[int, int, int]:
+    # Walk markers up to the first SOF to read its type and dimensions
+    # without decoding: (marker, width, height), zeros if there is none
+    end = min(offset + length, len(buf))
+    pos = offset + 2
+    while pos + 9 < end:
+        if buf[pos] != 0xFF:
+            return 0, 0, 0
+        marker = buf[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        (seg_len,) = struct.unpack_from(">H", buf, pos + 2)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width = struct.unpack_from(">HH", buf, pos + 5)
+            return marker, width, height
+        pos += 2 + seg_len
+    return 0, 0, 0
+
+
+def _is_jpeg(buf, offset: int, length: int) -> bool:
+    return length > 4 and offset + length <= len(buf) and buf[offset] == 0xFF and buf[offset + 1] == 0xD8
+
+
+def _candidate(buf, offset: int, length: int) -> Optional[Candidate]:
+    if not _is_jpeg(buf, offset, length):
+        return None
+    marker, width, height = jpeg_frame(buf, offset, length)
+    if marker not in DECODABLE_SOF:
+        return None
+    return Candidate(offset, length, width, height)
+
+
+def _tiff_candidates(buf, base: int = 0) -> Tuple[List[Candidate], int]:
+    reader = TiffReader(buf, base)
+    ifds = reader.walk()
+    candidates = []
+    orientation = 1
+    for i, entries in enumerate(ifds):
+        try:
+            if i == 0 and TAG_ORIENTATION in entries:
+                orientation = reader.values(entries[TAG_ORIENTATION])[0] or 1
+            if TAG_JPEG_OFFSET in entries and TAG_JPEG_LENGTH in entries:
+                (offset,) = reader.values(entries[TAG_JPEG_OFFSET])[:1]
+                (length,) = reader.values(entries[TAG_JPEG_LENGTH])[:1]
+                candidates.append(_candidate(buf, base + offset, length))
+            compression = reader.values(entries[TAG_COMPRESSION])[:1] if TAG_COMPRESSION in entries else []
+            if compression and compression[0] in JPEG_COMPRESSION and TAG_STRIP_OFFSETS in entries:
+                offsets = reader.values(entries[TAG_STRIP_OFFSETS])
+                lengths = reader.values(entries.get(TAG_STRIP_BYTE_COUNTS, (4, 0, 0)))
+                if len(offsets) == 1 and len(lengths) == 1:
+                    candidates.append(_candidate(buf, base + offsets[0], lengths[0]))
+            if TAG_RW2_JPEG in entries:
+                offset, length = reader.blob(entries[TAG_RW2_JPEG])
+                candidates.append(_candidate(buf, offset, length))
+        except (struct.error, ValueError, IndexError):
+            continue
+    return [c for c in candidates if c is not None], orientation
+
+
+def _raf_candidates(buf) -> Tuple[List[Candidate], int]:
+    # Fujifilm: big-endian JPEG offset/length at fixed header positions
+    offset, length = struct.unpack_from(">II", buf, 84)
+    candidate = _candidate(buf, offset, length)
+    orientation = 1
+    if candidate is not None:
+        # The embedded JPEG carries its own EXIF (and orientation)
+        try:
+            exif_pos = bytes(buf[offset : offset + 64]).find(b"Exif\x00\x00")
+            if exif_pos >= 0:
+                _, orientation = _tiff_candidates(buf, offset + exif_pos + 6)
+        except (ValueError, struct.error):
+            pass
+    return ([candidate] if candidate else []), orientation
+
+
+def find_candidates(buf) -> Tuple[List[Candidate], int]:
+    if bytes(buf[:15]) == b"FUJIFILMCCD-RAW":
+        return _raf_candidates(buf)
+    return _tiff_candidates(buf)
+
+
+def choose(candidates: List[Candidate], max_width: Optional[int]) -> List[Candidate]:
+    # Best first: the smallest preview that still covers max_width, then larger
+    # ones, then anything smaller down to the thumbnail.
+    ordered = sorted(set(candidates), key=lambda c: (c.width * c.height, c.length))
+    if not max_width:
+        return ordered[::-1]
+    big_enough = [c for c in ordered if max(c.width, c.height) >= max_width]
+    too_small = [c for c in ordered if max(c.width, c.height) < max_width]
+    return big_enough + too_small[::-1]
+
+
+def iter_previews(path: Path, max_width: Optional[int] = None) -> Iterator[RawPreview]:
+    # Yields copies in preference order so a corrupt preview can fall back to the next one
+    with open(path, "rb") as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return  # empty file
+        try:
+            try:
+                candidates, orientation = find_candidates(buf)
+            except (ValueError, struct.error):
+                return
+            for candidate in choose(candidates, max_width):
+                if candidate.width and candidate.height:
+                    data = buf[candidate.offset : candidate.offset + candidate.length]
+                    yield RawPreview(data, orientation, candidate.width, candidate.height)
+        finally:
+            buf.close()
+
+
+def extract_preview(path: Path, max_width: Optional[int] = None) -> Optional[RawPreview]:
+    return next(iter_previews(path, max_width), None)
+
+
+def list_previews(path: Path) -> List[Candidate]:
+    with open(path, "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            candidates, _ = find_candidates(buf)
+    return choose(candidates, None)
@@ -0,0 +1,270 @@
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+from catalog import Catalog
+from tools import IMAGE_EXTS, FileInfo, MediaIndex, scan_dir
+
+
+class MediaScanner:
+    def __init__(
+        self,
+        root: Path,
+        recursive: bool = True,
+        page_size: int = 48,
+        refresh_interval: float = 2.0,
+        catalog: Optional[Catalog] = None,
+        settle: float = 0.0,
+    ):
+        self.root = Path(root)
+        self.catalog = catalog
+        self.recursive = recursive
+        self.page_size = page_size
+        self.refresh_interval = refresh_interval
+        # Watch mode: a new file is queued once it has gone `settle` seconds
+        # without being modified and is not open for writing (see watcher.py)
+        self.settle = settle
+        self.writing: Dict[Path, float] = {}
+        self.index = MediaIndex(self.root)
+        # Review order is append-only so positions already shown never shift
+        self.order: List[Path] = []
+        self.generation = 0
+        self.first_page = threading.Event()
+        self.done = threading.Event()
+        # Queued path -> its stored position; only the relative order matters,
+        # so rows seeded from the catalog keep theirs
+        self._queued: Dict[Path, int] = {}
+        self._next_position = 0
+        self._dir_mtimes: Dict[Path, int] = {}
+        self._dir_files: Dict[Path, Set[str]] = {}
+        # Folders holding files that were indexed but not queued yet
+        self._settling: Set[Path] = set()
+        # Not written to the catalog yet: folders rescanned (their rows are
+        # upserted), directory mtimes that moved or vanished, removed names.
+        # Until the first save everything is written at once.
+        self._saved = False
+        self._dirty_folders: Set[Path] = set()
+        self._dirty_mtimes: Set[Path] = set()
+        self._removed: Set[str] = set()
+        self._lock = threading.RLock()
+        self._refresh_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._last_refresh = 0.0
+
+    def start(self) -> "MediaScanner":
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="media-scan", daemon=True)
+            self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        try:
+            if self.catalog is not None and self._seed_from_catalog():
+                # Only folders whose mtime moved since the catalog was written get rescanned
+                self._refresh()
+            else:
+                self._scan_tree(self.root)
+            self._persist()
+        finally:
+            self._last_refresh = time.monotonic()
+            self.first_page.set()
+            self.done.set()
+
+    def _seed_from_catalog(self) -> bool:
+        dir_mtimes, rows = self.catalog.load_inventory(str(self.root))
+        if not dir_mtimes:
+            return False
+        with self._lock:
+            for row in rows:
+                info = FileInfo(self.root / row.name, row.size, row.mtime_ns)
+                self.index.add(info, row.is_image)
+                self._dir_files.setdefault(info.path.parent, set()).add(row.name)
+                if row.position is not None and info.path not in self._queued:
+                    self._enqueue(info.path, row.position)
+            self._dir_mtimes = {Path(path): mtime_ns for path, mtime_ns in dir_mtimes.items()}
+            self._saved = True
+            self.generation += 1
+        self.first_page.set()
+        return True
+
+    def _row(self, name: str, info: FileInfo) -> tuple:
+        return (
+            name,
+            self.index.stem_of(info.path),
+            info.size,
+            info.mtime_ns,
+            info.path.suffix.lower() in IMAGE_EXTS,
+            self._queued.get(info.path),
+        )
+
+    def _persist(self) -> None:
+        if self.catalog is None:
+            return
+        files = self.index.files
+        with self._lock:
+            if not self._saved:
+                rows = [self._row(name, info) for name, info in files.items()]
+                dir_mtimes = {str(path): mtime_ns for path, mtime_ns in self._dir_mtimes.items()}
+            else:
+                names = set().union(*(self._dir_files.get(folder, ()) for folder in self._dirty_folders))
+                rows = [self._row(name, files[name]) for name in names if name in files]
+                removed = [name for name in self._removed if name not in files]
+                dir_mtimes = {
+                    str(folder): self._dir_mtimes[folder]
+                    for folder in self._dirty_mtimes
+                    if folder in self._dir_mtimes
+                }
+                removed_dirs = [str(folder) for folder in self._dirty_mtimes if folder not in self._dir_mtimes]
+            full = not self._saved
+            self._saved = True
+            self._dirty_folders.clear()
+            self._dirty_mtimes.clear()
+            self._removed.clear()
+        if full:
+            self.catalog.save_inventory(str(self.root), dir_mtimes, rows)
+        elif rows or removed or dir_mtimes or removed_dirs:
+            self.catalog.update_inventory(str(self.root), dir_mtimes, removed_dirs, rows, removed)
+
+    def _enqueue(self, path: Path, position: Optional[int] = None) -> None:
+        position = self._next_position if position is None else position
+        self._queued[path] = position
+        self._next_position = max(self._next_position, position + 1)
+        self.order.append(path)
+
+    def _scan_tree(self, top: Path) -> None:
+        stack = [top]
+        while stack:
+            stack.extend(reversed(self._scan_one(stack.pop())))
+
+    def _unsettled(self, info: FileInfo, now_ns: int) -> bool:
+        return info.path in self.writing or now_ns - info.mtime_ns < self.settle * 1e9
+
+    def _scan_one(self, folder: Path) -> List[Path]:
+        try:
+            mtime_ns = folder.stat().st_mtime_ns
+            files, subdirs = scan_dir(folder)
+        except OSError:
+            self._forget(folder)
+            return []
+        now_ns = time.time_ns()
+        with self._lock:
+            names = set()
+            # Stems with a file still being written: its RAW+JPEG pair is queued together later
+            unsettled: Set[str] = set()
+            for info, is_image in files:
+                self.index.add(info, is_image)
+                names.add(self.index.name_of(info.path))
+                if self.settle and info.path not in self._queued and self._unsettled(info, now_ns):
+                    unsettled.add(self.index.stem_of(info.path))
+            # Queued after the whole folder is indexed so RAW-only stems are known
+            for info, _ in files:
+                if info.path not in self._queued and self.index.is_review_item(info.path):
+                    if unsettled and self.index.stem_of(info.path) in unsettled:
+                        continue
+                    self._enqueue(info.path)
+            if unsettled:
+                self._settling.add(folder)
+            else:
+                self._settling.discard(folder)
+            for name in self._dir_files.get(folder, set()) - names:
+                self.index.remove(name)
+                self._removed.add(name)
+            self._dir_files[folder] = names
+            if self._dir_mtimes.get(folder) != mtime_ns:
+                self._dir_mtimes[folder] = mtime_ns
+                self._dirty_mtimes.add(folder)
+            self._dirty_folders.add(folder)
+            self.generation += 1
+            if len(self.order) >= self.page_size:
+                self.first_page.set()
+        return subdirs if self.recursive else []
+
+    def _forget(self, folder: Path) -> None:
+        with self._lock:
+            for known in list(self._dir_files):
+                if known == folder or folder in known.parents:
+                    for name in self._dir_files.pop(known):
+                        self.index.remove(name)
+                        self._removed.add(name)
+                    self._dir_mtimes.pop(known, None)
+                    self._dirty_mtimes.add(known)
+            self.generation += 1
+
+    def attach_catalog(self, catalog: Catalog) -> None:
+        self.catalog = catalog
+        with self._lock:
+            # Whatever the catalog holds for this folder may be stale
+            self._saved = False
+        if self.done.is_set():
+            threading.Thread(target=self._persist, name="media-catalog", daemon=True).start()
+
+    def refresh(self) -> bool:
+        # A directory's mtime changes when entries are added, removed or renamed
+        if not self.done.is_set() or not self._refresh_lock.acquire(blocking=False):
+            return False
+        try:
+            changed = self._refresh()
+            if changed:
+                self._persist()
+            return changed
+        finally:
+            self._refresh_lock.release()
+
+    def _refresh(self) -> bool:
+        self._last_refresh = time.monotonic()
+        changed = []
+        for folder, mtime_ns in list(self._dir_mtimes.items()):
+            try:
+                current = folder.stat().st_mtime_ns
+            except OSError:
+                current = None
+            if current != mtime_ns or folder in self._settling:
+                changed.append(folder)
+        self._rescan(changed)
+        return bool(changed)
+
+    def _rescan(self, folders: Iterable[Path]) -> None:
+        for folder in folders:
+            if folder not in self._dir_mtimes:
+                continue  # dropped with a parent that vanished
+            for sub in self._scan_one(folder):
+                if sub not in self._dir_mtimes:
+                    self._scan_tree(sub)
+
+    def rescan(self, folders: Optional[Iterable[Path]] = None) -> List[Path]:
+        # For the watcher: rescan the folders it saw change (None: compare
+        # directory mtimes) plus those still settling; returns what got queued
+        if not self.done.is_set():
+            return []
+        with self._refresh_lock:
+            start = len(self.order)
+            if folders is None:
+                changed = self._refresh()
+            else:
+                self._last_refresh = time.monotonic()
+                targets = set(folders) | set(self._settling)
+                self._rescan(sorted(targets))
+                changed = bool(targets)
+            if changed:
+                self._persist()
+            return self.order[start:]
+
+    def folders(self) -> List[Path]:
+        with self._lock:
+            return list(self._dir_mtimes)
+
+    @property
+    def settling(self) -> bool:
+        return bool(self._settling)
+
+    def refresh_if_due(self) -> bool:
+        if time.monotonic() - self._last_refresh < self.refresh_interval:
+            return False
+        return self.refresh()
+
+    def wait_first_page(self, timeout: Optional[float] = None) -> bool:
+        return self.first_page.wait(timeout)
+
+    def wait_done(self, timeout: Optional[float] = None) -> bool:
+        return self.done.wait(timeout)
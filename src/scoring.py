@@ -0,0 +1,91 @@
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # a dependency, but scoring degrades to disabled if it is missing
+    np = None
+
+from analysis import AnalysisCache
+from previews import render_preview
+from tools import FileInfo
+
+SCORE_CACHE = Path(".keep_or_discard") / "scores.json"
+# Laplacian variance depends on resolution, so every image is scored at the same width
+SCORE_WIDTH = 512
+SHADOW_LEVEL = 4
+HIGHLIGHT_LEVEL = 251
+DEFAULT_SHARPNESS_THRESHOLD = 60.0
+DEFAULT_CLIPPING_THRESHOLD = 0.25
+
+
+class Score(NamedTuple):
+    sharpness: Optional[float]
+    shadows: float = 0.0
+    highlights: float = 0.0
+
+    def is_suspect(self, sharpness_threshold: float, clipping_threshold: float) -> bool:
+        if self.sharpness is None:
+            return False
+        return (
+            self.sharpness < sharpness_threshold
+            or self.shadows > clipping_threshold
+            or self.highlights > clipping_threshold
+        )
+
+
+def scoring_available() -> bool:
+    return np is not None
+
+
+def measure(gray: "np.ndarray") -> Score:
+    # 4-neighbour Laplacian with slicing instead of a convolution
+    a = gray.astype(np.float32)
+    lap = a[1:-1, :-2] + a[1:-1, 2:] + a[:-2, 1:-1] + a[2:, 1:-1] - 4.0 * a[1:-1, 1:-1]
+    hist = np.bincount(gray.ravel(), minlength=256)
+    total = gray.size or 1
+    return Score(
+        float(lap.var()),
+        float(hist[: SHADOW_LEVEL + 1].sum() / total),
+        float(hist[HIGHLIGHT_LEVEL:].sum() / total),
+    )
+
+
+def score_file(path_str: str) -> Tuple[str, Score]:
+    try:
+        img = render_preview(Path(path_str), SCORE_WIDTH)
+    except (OSError, SyntaxError, ValueError):
+        return path_str, Score(None)
+    return path_str, measure(np.asarray(img.convert("L")))
+
+
+class ScoreIndex(AnalysisCache):
+    def __init__(self, cache_path: Path = SCORE_CACHE):
+        if np is None:
+            raise RuntimeError("NumPy is required for scoring")
+        super().__init__(cache_path, score_file)
+
+    def encode(self, value: Score) -> list:
+        return list(value)
+
+    def decode(self, data: list) -> Score:
+        return Score(*data)
+
+    def suspects(
+        self,
+        infos: Sequence[FileInfo],
+        sharpness_threshold: float = DEFAULT_SHARPNESS_THRESHOLD,
+        clipping_threshold: float = DEFAULT_CLIPPING_THRESHOLD,
+    ) -> Dict[Path, Score]:
+        found = {}
+        for info in infos:
+            score = self.get(info)
+            if score is not None and score.is_suspect(sharpness_threshold, clipping_threshold):
+                found[info.path] = score
+        return found
+
+
+def suspects_first(queue: Sequence[Path], suspects: Dict[Path, Score]) -> List[Path]:
+    # Suspects move to the front, blurriest first; everything else keeps queue order
+    flagged = sorted((p for p in queue if p in suspects), key=lambda p: suspects[p].sharpness)
+    return flagged + [p for p in queue if p not in suspects]
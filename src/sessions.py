@@ -0,0 +1,191 @@
+import json
+import os
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from catalog import DEFAULT_SESSION, Catalog
+from decisions import ACTION_DECISION, KEEP, DecisionStore
+from journal import SESSION_LOG, SESSION_SNAPSHOT, SessionJournal
+
+SESSIONS_DIR = Path(".keep_or_discard") / "sessions"
+SHARDS_FILE = SESSIONS_DIR / "shards.json"
+# The session without a reviewer name: the single-user files from before
+SHARED = ""
+
+
+class ReviewerSession(NamedTuple):
+    source_dir: str
+    mode: str
+    idx: int
+    decisions: DecisionStore
+    history: List[Tuple]
+
+
+class Shard(NamedTuple):
+    start: int
+    end: int
+    total: int
+    # Name at start when the folder was split, to notice that it changed since
+    first: Optional[str] = None
+
+
+class MergeResult(NamedTuple):
+    decisions: List[Tuple[str, str]]
+    conflicts: Dict[str, Dict[str, str]]
+    counts: Dict[str, int]
+
+
+def reviewer_slug(name: str) -> str:
+    return re.sub(r"[^\w.-]+", "-", name.strip()).strip(".-")[:64]
+
+
+def reviewer_label(reviewer: str) -> str:
+    return reviewer or "(compartida)"
+
+
+def session_paths(reviewer: str) -> Tuple[Path, Path]:
+    if not reviewer:
+        return SESSION_SNAPSHOT, SESSION_LOG
+    folder = SESSIONS_DIR / reviewer
+    return folder / SESSION_SNAPSHOT.name, folder / SESSION_LOG.name
+
+
+def catalog_session(reviewer: str) -> str:
+    return reviewer or DEFAULT_SESSION
+
+
+def list_reviewers(catalog: Optional[Catalog] = None) -> List[str]:
+    found = set()
+    if catalog is not None:
+        found.update(SHARED if name == DEFAULT_SESSION else name for name, _ in catalog.sessions())
+    else:
+        if SESSION_SNAPSHOT.exists() or SESSION_LOG.exists():
+            found.add(SHARED)
+        if SESSIONS_DIR.is_dir():
+            for entry in os.scandir(SESSIONS_DIR):
+                if entry.is_dir() and any(p.exists() for p in session_paths(entry.name)):
+                    found.add(entry.name)
+    return sorted(found)
+
+
+def load_journal_session(journal: SessionJournal) -> Optional[ReviewerSession]:
+    # Snapshot plus log replay without Streamlit (CLI, merges)
+    snapshot, records = journal.load()
+    if snapshot is None and not records:
+        return None
+    payload = snapshot or {}
+    source_dir = payload.get("source_dir", "media")
+    mode = payload.get("mode", "copy")
+    idx = int(payload.get("idx", 0))
+    history = [tuple(h) for h in payload.get("history", [])]
+    store = DecisionStore.from_lists(
+        payload.get("mantener", []), payload.get("desechar", []), {h[1]: int(h[2]) for h in history}
+    )
+    for record in records:
+        op = record.get("op")
+        if op in ACTION_DECISION:
+            previous = store.record(record["name"], ACTION_DECISION[op], int(record["idx"]))
+            entry = (op, record["name"], int(record["idx"]), previous)
+            history.append(entry + (record["batch"],) if record.get("batch") else entry)
+            idx = int(record["idx"]) + 1
+        elif op == "undo" and history:
+            entry = history.pop()
+            store.restore(entry[1], entry[3] if len(entry) > 3 else None, int(entry[2]))
+            idx = int(entry[2])
+        elif op == "meta":
+            mode = record.get("mode", mode)
+            source_dir = record.get("source_dir", source_dir)
+    return ReviewerSession(source_dir, mode, idx, store, history)
+
+
+def load_reviewer_session(reviewer: str, catalog: Optional[Catalog] = None) -> Optional[ReviewerSession]:
+    if catalog is not None:
+        session = catalog.load_session(catalog_session(reviewer))
+        if session is not None:
+            store = DecisionStore()
+            for name, decision, position in session.decisions:
+                store.record(name, decision, position)
+            return ReviewerSession(session.source_dir, session.mode, session.idx, store, list(session.history))
+    return load_journal_session(SessionJournal(*session_paths(reviewer)))
+
+
+def sessions_signature(reviewers: Iterable[str], catalog: Optional[Catalog] = None) -> tuple:
+    # Changes whenever any reviewer records a decision; keys the combined plan
+    if catalog is not None:
+        return tuple(catalog.sessions())
+    signature = []
+    for reviewer in reviewers:
+        for path in session_paths(reviewer):
+            try:
+                st = os.stat(path)
+            except OSError:
+                signature.append((reviewer, path.name, None))
+                continue
+            signature.append((reviewer, path.name, st.st_ino, st.st_mtime_ns, st.st_size))
+    return tuple(signature)
+
+
+def merge_sessions(reviewers: Sequence[str], catalog: Optional[Catalog] = None) -> MergeResult:
+    # Disagreements keep the photo: a discard can always be redone, a lost keep cannot
+    merged: Dict[str, str] = {}
+    votes: Dict[str, Dict[str, str]] = {}
+    counts: Dict[str, int] = {}
+    for reviewer in reviewers:
+        session = load_reviewer_session(reviewer, catalog)
+        if session is None:
+            continue
+        counts[reviewer] = len(session.decisions)
+        for name, decision in session.decisions.items():
+            votes.setdefault(name, {})[reviewer] = decision
+            if merged.get(name) != KEEP:
+                merged[name] = decision
+    conflicts = {name: by for name, by in votes.items() if len(set(by.values())) > 1}
+    return MergeResult(list(merged.items()), conflicts, counts)
+
+
+def split_ranges(total: int, count: int) -> List[Tuple[int, int]]:
+    # Contiguous, as even as possible: the first total % count ranges get one more
+    base, extra = divmod(total, count)
+    ranges = []
+    start = 0
+    for i in range(count):
+        end = start + base + (1 if i < extra else 0)
+        ranges.append((start, end))
+        start = end
+    return ranges
+
+
+def folder_key(source_dir: str) -> str:
+    # "media", "./media" and "/abs/media" are the same folder to share out
+    return str(Path(source_dir).resolve())
+
+
+def assign_shards(source_dir: str, names: Sequence[str], reviewers: Sequence[str]) -> Dict[str, Shard]:
+    if not reviewers:
+        raise ValueError("Hace falta al menos un revisor para repartir")
+    shards = {
+        reviewer: Shard(start, end, len(names), names[start] if start < len(names) else None)
+        for reviewer, (start, end) in zip(reviewers, split_ranges(len(names), len(reviewers)))
+    }
+    SHARDS_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = SHARDS_FILE.with_suffix(".json.tmp")
+    payload = {"source_dir": folder_key(source_dir), "shards": {r: list(s) for r, s in shards.items()}}
+    tmp_path.write_text(json.dumps(payload, ensure_ascii=False), encoding="utf-8")
+    tmp_path.replace(SHARDS_FILE)
+    return shards
+
+
+def load_shards(source_dir: str) -> Dict[str, Shard]:
+    try:
+        payload = json.loads(SHARDS_FILE.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    # Files written before folders were normalised hold the folder as typed
+    if folder_key(payload.get("source_dir", "")) != folder_key(source_dir):
+        return {}
+    return {reviewer: Shard(*values) for reviewer, values in payload.get("shards", {}).items()}
+
+
+def clear_shards() -> None:
+    SHARDS_FILE.unlink(missing_ok=True)
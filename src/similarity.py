@@ -0,0 +1,168 @@
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from PIL import Image
+
+from analysis import AnalysisCache
+from previews import render_preview
+from tools import RAW_EXTS, FileInfo
+
+HASH_CACHE = Path(".keep_or_discard") / "phash.json"
+HASH_SIZE = 8
+# render_preview width for hashing; draft() decodes JPEGs at 1/8 scale
+HASH_DECODE_WIDTH = 64
+DEFAULT_MAX_DISTANCE = 10
+DEFAULT_MAX_GAP = 2.0
+EXIF_IFD = 0x8769
+DATETIME_ORIGINAL = 0x9003
+
+
+class HashRecord(NamedTuple):
+    hash: Optional[int]
+    taken: Optional[float]
+
+
+def dhash(img: Image.Image, size: int = HASH_SIZE) -> int:
+    # Difference hash: one bit per horizontally adjacent pixel pair
+    gray = img.convert("L").resize((size + 1, size), Image.Resampling.BILINEAR)
+    pixels = gray.tobytes()
+    value = 0
+    for row in range(size):
+        offset = row * (size + 1)
+        for col in range(size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+def capture_time(path: Path) -> Optional[float]:
+    if path.suffix.lower() in RAW_EXTS:
+        return None
+    with Image.open(path) as img:
+        value = img.getexif().get_ifd(EXIF_IFD).get(DATETIME_ORIGINAL)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(str(value).strip("\x00 "), "%Y:%m:%d %H:%M:%S").timestamp()
+    except ValueError:
+        return None
+
+
+def hash_file(path_str: str) -> Tuple[str, HashRecord]:
+    # Runs in a worker process, so it takes and returns plain values
+    path = Path(path_str)
+    try:
+        taken = capture_time(path)
+    except (OSError, SyntaxError, ValueError):
+        taken = None
+    try:
+        if taken is None:
+            taken = path.stat().st_mtime
+        img = render_preview(path, HASH_DECODE_WIDTH)
+    except (OSError, SyntaxError, ValueError):
+        return path_str, HashRecord(None, taken)
+    return path_str, HashRecord(dhash(img), taken)
+
+
+class BKTree:
+    # Burkhard-Keller tree over Hamming distance: a radius search only visits
+    # children whose edge distance is within [d - radius, d + radius].
+    def __init__(self):
+        self._root: Optional[Tuple[int, List[int], Dict[int, tuple]]] = None
+
+    def add(self, key: int, item: int) -> None:
+        if self._root is None:
+            self._root = (key, [item], {})
+            return
+        node = self._root
+        while True:
+            d = hamming(key, node[0])
+            if d == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = (key, [item], {})
+                return
+            node = child
+
+    def search(self, key: int, radius: int) -> List[int]:
+        found: List[int] = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node_key, items, children = stack.pop()
+            d = hamming(key, node_key)
+            if d <= radius:
+                found.extend(items)
+            for edge, child in children.items():
+                if d - radius <= edge <= d + radius:
+                    stack.append(child)
+        return found
+
+
+class SimilarityIndex(AnalysisCache):
+    cache_version = 2
+
+    def __init__(self, cache_path: Path = HASH_CACHE):
+        self._clusters: Tuple[Optional[tuple], Dict[Path, int]] = (None, {})
+        super().__init__(cache_path, hash_file)
+
+    def encode(self, value: HashRecord) -> list:
+        return [f"{value.hash:016x}" if value.hash is not None else None, value.taken]
+
+    def decode(self, data: list) -> HashRecord:
+        return HashRecord(int(data[0], 16) if data[0] else None, data[1])
+
+    def clusters(
+        self,
+        infos: Sequence[FileInfo],
+        max_distance: int = DEFAULT_MAX_DISTANCE,
+        max_gap: float = DEFAULT_MAX_GAP,
+    ) -> Dict[Path, int]:
+        # Near-identical hashes taken within max_gap seconds of each other end up
+        # in one cluster; only paths that share a cluster with something are returned.
+        key = (self.version, len(infos), infos[-1].path if infos else None, max_distance, max_gap)
+        if self._clusters[0] == key:
+            return self._clusters[1]
+        hashed = []
+        for info in infos:
+            record = self.get(info)
+            if record is not None and record.hash is not None:
+                hashed.append((info.path, record))
+        parent = list(range(len(hashed)))
+
+        def find(i: int) -> int:
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        tree = BKTree()
+        for i, (_, record) in enumerate(hashed):
+            for j in tree.search(record.hash, max_distance):
+                other = hashed[j][1]
+                if record.taken is None or other.taken is None or abs(record.taken - other.taken) <= max_gap:
+                    parent[find(i)] = find(j)
+            tree.add(record.hash, i)
+        sizes: Dict[int, int] = {}
+        for i in range(len(hashed)):
+            root = find(i)
+            sizes[root] = sizes.get(root, 0) + 1
+        clusters = {path: find(i) for i, (path, _) in enumerate(hashed) if sizes[find(i)] > 1}
+        self._clusters = (key, clusters)
+        return clusters
+
+
+def burst_at(queue: Sequence[Path], idx: int, clusters: Dict[Path, int]) -> List[Path]:
+    # The run of consecutive queue items from idx that share one cluster
+    if idx >= len(queue) or queue[idx] not in clusters:
+        return []
+    cluster = clusters[queue[idx]]
+    end = idx + 1
+    while end < len(queue) and clusters.get(queue[end]) == cluster:
+        end += 1
+    return list(queue[idx:end]) if end - idx > 1 else []
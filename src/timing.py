@@ -0,0 +1,289 @@
+import cProfile
+import csv
+import functools
+import io
+import json
+import pstats
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Deque, Dict, List, NamedTuple, Optional, Tuple, TypeVar
+
+TRACE_DIR = Path(".keep_or_discard") / "traces"
+MAX_RERUNS = 200
+# Upper bounds in ms; the last bucket takes everything slower
+BUCKETS_MS = (1, 4, 16, 64, 256, 1000)
+PROFILE_LINES = 30
+
+F = TypeVar("F", bound=Callable)
+
+
+class Span(NamedTuple):
+    name: str
+    ms: float
+    thread: str
+    top: bool
+
+
+class Rerun:
+    def __init__(self, number: int):
+        self.number = number
+        self.started = time.time()
+        self.t0 = time.perf_counter()
+        self.thread = threading.get_ident()
+        self.total_ms: Optional[float] = None
+        self.script_started = False
+        self.interrupted = False
+        self.spans: List[Span] = []
+
+    def summary(self) -> Dict[str, Tuple[int, float, float]]:
+        # name -> (calls, total ms, max ms)
+        found: Dict[str, Tuple[int, float, float]] = {}
+        for span in self.spans:
+            calls, total, worst = found.get(span.name, (0, 0.0, 0.0))
+            found[span.name] = (calls + 1, total + span.ms, max(worst, span.ms))
+        return found
+
+    def untracked_ms(self) -> float:
+        # Script time outside any top-level span: widgets, Streamlit itself, untimed code
+        if self.total_ms is None:
+            return 0.0
+        return max(0.0, self.total_ms - sum(s.ms for s in self.spans if s.top))
+
+    def as_dict(self) -> Dict:
+        return {
+            "rerun": self.number,
+            "started": self.started,
+            "total_ms": self.total_ms,
+            "interrupted": self.interrupted,
+            "spans": [span._asdict() for span in self.spans],
+        }
+
+
+class _NullSpan:
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, *exc) -> bool:
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("tracer", "name", "t0", "top")
+
+    def __init__(self, tracer: "Tracer", name: str):
+        self.tracer = tracer
+        self.name = name
+
+    def __enter__(self) -> None:
+        depth = self.tracer._local.__dict__.get("depth", 0)
+        self.top = depth == 0
+        self.tracer._local.depth = depth + 1
+        self.t0 = time.perf_counter()
+
+    def __exit__(self, *exc) -> bool:
+        ms = (time.perf_counter() - self.t0) * 1000
+        self.tracer._local.depth -= 1
+        self.tracer.record(self.name, ms, self.top)
+        return False
+
+
+def bucket_label(i: int) -> str:
+    if i == len(BUCKETS_MS):
+        return f"≥{BUCKETS_MS[-1]} ms"
+    return f"<{BUCKETS_MS[i]} ms"
+
+
+def bucket_of(ms: float) -> int:
+    for i, bound in enumerate(BUCKETS_MS):
+        if ms < bound:
+            return i
+    return len(BUCKETS_MS)
+
+
+def percentile(ordered: List[float], pct: float) -> float:
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+
+class Tracer:
+    # Disabled by default: span() and timed() then cost one attribute check.
+    # One per browser session (see use_tracer), so sessions neither switch
+    # each other's tracing on or off nor mix their spans.
+    def __init__(self, max_reruns: int = MAX_RERUNS):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._current: Optional[Rerun] = None
+        self._count = 0
+        self.reruns: Deque[Rerun] = deque(maxlen=max_reruns)
+        self._profile_next = False
+        self._profiler: Optional[cProfile.Profile] = None
+        self._profile_owner: Optional[Rerun] = None
+        self.last_profile: Optional[Tuple[Path, str]] = None
+
+    def span(self, name: str):
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, name)
+
+    def record(self, name: str, ms: float, top: bool = False) -> None:
+        with self._lock:
+            # Button callbacks run before the script body, so they open the rerun
+            if self._current is None:
+                self._current = self._open()
+            rerun = self._current
+            top = top and rerun.thread == threading.get_ident()
+            rerun.spans.append(Span(name, ms, threading.current_thread().name, top))
+
+    def _open(self) -> Rerun:
+        self._count += 1
+        return Rerun(self._count)
+
+    def begin_rerun(self) -> None:
+        if not self.enabled:
+            if self._current is not None or self._profiler is not None:
+                self.end_rerun()
+            return
+        interrupted = None
+        with self._lock:
+            current = self._current
+            if current is not None and current.script_started:
+                # st.rerun() or an exception left the previous run open
+                current.interrupted = True
+                self._close(current)
+                interrupted, current = current, None
+            if current is None:
+                current = self._current = self._open()
+            current.script_started = True
+            current.thread = threading.get_ident()
+        if self._profiler is not None and self._profile_owner is interrupted:
+            self._stop_profile()
+        if self._profile_next and self._profiler is None:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Another session is profiling right now (one profiler per process): retry next rerun
+                return
+            self._profile_next = False
+            self._profiler = profiler
+            self._profile_owner = current
+
+    def end_rerun(self) -> None:
+        with self._lock:
+            current, self._current = self._current, None
+            if current is not None:
+                self._close(current)
+        if self._profiler is not None:
+            self._stop_profile()
+
+    def _close(self, rerun: Rerun) -> None:
+        rerun.total_ms = (time.perf_counter() - rerun.t0) * 1000
+        self.reruns.append(rerun)
+
+    def profile_next_rerun(self) -> None:
+        self._profile_next = True
+
+    def _stop_profile(self) -> None:
+        profiler, owner = self._profiler, self._profile_owner
+        self._profiler = self._profile_owner = None
+        profiler.disable()
+        TRACE_DIR.mkdir(parents=True, exist_ok=True)
+        number = owner.number if owner is not None else self._count
+        path = TRACE_DIR / f"rerun_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{number}.prof"
+        profiler.dump_stats(str(path))
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_LINES)
+        self.last_profile = (path, out.getvalue())
+
+    def last_rerun(self) -> Optional[Rerun]:
+        with self._lock:
+            return self.reruns[-1] if self.reruns else None
+
+    def histograms(self) -> Dict[str, Tuple[List[float], List[int]]]:
+        # name -> (sorted per-call ms, bucket counts) over the kept reruns
+        with self._lock:
+            reruns = list(self.reruns)
+        samples: Dict[str, List[float]] = {}
+        for rerun in reruns:
+            samples.setdefault("rerun", []).append(rerun.total_ms or 0.0)
+            for span in rerun.spans:
+                samples.setdefault(span.name, []).append(span.ms)
+        found = {}
+        for name, values in samples.items():
+            counts = [0] * (len(BUCKETS_MS) + 1)
+            for ms in values:
+                counts[bucket_of(ms)] += 1
+            found[name] = (sorted(values), counts)
+        return found
+
+    def clear(self) -> None:
+        with self._lock:
+            self.reruns.clear()
+
+    def export(self, fmt: str = "json") -> Path:
+        with self._lock:
+            reruns = list(self.reruns)
+        TRACE_DIR.mkdir(parents=True, exist_ok=True)
+        path = TRACE_DIR / f"trace_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+        if fmt == "json":
+            path.write_text(json.dumps([r.as_dict() for r in reruns], indent=1), encoding="utf-8")
+        elif fmt == "csv":
+            with path.open("w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(["rerun", "started", "name", "ms", "thread", "top"])
+                for rerun in reruns:
+                    writer.writerow([rerun.number, rerun.started, "rerun", f"{rerun.total_ms or 0:.3f}", "", ""])
+                    for span in rerun.spans:
+                        writer.writerow([rerun.number, rerun.started, span.name, f"{span.ms:.3f}", span.thread, int(span.top)])
+        else:
+            raise ValueError(f"Unsupported trace format: {fmt}")
+        return path
+
+
+def _no_tracer() -> Optional[Tracer]:
+    return None
+
+
+_resolve: Callable[[], Optional[Tracer]] = _no_tracer
+
+
+def use_tracer(resolve: Callable[[], Optional[Tracer]]) -> None:
+    # How span() and timed() find the tracer of the session running on the
+    # calling thread; threads that belong to no session get None and record nothing
+    global _resolve
+    _resolve = resolve
+
+
+def span(name: str):
+    tracer = _resolve()
+    if tracer is None:
+        return NULL_SPAN
+    return tracer.span(name)
+
+
+def timed(name: Optional[str] = None) -> Callable[[F], F]:
+    def decorate(func: F) -> F:
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            tracer = _resolve()
+            if tracer is None or not tracer.enabled:
+                return func(*args, **kwargs)
+            with _Span(tracer, label):
+                return func(*args, **kwargs)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorate
@@ -1,11 +1,216 @@
+import os
 import shutil
-from typing import Iterable, List, Tuple
-from pathlib import Path
+import sys
+import threading
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from pathlib import Path, PurePosixPath
 
 RAW_EXTS = {".cr2", ".cr3", ".nef", ".arw", ".raf", ".dng", ".rw2", ".orf", ".srw", ".pef", ".raw"}
 JPG_EXTS = {".jpg", ".jpeg"}
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".tiff"}
 
 def list_jpgs(folder: Path) -> List[Path]:
     if not folder.exists():
         return []
-    return sorted([p for p in folder.iterdir() if p.is_file() and p.suffix.lower() in JPG_EXTS])
\ No newline at end of file
+    return sorted([p for p in folder.iterdir() if p.is_file() and p.suffix.lower() in JPG_EXTS])
+
+
+class FileInfo(NamedTuple):
+    path: Path
+    size: int
+    mtime_ns: int
+
+
+class StemGroup:
+    __slots__ = ("images", "raws")
+
+    def __init__(self):
+        self.images: List[FileInfo] = []
+        self.raws: List[FileInfo] = []
+
+    @property
+    def display(self) -> Optional[FileInfo]:
+        return self.images[0] if self.images else None
+
+    @property
+    def review_items(self) -> List[FileInfo]:
+        # RAW-only shots are reviewed through their first RAW's embedded JPEG
+        return self.images if self.images else self.raws[:1]
+
+
+def stem_key(name: str) -> str:
+    suffix = PurePosixPath(name).suffix
+    return name[: len(name) - len(suffix)] if suffix else name
+
+
+def scan_dir(folder: Path) -> Tuple[List[Tuple[FileInfo, bool]], List[Path]]:
+    # One directory level. d_type from scandir answers is_file()/is_dir() without
+    # a stat; only matching media files are stat'ed for size and mtime.
+    files: List[Tuple[FileInfo, bool]] = []
+    subdirs: List[Path] = []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name.startswith("."):
+                continue
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(Path(entry.path))
+                    continue
+                ext = os.path.splitext(entry.name)[1].lower()
+                is_image = ext in IMAGE_EXTS
+                if not (is_image or ext in RAW_EXTS) or not entry.is_file():
+                    continue
+                st = entry.stat()
+            except OSError:
+                continue
+            files.append((FileInfo(Path(entry.path), st.st_size, st.st_mtime_ns), is_image))
+    files.sort(key=lambda f: f[0].path.name.lower())
+    subdirs.sort(key=lambda d: d.name.lower())
+    return files, subdirs
+
+
+def scan_media(folder: Path, recursive: bool = True) -> Iterator[Tuple[FileInfo, bool]]:
+    # Depth-first, files before subfolders, both sorted: results stream in
+    # display order without a global sort at the end.
+    stack = [Path(folder)]
+    while stack:
+        current = stack.pop()
+        try:
+            files, subdirs = scan_dir(current)
+        except OSError:
+            continue
+        yield from files
+        if recursive:
+            stack.extend(reversed(subdirs))
+
+
+class MediaIndex:
+    def __init__(self, folder: Path):
+        self.folder = Path(folder)
+        # Keys are paths relative to folder, in posix form ("2024/IMG_0001.jpg")
+        self.files: Dict[str, FileInfo] = {}
+        self.stems: Dict[str, StemGroup] = {}
+        self.lock = threading.RLock()
+        self._images: Optional[List[Path]] = None
+
+    @classmethod
+    def build(cls, folder: Path, recursive: bool = True) -> "MediaIndex":
+        index = cls(folder)
+        if index.folder.is_dir():
+            for info, is_image in scan_media(index.folder, recursive):
+                index.add(info, is_image)
+        return index
+
+    def name_of(self, path: Path) -> str:
+        try:
+            return Path(path).relative_to(self.folder).as_posix()
+        except ValueError:
+            return Path(path).name
+
+    def stem_of(self, path: Path) -> str:
+        return stem_key(self.name_of(path))
+
+    def add(self, info: FileInfo, is_image: bool) -> None:
+        with self.lock:
+            name = self.name_of(info.path)
+            if name in self.files:
+                self.remove(name)
+            self.files[name] = info
+            stem = self.stem_of(info.path)
+            group = self.stems.get(stem)
+            if group is None:
+                group = self.stems[stem] = StemGroup()
+            target = group.images if is_image else group.raws
+            target.append(info)
+            target.sort(key=lambda f: f.path.name.lower())
+            self._images = None
+
+    def remove(self, name: str) -> Optional[FileInfo]:
+        with self.lock:
+            info = self.files.pop(name, None)
+            if info is None:
+                return None
+            stem = self.stem_of(info.path)
+            group = self.stems.get(stem)
+            if group is not None:
+                group.images = [f for f in group.images if f.path != info.path]
+                group.raws = [f for f in group.raws if f.path != info.path]
+                if not group.images and not group.raws:
+                    del self.stems[stem]
+            self._images = None
+            return info
+
+    def is_review_item(self, path: Path) -> bool:
+        group = self.stems.get(self.stem_of(path))
+        return group is not None and any(f.path == path for f in group.review_items)
+
+    def images(self) -> List[Path]:
+        with self.lock:
+            if self._images is None:
+                imgs = [f.path for g in self.stems.values() for f in g.review_items]
+                imgs.sort(key=lambda x: self.name_of(x).lower())
+                self._images = imgs
+            return self._images
+
+    def resolve(self, name: str) -> Optional[FileInfo]:
+        info = self.files.get(name)
+        if info is not None:
+            return info
+        group = self.stems.get(stem_key(name))
+        if group is None or not group.review_items:
+            return None
+        return group.review_items[0]
+
+    def raws(self, stem: str) -> List[FileInfo]:
+        group = self.stems.get(stem)
+        return group.raws if group else []
+
+    def size_of(self, path: Path) -> Optional[int]:
+        info = self.files.get(self.name_of(path))
+        if info is not None and info.path == path:
+            return info.size
+        return None
+
+
+def format_bytes(num: int) -> str:
+    for unit in ["B", "KB", "MB", "GB", "TB"]:
+        if num < 1024:
+            return f"{num:.1f} {unit}"
+        num /= 1024
+    return f"{num:.1f} PB"
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    minutes, seconds = divmod(seconds, 60)
+    if minutes < 60:
+        return f"{minutes}m {seconds:02d}s"
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m"
+
+
+def build_media_index(folder: Path, recursive: bool = True) -> MediaIndex:
+    return MediaIndex.build(folder, recursive)
+
+
+def list_images(folder: Path) -> List[Path]:
+    return build_media_index(folder).images()
+
+
+def warm_preview_cache(folder: Path, max_width: int = 1200, workers: int = 0) -> Tuple[int, int]:
+    # Imported lazily so tools stays usable without Pillow
+    from previews import PreviewCache
+
+    return PreviewCache().warm(list_images(folder), max_width=max_width, workers=workers or None)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "warm-previews":
+        print("Uso: python src/tools.py warm-previews [carpeta] [ancho]")
+        sys.exit(2)
+    folder = Path(sys.argv[2]) if len(sys.argv) > 2 else Path("media")
+    width = int(sys.argv[3]) if len(sys.argv) > 3 else 1200
+    ok, failed = warm_preview_cache(folder, max_width=width)
+    print(f"{ok} previsualizaciones listas, {failed} errores")
@@ -0,0 +1,534 @@
+import errno
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from plan import PlanEntry
+
+try:
+    import fcntl
+except ImportError:  # Windows: no reflinks, hardlinks still work on NTFS
+    fcntl = None
+
+TRANSFER_DIR = Path(".keep_or_discard") / "transfers"
+COPY_CHUNK = 64 * 1024 * 1024
+# _IOW(0x94, 9, int): clone a whole file on btrfs, XFS (reflink=1), bcachefs...
+FICLONE = 0x40049409
+COPY_FULL = "copy"
+COPY_REFLINK = "reflink"
+COPY_HARDLINK = "hardlink"
+COPY_STRATEGIES = (COPY_FULL, COPY_REFLINK, COPY_HARDLINK)
+# What each strategy tries, in order; a full copy is always the last resort
+STRATEGY_METHODS = {
+    COPY_FULL: (),
+    COPY_REFLINK: (COPY_REFLINK,),
+    COPY_HARDLINK: (COPY_HARDLINK, COPY_REFLINK),
+}
+# Failures that mean "not on this filesystem" rather than "not this file"
+UNSUPPORTED_ERRNOS = {errno.EOPNOTSUPP, errno.ENOTSUP, errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.EPERM, None}
+
+
+class TransferProgress(NamedTuple):
+    files_done: int
+    files_total: int
+    bytes_done: int
+    bytes_total: int
+    failed: int
+    elapsed: float
+    files_resumed: int = 0
+    bytes_resumed: int = 0
+
+    @property
+    def files_per_sec(self) -> float:
+        if self.elapsed <= 0:
+            return 0.0
+        return (self.files_done - self.files_resumed) / self.elapsed
+
+    @property
+    def bytes_per_sec(self) -> float:
+        if self.elapsed <= 0:
+            return 0.0
+        return (self.bytes_done - self.bytes_resumed) / self.elapsed
+
+    @property
+    def eta(self) -> Optional[float]:
+        rate = self.bytes_per_sec
+        if rate <= 0:
+            return None
+        return (self.bytes_total - self.bytes_done) / rate
+
+
+class TransferResult(NamedTuple):
+    plan_id: str
+    mode: str
+    done: List[Tuple[Path, Path]]
+    resumed: int
+    failed: List[Tuple[Path, str]]
+    journal: Path
+    # How copies were made this run: copy / reflink / hardlink -> files
+    methods: Optional[Dict[str, int]] = None
+
+
+def plan_id(entries: Sequence[PlanEntry], mode: str) -> str:
+    digest = hashlib.sha1(mode.encode("utf-8"))
+    for entry in sorted(entries, key=lambda e: str(e.src)):
+        digest.update(f"\0{entry.src}\0{entry.dst}\0{entry.size}".encode("utf-8"))
+        if entry.link is not None:
+            digest.update(f"\0{entry.link}".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def unique_destination(path: Path, reserved: Optional[Set[Path]] = None) -> Path:
+    reserved = reserved if reserved is not None else set()
+    if not path.exists() and path not in reserved:
+        return path
+    base = path.stem
+    ext = path.suffix
+    parent = path.parent
+    i = 1
+    while True:
+        candidate = parent / f"{base}_{i}{ext}"
+        if not candidate.exists() and candidate not in reserved:
+            return candidate
+        i += 1
+
+
+def same_device(src: Path, dst_dir: Path) -> bool:
+    try:
+        return src.stat().st_dev == dst_dir.stat().st_dev
+    except OSError:
+        return False
+
+
+def kernel_copy(fsrc, fdst, size: int) -> None:
+    # copy_file_range, else sendfile: either way the data never enters userspace
+    try:
+        remaining = size
+        while remaining > 0:
+            sent = os.copy_file_range(fsrc.fileno(), fdst.fileno(), min(remaining, COPY_CHUNK))
+            if sent == 0:
+                break
+            remaining -= sent
+        return
+    except (AttributeError, OSError):
+        # Not in this kernel/platform, or not across these filesystems
+        fdst.seek(0)
+        fdst.truncate()
+    offset = 0
+    while offset < size:
+        sent = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, min(size - offset, COPY_CHUNK))
+        if sent == 0:
+            break
+        offset += sent
+
+
+def copy_file(src: Path, dst: Path) -> None:
+    # Copy through a temp name so an interrupted run never leaves a truncated dst
+    tmp_path = dst.with_name(f".{dst.name}.partial")
+    with open(src, "rb") as fsrc, open(tmp_path, "wb") as fdst:
+        try:
+            kernel_copy(fsrc, fdst, os.fstat(fsrc.fileno()).st_size)
+        except (AttributeError, OSError):
+            # No sendfile either (Windows): plain read/write loop
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+            shutil.copyfileobj(fsrc, fdst, COPY_CHUNK)
+    shutil.copystat(src, tmp_path)
+    tmp_path.replace(dst)
+
+
+def link_file(src: Path, dst: Path) -> None:
+    # Same temp-name dance as copy_file; a hardlink costs no data blocks
+    tmp_path = dst.with_name(f".{dst.name}.partial")
+    tmp_path.unlink(missing_ok=True)
+    os.link(src, tmp_path)
+    tmp_path.replace(dst)
+
+
+def reflink_file(src: Path, dst: Path) -> None:
+    # Copy-on-write clone: shares the data blocks until either side is written
+    if fcntl is None:
+        raise OSError("reflink no disponible en esta plataforma")
+    tmp_path = dst.with_name(f".{dst.name}.partial")
+    try:
+        with open(src, "rb") as fsrc, open(tmp_path, "wb") as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except OSError:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    shutil.copystat(src, tmp_path)
+    tmp_path.replace(dst)
+
+
+METHOD_FUNCS = {COPY_REFLINK: reflink_file, COPY_HARDLINK: link_file}
+# (st_dev, method) -> whether that filesystem took it, learned from real transfers
+_support: Dict[Tuple[int, str], bool] = {}
+_support_lock = threading.Lock()
+
+
+def support_version() -> int:
+    # Grows as transfers learn what each filesystem supports; estimates key on it
+    with _support_lock:
+        return len(_support)
+
+
+def existing_parent(path: Path) -> Path:
+    while not path.exists() and path.parent != path:
+        path = path.parent
+    return path
+
+
+def method_support(folder: Path, method: str) -> Optional[bool]:
+    # None until a transfer into this filesystem has tried the method
+    try:
+        key = (existing_parent(folder).stat().st_dev, method)
+    except OSError:
+        return False
+    with _support_lock:
+        return _support.get(key)
+
+
+def clone_file(src: Path, dst: Path, strategy: str = COPY_FULL) -> str:
+    # Per file: the first method this filesystem accepts, else a real copy.
+    # A method the filesystem refused once is not tried again.
+    methods = STRATEGY_METHODS[strategy]
+    if methods and same_device(src, dst.parent):
+        device = dst.parent.stat().st_dev
+        for method in methods:
+            key = (device, method)
+            with _support_lock:
+                if _support.get(key) is False:
+                    continue
+            try:
+                METHOD_FUNCS[method](src, dst)
+            except OSError as exc:
+                if exc.errno in UNSUPPORTED_ERRNOS:
+                    with _support_lock:
+                        _support[key] = False
+                continue
+            with _support_lock:
+                _support[key] = True
+            return method
+    copy_file(src, dst)
+    return COPY_FULL
+
+
+def zero_copy_method(src: Path, dst_dir: Path, strategy: str) -> Tuple[Optional[str], bool]:
+    # Which method clone_file would use without copying any data, if any, and
+    # whether that is known yet: support is only learned by transferring
+    methods = STRATEGY_METHODS[strategy]
+    if not methods or not same_device(src, existing_parent(dst_dir)):
+        return None, True
+    for method in methods:
+        supported = method_support(dst_dir, method)
+        if supported is None:
+            return None, False
+        if supported:
+            return method, True
+    return None, True
+
+
+def extra_bytes(entries: Sequence[PlanEntry], strategy: str = COPY_FULL) -> Tuple[int, bool]:
+    # New data blocks a copy will allocate: clones and hardlinks are free.
+    # Devices are looked up per source folder, so this stays one stat per folder.
+    # Files whose filesystem has not been tried yet count in full, and the
+    # second value is False: the total is then an upper bound.
+    total = 0
+    exact = True
+    free: Dict[Tuple[Path, Path], bool] = {}
+    for entry in entries:
+        if entry.link is not None:
+            continue
+        key = (entry.src.parent, entry.dst.parent)
+        if key not in free:
+            method, known = zero_copy_method(entry.src, entry.dst.parent, strategy)
+            free[key] = method is not None
+            exact = exact and known
+        if not free[key]:
+            total += entry.size
+    return total, exact
+
+
+def move_file(src: Path, dst: Path) -> None:
+    if same_device(src, dst.parent):
+        os.rename(src, dst)
+        return
+    copy_file(src, dst)
+    src.unlink()
+
+
+class TransferJournal:
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fh = None
+
+    def load(self) -> Tuple[Dict[str, str], Dict[str, str]]:
+        started: Dict[str, str] = {}
+        done: Dict[str, str] = {}
+        if not self.path.exists():
+            return started, done
+        with self.path.open(encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if record.get("op") == "start":
+                    started[record["src"]] = record["dst"]
+                elif record.get("op") == "done":
+                    done[record["src"]] = record["dst"]
+        return started, done
+
+    def write(self, record: Dict) -> None:
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            if self._fh is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._fh = self.path.open("a", encoding="utf-8")
+            self._fh.write(line + "\n")
+            self._fh.flush()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._fh is not None:
+                os.fsync(self._fh.fileno())
+                self._fh.close()
+                self._fh = None
+
+
+class TransferEngine:
+    def __init__(
+        self,
+        entries: Sequence[PlanEntry],
+        mode: str,
+        workers: int = 4,
+        journal_dir: Path = TRANSFER_DIR,
+        strategy: str = COPY_FULL,
+    ):
+        if mode not in ("copy", "move"):
+            raise ValueError(f"Unknown transfer mode: {mode}")
+        if strategy not in COPY_STRATEGIES:
+            raise ValueError(f"Unknown copy strategy: {strategy}")
+        self.entries = list(entries)
+        self.mode = mode
+        self.workers = workers
+        self.strategy = strategy
+        self.methods: Dict[str, int] = {}
+        self.plan_id = plan_id(self.entries, mode)
+        # One journal per mode, not per plan: adding a decision after a run must
+        # not make the files already placed look new
+        self.journal = TransferJournal(Path(journal_dir) / f"{mode}.jsonl")
+        self._reserved: Set[Path] = set()
+        self._dest_lock = threading.Lock()
+        # src -> dst of finished entries, to resolve links to another entry's source
+        self._placed: Dict[Path, Path] = {}
+
+    def _destination(self, entry: PlanEntry, started: Dict[str, str]) -> Path:
+        with self._dest_lock:
+            previous = started.get(str(entry.src))
+            if previous is not None and self._same_folder(entry, previous) and not Path(previous).exists():
+                # Resume into the name chosen before the interruption
+                dst = Path(previous)
+            else:
+                dst = unique_destination(entry.dst, self._reserved)
+            self._reserved.add(dst)
+            return dst
+
+    @staticmethod
+    def _same_folder(entry: PlanEntry, dst: str) -> bool:
+        # A record for another folder is from before the decision was flipped
+        return Path(dst).parent == entry.dst.parent
+
+    def _placed_before(self, entry: PlanEntry, journaled: Sequence[Optional[str]]) -> Optional[Path]:
+        # Where an earlier run (or a crash after the rename) already left this file
+        candidates = []
+        for dst in journaled:
+            if dst is not None and self._same_folder(entry, dst):
+                # Ours: the size is enough, unless the source is back after a move
+                candidates.append((Path(dst), self.mode == "move" and entry.src.exists()))
+        if self.mode == "copy":
+            # No journal (deleted, or another copy tool): same size and mtime as the source
+            candidates.append((entry.dst, True))
+        for dst, strict in candidates:
+            try:
+                st = dst.stat()
+                if st.st_size != entry.size:
+                    continue
+                if strict and entry.src.stat().st_mtime_ns != st.st_mtime_ns:
+                    continue
+            except OSError:
+                continue
+            if self.mode == "move" and entry.src.exists():
+                # Copied across devices, crashed before removing the source
+                entry.src.unlink()
+            return dst
+        return None
+
+    def _transfer(self, entry: PlanEntry, started: Dict[str, str]) -> Path:
+        dst = self._destination(entry, started)
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        self.journal.write({"op": "start", "src": str(entry.src), "dst": str(dst)})
+        if self.mode == "move":
+            move_file(entry.src, dst)
+            return dst
+        method = None
+        if entry.link is not None:
+            target = self._placed.get(entry.link, entry.link)
+            try:
+                link_file(target, dst)
+                method = COPY_HARDLINK
+            except OSError:
+                # Other filesystem, no hardlink support or the target is gone
+                pass
+        if method is None:
+            method = clone_file(entry.src, dst, self.strategy)
+        with self._dest_lock:
+            self.methods[method] = self.methods.get(method, 0) + 1
+        return dst
+
+    def run(self, progress: Optional[Callable[[TransferProgress], None]] = None) -> TransferResult:
+        started, done_before = self.journal.load()
+        pending: List[PlanEntry] = []
+        done: List[Tuple[Path, Path]] = []
+        bytes_done = 0
+        for entry in self.entries:
+            src = str(entry.src)
+            # A destination removed since the last run has to be transferred again
+            dst = self._placed_before(entry, (done_before.get(src), started.get(src)))
+            if dst is None:
+                pending.append(entry)
+            else:
+                done.append((entry.src, dst))
+                self._reserved.add(dst)
+                bytes_done += entry.size
+        self._placed = dict(done)
+        resumed = len(done)
+        bytes_resumed = bytes_done
+        failed: List[Tuple[Path, str]] = []
+        bytes_total = sum(e.size for e in self.entries)
+        t0 = time.monotonic()
+
+        def report() -> None:
+            if progress is not None:
+                progress(
+                    TransferProgress(
+                        len(done),
+                        len(self.entries),
+                        bytes_done,
+                        bytes_total,
+                        len(failed),
+                        time.monotonic() - t0,
+                        resumed,
+                        bytes_resumed,
+                    )
+                )
+
+        report()
+        # Linked entries go last: they may point at another entry's destination
+        waves = [[e for e in pending if e.link is None], [e for e in pending if e.link is not None]]
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="transfer") as pool:
+                for wave in waves:
+                    futures = {pool.submit(self._transfer, e, started): e for e in wave}
+                    for future in as_completed(futures):
+                        entry = futures[future]
+                        try:
+                            dst = future.result()
+                        except OSError as exc:
+                            failed.append((entry.src, str(exc)))
+                            self.journal.write({"op": "failed", "src": str(entry.src), "error": str(exc)})
+                        else:
+                            done.append((entry.src, dst))
+                            self._placed[entry.src] = dst
+                            bytes_done += entry.size
+                            self.journal.write({"op": "done", "src": str(entry.src), "dst": str(dst)})
+                        report()
+        finally:
+            self.journal.close()
+        return TransferResult(self.plan_id, self.mode, done, resumed, failed, self.journal.path, dict(self.methods))
+
+
+ORIGINALS_DIR = Path("discard") / "_originals"
+HASH_ALGORITHM = "blake2b"
+
+
+class CleanupResult(NamedTuple):
+    verified: int
+    skipped: List[Path]
+    failed: List[Tuple[Path, str]]
+    moved: List[Tuple[Path, Path]]
+
+
+def file_hash(path: Path, algorithm: str = HASH_ALGORITHM) -> str:
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, algorithm).hexdigest()
+
+
+def verify_copy(src: Path, dst: Path, check_hash: bool = False) -> Optional[str]:
+    try:
+        src_size = src.stat().st_size
+        dst_size = dst.stat().st_size
+    except FileNotFoundError as exc:
+        return f"no existe: {exc.filename}"
+    if src_size != dst_size:
+        return f"tamaño distinto ({src_size} vs {dst_size})"
+    if check_hash and file_hash(src) != file_hash(dst):
+        return "hash distinto"
+    return None
+
+
+def cleanup_originals(
+    items: Sequence[Tuple[Path, Path]],
+    originals_dir: Path = ORIGINALS_DIR,
+    check_hash: bool = False,
+    workers: int = 4,
+) -> CleanupResult:
+    skipped: List[Path] = []
+    failed: List[Tuple[Path, str]] = []
+    to_check = []
+    for src, dst in items:
+        src, dst = Path(src), Path(dst)
+        if not src.exists():
+            # Already cleaned up in an earlier run
+            skipped.append(src)
+        else:
+            to_check.append((src, dst))
+
+    # Verification reads whole files when hashing, so it runs across files in parallel
+    verified = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="verify") as pool:
+        futures = {pool.submit(verify_copy, src, dst, check_hash): (src, dst) for src, dst in to_check}
+        for future in as_completed(futures):
+            src, _ = futures[future]
+            try:
+                problem = future.result()
+            except OSError as exc:
+                problem = str(exc)
+            if problem is None:
+                verified.append(src)
+            else:
+                failed.append((src, problem))
+
+    moved: List[Tuple[Path, Path]] = []
+    if verified:
+        originals_dir.mkdir(parents=True, exist_ok=True)
+        reserved: Set[Path] = set()
+        # Same-device renames are metadata-only, so the bulk move stays on one thread
+        for src in sorted(verified):
+            target = unique_destination(originals_dir / src.name, reserved)
+            reserved.add(target)
+            try:
+                move_file(src, target)
+            except OSError as exc:
+                failed.append((src, str(exc)))
+            else:
+                moved.append((src, target))
+    return CleanupResult(len(verified), skipped, failed, moved)
@@ -0,0 +1,256 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set
+
+from scanner import MediaScanner
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+WATCH_MASK = (
+    IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+)
+# struct inotify_event without the name: wd, mask, cookie, len
+EVENT = struct.Struct("iIII")
+BACKEND_INOTIFY = "inotify"
+BACKEND_POLL = "poll"
+# A file that saw IN_CREATE/IN_MODIFY but no close for this long is no longer
+# considered open (the writer died, or it was open before we started watching)
+WRITE_TIMEOUT = 60.0
+
+
+class Inotify:
+    # The handful of libc calls needed, through ctypes: no extra dependency
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._rm_watch = libc.inotify_rm_watch
+        self._rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+
+    def add_watch(self, path: Path, mask: int = WATCH_MASK) -> int:
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), str(path))
+        return wd
+
+    def rm_watch(self, wd: int) -> None:
+        self._rm_watch(self.fd, wd)
+
+    def read(self, timeout: float) -> List[tuple]:
+        # [(wd, mask, name)]; empty after timeout
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        events = []
+        pos = 0
+        while pos + EVENT.size <= len(data):
+            wd, mask, _, length = EVENT.unpack_from(data, pos)
+            name = data[pos + EVENT.size : pos + EVENT.size + length].rstrip(b"\0")
+            events.append((wd, mask, os.fsdecode(name)))
+            pos += EVENT.size + length
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def inotify_available() -> bool:
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        Inotify().close()
+    except (OSError, AttributeError):
+        return False
+    return True
+
+
+class MediaWatcher:
+    # Keeps a MediaScanner current while files land in the folder (tethered
+    # shooting): inotify tells which folders changed and which files are still
+    # open for writing; elsewhere the scanner's directory-mtime check is polled.
+    # Newly queued images are handed to on_new on a worker thread (previews).
+    def __init__(
+        self,
+        scanner: MediaScanner,
+        on_new: Optional[Callable[[List[Path]], object]] = None,
+        settle: float = 2.0,
+        poll_interval: float = 1.0,
+        debounce: float = 0.25,
+        backend: Optional[str] = None,
+    ):
+        self.scanner = scanner
+        self.on_new = on_new
+        self.settle = settle
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.backend = backend or (BACKEND_INOTIFY if inotify_available() else BACKEND_POLL)
+        self.found = 0
+        self.error: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._inotify: Optional[Inotify] = None
+        self._watches: Dict[int, Path] = {}
+        self._watched: Set[Path] = set()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> "MediaWatcher":
+        if self.running:
+            return self
+        self.scanner.settle = max(self.scanner.settle, self.settle)
+        self._stop.clear()
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="media-watch-new")
+        self._thread = threading.Thread(target=self._run, name="media-watch", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        # Nothing prunes these any more
+        self.scanner.writing.clear()
+
+    def _run(self) -> None:
+        self.scanner.wait_done()
+        try:
+            if self.backend == BACKEND_INOTIFY:
+                try:
+                    self._inotify = Inotify()
+                    self._watch_folders()
+                except OSError as exc:
+                    # Most often ENOSPC: more folders than fs.inotify.max_user_watches
+                    self.error = str(exc)
+                    self._close_inotify()
+                    self.backend = BACKEND_POLL
+            if self.backend == BACKEND_INOTIFY:
+                self._run_inotify()
+            else:
+                self._run_poll()
+        finally:
+            self._close_inotify()
+
+    def _close_inotify(self) -> None:
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+            self._watches.clear()
+            self._watched.clear()
+
+    def _watch_folders(self) -> None:
+        for folder in self.scanner.folders():
+            if folder in self._watched:
+                continue
+            try:
+                wd = self._inotify.add_watch(folder)
+            except OSError as exc:
+                if exc.errno in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                    continue
+                raise
+            self._watches[wd] = folder
+            self._watched.add(folder)
+
+    def _notify(self, new: List[Path]) -> None:
+        if not new:
+            return
+        self.found += len(new)
+        if self.on_new is not None and self._pool is not None:
+            self._pool.submit(self.on_new, new)
+
+    def _run_poll(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            self._notify(self.scanner.rescan())
+
+    def _run_inotify(self) -> None:
+        writing = self.scanner.writing
+        dirty: Set[Path] = set()
+        dirty_since = 0.0
+        overflow = False
+        while not self._stop.is_set():
+            # After the first event, keep reading briefly so a burst of files
+            # costs one rescan per folder
+            timeout = self.debounce if dirty else self.poll_interval
+            events = self._inotify.read(timeout)
+            now = time.monotonic()
+            for wd, mask, name in events:
+                if mask & IN_Q_OVERFLOW:
+                    overflow = True
+                    continue
+                folder = self._watches.get(wd)
+                if folder is None:
+                    continue
+                if mask & IN_IGNORED:
+                    del self._watches[wd]
+                    self._watched.discard(folder)
+                    continue
+                if not dirty:
+                    dirty_since = now
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                    # Rescanning a folder that is gone makes the scanner forget it
+                    dirty.update((folder, folder.parent))
+                    continue
+                path = folder / name
+                if mask & IN_ISDIR:
+                    dirty.add(folder)
+                elif mask & (IN_CREATE | IN_MODIFY):
+                    writing[path] = now
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE):
+                    writing.pop(path, None)
+                    dirty.add(folder)
+            if events and (not dirty or now - dirty_since < 4 * self.debounce):
+                continue
+            for path, seen in list(writing.items()):
+                if now - seen > WRITE_TIMEOUT:
+                    writing.pop(path, None)
+            if overflow:
+                # Events were lost: fall back to comparing every folder's mtime once
+                overflow = False
+                dirty.clear()
+                new = self.scanner.rescan()
+            elif dirty or self.scanner.settling:
+                new = self.scanner.rescan(dirty)
+                dirty.clear()
+            else:
+                continue
+            try:
+                self._watch_folders()
+            except OSError as exc:
+                self.error = str(exc)
+            self._notify(new)
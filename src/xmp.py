@@ -0,0 +1,217 @@
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from analysis import SAVE_EVERY
+from decisions import DISCARD, KEEP
+from tools import MediaIndex, stem_key
+
+XMP_MANIFEST = Path(".keep_or_discard") / "xmp_manifest.json"
+# IMG_0001.xmp, shared by IMG_0001.jpg and IMG_0001.CR2 (Lightroom, Capture One, Bridge)
+SIDECAR_STEM = "stem"
+# IMG_0001.CR2.xmp, one per file (darktable, digiKam)
+SIDECAR_FULL = "full"
+SIDECAR_STYLES = (SIDECAR_STEM, SIDECAR_FULL)
+# decision -> xmp:Rating, xmp:Label, xmpDM:pick, digiKam:PickLabel
+XMP_FIELDS = {KEEP: (1, "Green", 1, 3), DISCARD: (-1, "Red", -1, 1)}
+XMP_TEMPLATE = """<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>
+<x:xmpmeta xmlns:x="adobe:ns:meta/" x:xmptk="keep_or_discard">
+ <rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">
+  <rdf:Description rdf:about=""
+    xmlns:xmp="http://ns.adobe.com/xap/1.0/"
+    xmlns:xmpDM="http://ns.adobe.com/xmp/1.0/DynamicMedia/"
+    xmlns:digiKam="http://www.digikam.org/ns/1.0/"
+   xmp:Rating="{0}"
+   xmp:Label="{1}"
+   xmpDM:pick="{2}"
+   digiKam:PickLabel="{3}"/>
+ </rdf:RDF>
+</x:xmpmeta>
+<?xpacket end="w"?>
+"""
+# Only two possible sidecars: render them once
+XMP_PAYLOADS = {decision: XMP_TEMPLATE.format(*fields).encode("utf-8") for decision, fields in XMP_FIELDS.items()}
+WRITTEN = "written"
+UNCHANGED = "unchanged"
+REMOVED = "removed"
+FOREIGN = "foreign"
+FAILED = "failed"
+
+
+class XmpReport(NamedTuple):
+    written: int
+    unchanged: int
+    removed: int
+    # Sidecars that exist but were not written by us (or were edited since): left alone
+    foreign: List[Path]
+    # Decided names no longer in the source folder
+    missing: List[str]
+    failed: List[Tuple[Path, str]]
+
+
+class SidecarManifest:
+    # What the last export wrote: sidecar path -> decision and the file's
+    # size/mtime right after writing, so edits by other tools are noticed.
+    manifest_version = 1
+
+    def __init__(self, path: Path = XMP_MANIFEST):
+        self.path = Path(path)
+        self.records: Dict[str, Tuple[str, int, int]] = {}
+        self.load()
+
+    def load(self) -> None:
+        try:
+            with self.path.open(encoding="utf-8") as f:
+                payload = json.load(f)
+        except (OSError, ValueError):
+            return
+        if payload.get("version") != self.manifest_version:
+            return
+        self.records = {path: tuple(record) for path, record in payload.get("sidecars", {}).items()}
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".json.tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump({"version": self.manifest_version, "sidecars": self.records}, f, separators=(",", ":"))
+        tmp_path.replace(self.path)
+
+    def ours(self, path: str, st: os.stat_result) -> bool:
+        record = self.records.get(path)
+        return record is not None and (record[1], record[2]) == (st.st_size, st.st_mtime_ns)
+
+
+def sidecar_path(path: str, style: str) -> str:
+    # Plain strings: this runs for every file of a 50k-image session
+    if style == SIDECAR_FULL:
+        return path + ".xmp"
+    return os.path.splitext(path)[0] + ".xmp"
+
+
+def sidecar_targets(
+    index: MediaIndex, decisions: Iterable[Tuple[str, str]], style: str = SIDECAR_STEM
+) -> Tuple[Dict[str, str], List[str]]:
+    # Every reviewed image and its RAW siblings; in stem style they share one
+    # sidecar, and if two decided images share a stem, keep wins.
+    if style not in SIDECAR_STYLES:
+        raise ValueError(f"Unknown sidecar style: {style}")
+    targets: Dict[str, str] = {}
+    missing: List[str] = []
+    for name, decision in decisions:
+        info = index.resolve(name)
+        if info is None:
+            missing.append(name)
+            continue
+        # Decided names are index keys, so the stem comes without Path work
+        stem = stem_key(name) if name in index.files else index.stem_of(info.path)
+        for item in [info] + [raw for raw in index.raws(stem) if raw is not info]:
+            sidecar = sidecar_path(str(item.path), style)
+            if targets.get(sidecar) != KEEP:
+                targets[sidecar] = decision
+    return targets, missing
+
+
+def write_sidecar(path: Path, decision: str) -> os.stat_result:
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(XMP_PAYLOADS[decision])
+    os.replace(tmp_path, path)
+    return os.stat(path)
+
+
+def bounded_map(pool: ThreadPoolExecutor, func: Callable, items: Iterable, window: int) -> Iterator:
+    # Like pool.map, but with at most `window` tasks queued, so a 50k-item export
+    # never materialises 50k futures; results come back in completion order.
+    pending = set()
+    for item in items:
+        pending.add(pool.submit(func, item))
+        if len(pending) >= window:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield future.result()
+
+
+def export_sidecars(
+    index: MediaIndex,
+    decisions: Iterable[Tuple[str, str]],
+    manifest: Optional[SidecarManifest] = None,
+    style: str = SIDECAR_STEM,
+    full: bool = False,
+    force: bool = False,
+    workers: Optional[int] = None,
+) -> XmpReport:
+    # Sidecars whose decision matches the manifest are skipped without touching
+    # the disk unless full=True, which also recreates deleted ones. Sidecars we
+    # wrote for names that are no longer decided are removed. Existing files we
+    # did not write, or that were edited since, are only overwritten with force.
+    manifest = manifest if manifest is not None else SidecarManifest()
+    targets, missing = sidecar_targets(index, decisions, style)
+
+    def export(item: Tuple[str, str]) -> Tuple[str, str, str, object]:
+        sidecar, decision = item
+        try:
+            st = os.stat(sidecar)
+        except FileNotFoundError:
+            st = None
+        except OSError as exc:
+            return sidecar, decision, FAILED, str(exc)
+        if st is not None and not force and not manifest.ours(sidecar, st):
+            return sidecar, decision, FOREIGN, None
+        if st is not None and manifest.records.get(sidecar, ("",))[0] == decision:
+            return sidecar, decision, UNCHANGED, st
+        try:
+            return sidecar, decision, WRITTEN, write_sidecar(Path(sidecar), decision)
+        except OSError as exc:
+            return sidecar, decision, FAILED, str(exc)
+
+    def remove(sidecar: str) -> Tuple[str, str, str, object]:
+        try:
+            st = os.stat(sidecar)
+            # Edited by another tool since we wrote it: theirs now, left in place
+            if not manifest.ours(sidecar, st):
+                return sidecar, "", FOREIGN, None
+            os.unlink(sidecar)
+        except FileNotFoundError:
+            pass
+        except OSError as exc:
+            return sidecar, "", FAILED, str(exc)
+        return sidecar, "", REMOVED, None
+
+    counts = {WRITTEN: 0, UNCHANGED: 0, REMOVED: 0}
+    foreign: List[Path] = []
+    failed: List[Tuple[Path, str]] = []
+    todo = [
+        (sidecar, decision)
+        for sidecar, decision in targets.items()
+        if full or manifest.records.get(sidecar, ("",))[0] != decision
+    ]
+    counts[UNCHANGED] = len(targets) - len(todo)
+    stale = [sidecar for sidecar in manifest.records if sidecar not in targets]
+    workers = workers or min(16, 2 * (os.cpu_count() or 4))
+    done = 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="xmp") as pool:
+        results = bounded_map(pool, export, todo, 4 * workers)
+        removals = bounded_map(pool, remove, stale, 4 * workers)
+        for results_of in (results, removals):
+            for sidecar, decision, status, detail in results_of:
+                if status in (WRITTEN, UNCHANGED):
+                    manifest.records[sidecar] = (decision, detail.st_size, detail.st_mtime_ns)
+                elif status in (REMOVED, FOREIGN):
+                    manifest.records.pop(sidecar, None)
+                if status == FOREIGN:
+                    foreign.append(Path(sidecar))
+                elif status == FAILED:
+                    failed.append((Path(sidecar), detail))
+                else:
+                    counts[status] += 1
+                done += 1
+                if done % SAVE_EVERY == 0:
+                    manifest.save()
+    manifest.save()
+    return XmpReport(counts[WRITTEN], counts[UNCHANGED], counts[REMOVED], foreign, missing, failed)
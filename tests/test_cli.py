@@ -0,0 +1,69 @@
+import pytest
+
+import cli
+from catalog import CATALOG_PATH, Catalog
+from journal import SESSION_VERSION, SessionJournal
+from sessions import load_reviewer_session, session_paths
+
+SNAPSHOT = {
+    "version": SESSION_VERSION,
+    "source_dir": "media",
+    "mode": "copy",
+    "idx": 2,
+    "mantener": ["a.jpg"],
+    "desechar": ["b.jpg"],
+    "history": [["right", "a.jpg", 0, None], ["left", "b.jpg", 1, None]],
+}
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch, request):
+    # The same reviewer session, stored in the journal or in the catalog
+    monkeypatch.chdir(tmp_path)
+    journal = SessionJournal(*session_paths(""))
+    journal.compact(SNAPSHOT)
+    flag = ["--catalog"] if request.param else ["--no-catalog"]
+    if request.param:
+        catalog = Catalog(CATALOG_PATH)
+        catalog.save_session(
+            "media", "copy", 2, [("a.jpg", "keep", 0), ("b.jpg", "discard", 1)], SNAPSHOT["history"]
+        )
+        catalog.close()
+    (tmp_path / "more.csv").write_text("filename,decision\nc.jpg,keep\nb.jpg,keep\n", encoding="utf-8")
+    return flag
+
+
+def reload(flag):
+    catalog = Catalog(CATALOG_PATH) if flag == ["--catalog"] else None
+    return load_reviewer_session("", catalog)
+
+
+@pytest.mark.parametrize("session", [False, True], indirect=True, ids=["journal", "catalog"])
+def test_import_merge_keeps_position_and_history(session):
+    assert cli.main(session + ["import", "more.csv", "--merge"]) == 0
+    merged = reload(session)
+    assert merged.idx == 2
+    assert [entry[:2] for entry in merged.history] == [("right", "a.jpg"), ("left", "b.jpg")]
+    assert sorted(merged.decisions.items()) == [("a.jpg", "keep"), ("b.jpg", "keep"), ("c.jpg", "keep")]
+
+
+@pytest.mark.parametrize("session", [False, True], indirect=True, ids=["journal", "catalog"])
+def test_import_replace_starts_over(session):
+    assert cli.main(session + ["import", "more.csv"]) == 0
+    replaced = reload(session)
+    assert (replaced.idx, replaced.history) == (0, [])
+    assert sorted(replaced.decisions.items()) == [("b.jpg", "keep"), ("c.jpg", "keep")]
+
+
+def test_plan_totals_count_what_is_left_after_dedup(tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "media").mkdir()
+    for name in ("a.jpg", "b.jpg"):
+        (tmp_path / "media" / name).write_bytes(b"same bytes")
+    SessionJournal(*session_paths("")).compact(
+        dict(SNAPSHOT, mantener=["a.jpg", "b.jpg"], desechar=[], history=[])
+    )
+    assert cli.main(["--no-catalog", "plan", "--dedup", "skip"]) == 0
+    out, err = capsys.readouterr()
+    assert len(out.splitlines()) == 1
+    assert "\n1 archivos, 10.0 B\n" in err
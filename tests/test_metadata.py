@@ -0,0 +1,88 @@
+import os
+from pathlib import Path
+
+from PIL import Image
+
+from metadata import SHAPE_LANDSCAPE, SHAPE_PORTRAIT, ExifInfo, MetadataIndex, QueueFilter, capture_time, read_metadata
+from tools import FileInfo
+
+TAG_EXIF_IFD = 0x8769
+
+
+def jpeg_with_exif(path: Path, make: str, model: str, taken: str, orientation: int = 1, lens: str = "") -> None:
+    exif = Image.Exif()
+    exif[0x010F] = make
+    exif[0x0110] = model
+    exif[0x0112] = orientation
+    exif_ifd = exif.get_ifd(TAG_EXIF_IFD)
+    exif_ifd[0x9003] = taken
+    exif_ifd[0x9291] = "42"
+    if lens:
+        exif_ifd[0xA434] = lens
+    Image.new("RGB", (64, 48), "gray").save(path, exif=exif.tobytes())
+
+
+def file_info(path: Path) -> FileInfo:
+    st = path.stat()
+    return FileInfo(path, st.st_size, st.st_mtime_ns)
+
+
+def test_jpeg_headers(tmp_path):
+    path = tmp_path / "IMG_0001.jpg"
+    jpeg_with_exif(path, "Canon", "Canon EOS R5", "2024:05:01 10:20:30", orientation=6, lens="RF24-70mm")
+    meta = read_metadata(path)
+    assert meta.taken == "2024:05:01 10:20:30.42"
+    # The model already names the make
+    assert meta.camera == "Canon EOS R5"
+    assert meta.lens == "RF24-70mm"
+    assert (meta.width, meta.height, meta.orientation) == (64, 48, 6)
+    # Rotated 90°: stored landscape, shown portrait
+    assert meta.shape == SHAPE_PORTRAIT
+
+
+def test_files_without_exif_fall_back_to_mtime(tmp_path):
+    path = tmp_path / "scan.png"
+    Image.new("RGB", (30, 20)).save(path)
+    os.utime(path, (0, 1_700_000_000))
+    meta = read_metadata(path)
+    assert (meta.taken, meta.camera, meta.shape) == (None, "", SHAPE_LANDSCAPE)
+    assert capture_time(meta, file_info(path)).startswith("2023:11:1")
+    assert read_metadata(tmp_path / "missing.jpg") == ExifInfo()
+
+
+def test_queue_filter(tmp_path):
+    info = FileInfo(tmp_path / "x.jpg", 1, 0)
+    meta = ExifInfo("2024:05:01 10:20:30", "NIKON CORPORATION", "Z 6", "", 1, 60, 40)
+    assert meta.camera == "NIKON CORPORATION Z 6"
+    assert QueueFilter(cameras=("NIKON CORPORATION Z 6",), date_from="2024:05:01").matches(meta, info)
+    assert not QueueFilter(date_to="2024:04:30").matches(meta, info)
+    assert not QueueFilter(shape=SHAPE_PORTRAIT).matches(meta, info)
+    assert not QueueFilter().active
+
+
+def test_index_parses_only_new_or_changed_files(tmp_path):
+    paths = [tmp_path / f"IMG_{i}.jpg" for i in range(3)]
+    for i, path in enumerate(paths):
+        jpeg_with_exif(path, "FUJIFILM", "X-T5", f"2024:05:0{i + 1} 09:00:00")
+    index = MetadataIndex(tmp_path / "metadata.json")
+    assert index.update([file_info(p) for p in paths], workers=2) == 3
+    assert MetadataIndex(tmp_path / "metadata.json").update([file_info(p) for p in paths]) == 0
+
+    jpeg_with_exif(paths[1], "FUJIFILM", "X-T5", "2024:06:01 09:00:00", lens="XF33mmF1.4")
+    os.utime(paths[1], ns=(1, 1))
+    index = MetadataIndex(tmp_path / "metadata.json")
+    assert index.update([file_info(p) for p in paths]) == 1
+    assert index.get(file_info(paths[1])).taken.startswith("2024:06:01")
+    assert index.values(file_info(p) for p in paths) == (["FUJIFILM X-T5"], ["XF33mmF1.4"])
+
+
+def test_unreadable_orientation_is_left_to_the_preview(tmp_path):
+    # An APP1 block the header parser does not recognise as EXIF
+    path = tmp_path / "odd.jpg"
+    jpeg_with_exif(path, "Canon", "Canon EOS R5", "2024:05:01 10:20:30", orientation=6)
+    data = path.read_bytes()
+    path.write_bytes(data.replace(b"Exif\x00\x00", b"Exif\x00\x01", 1))
+    assert read_metadata(path).orientation == 0
+    index = MetadataIndex(tmp_path / "metadata.json")
+    index.update([file_info(path)])
+    assert index.orientation_of(path) is None
@@ -0,0 +1,98 @@
+from pathlib import Path
+
+import pytest
+
+from decisions import DISCARD, KEEP
+from dedup import DEDUP_LINK, DEDUP_SKIP, ContentHashes, dedup_entries
+from plan import TransferPlan
+from tools import MediaIndex
+
+
+@pytest.fixture
+def media(tmp_path, monkeypatch):
+    # Destinations (keep/, discard/) are relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    root = Path("media")
+    files = {
+        "a.jpg": b"a-jpg",
+        "a.CR2": b"a-raw",
+        "b.jpg": b"b-jpg",
+        "b.cr2": b"b-raw-1",
+        "b.nef": b"b-raw-22",
+        "c.cr2": b"c-raw",
+        "2024/d.jpg": b"d-jpg",
+        "2024/d.dng": b"d-raw",
+    }
+    for name, data in files.items():
+        (root / name).parent.mkdir(parents=True, exist_ok=True)
+        (root / name).write_bytes(data)
+    return root
+
+
+def targets(plan: TransferPlan):
+    return sorted((src.name, dst.as_posix()) for src, dst in plan.pairs())
+
+
+def test_raws_follow_their_jpeg(media):
+    index = MediaIndex.build(media)
+    decisions = [("a.jpg", KEEP), ("c.cr2", DISCARD), ("2024/d.jpg", DISCARD)]
+    plan = TransferPlan.build(index, decisions)
+    assert targets(plan) == [
+        ("a.CR2", "keep/a.CR2"),
+        ("a.jpg", "keep/a.jpg"),
+        ("c.cr2", "discard/c.cr2"),
+        ("d.dng", "discard/2024/d.dng"),
+        ("d.jpg", "discard/2024/d.jpg"),
+    ]
+    assert (plan.total_files, plan.total_bytes) == (5, 5 + 5 + 5 + 5 + 5)
+
+
+def test_ambiguous_raws_are_optional(media):
+    index = MediaIndex.build(media)
+    plan = TransferPlan.build(index, [("b.jpg", KEEP)], include_ambiguous_raws=False)
+    assert targets(plan) == [("b.jpg", "keep/b.jpg")]
+    assert sorted(plan.raw_report["b.jpg"]) == ["b.cr2", "b.nef"]
+    plan = TransferPlan.build(index, [("b.jpg", KEEP)])
+    assert [name for name, _ in targets(plan)] == ["b.cr2", "b.jpg", "b.nef"]
+
+
+def test_incremental_updates_match_a_rebuild(media):
+    index = MediaIndex.build(media)
+    plan = TransferPlan.build(index, [("a.jpg", KEEP), ("b.jpg", DISCARD)])
+    plan.update("a.jpg", DISCARD)
+    plan.update("b.jpg", None)
+    plan.update("c.cr2", KEEP)
+    rebuilt = TransferPlan.build(index, [("a.jpg", DISCARD), ("c.cr2", KEEP)])
+    assert targets(plan) == targets(rebuilt)
+    assert (plan.total_files, plan.total_bytes) == (rebuilt.total_files, rebuilt.total_bytes)
+
+
+def test_dedup_skips_or_links_identical_content(media, tmp_path):
+    (media / "copy_of_a.jpg").write_bytes(b"a-jpg")
+    Path("keep").mkdir()
+    (Path("keep") / "old_c.cr2").write_bytes(b"c-raw")
+    index = MediaIndex.build(media)
+    decisions = [("a.jpg", KEEP), ("copy_of_a.jpg", KEEP), ("c.cr2", KEEP), ("2024/d.jpg", DISCARD)]
+    entries = list(TransferPlan.build(index, decisions).entries())
+    hashes = ContentHashes(tmp_path / "hashes.json")
+
+    kept, report = dedup_entries(entries, hashes, DEDUP_SKIP)
+    assert sorted(e.src.name for e in report.skipped) == ["c.cr2", "copy_of_a.jpg"]
+    assert report.saved_bytes == 10
+    assert sorted(e.src.name for e in kept) == ["a.CR2", "a.jpg", "d.dng", "d.jpg"]
+
+    kept, report = dedup_entries(entries, hashes, DEDUP_LINK)
+    links = {e.src.name: e.link for e in kept if e.link is not None}
+    # The first planned copy is transferred, the second links to it; c links to what keep/ holds
+    assert links == {"copy_of_a.jpg": media / "a.jpg", "c.cr2": Path("keep") / "old_c.cr2"}
+    assert len(kept) == len(entries)
+
+
+def test_dedup_never_skips_content_only_in_the_other_folder(media, tmp_path):
+    Path("discard").mkdir()
+    (Path("discard") / "a.jpg").write_bytes(b"a-jpg")
+    index = MediaIndex.build(media)
+    entries = list(TransferPlan.build(index, [("a.jpg", KEEP)]).entries())
+    kept, report = dedup_entries(entries, ContentHashes(tmp_path / "hashes.json"), DEDUP_SKIP)
+    assert report.skipped == []
+    assert [e.link for e in kept if e.src.name == "a.jpg"] == [Path("discard") / "a.jpg"]
@@ -0,0 +1,79 @@
+import struct
+from pathlib import Path
+from typing import List, Tuple
+
+from rawpreview import TAG_COMPRESSION, TAG_ORIENTATION, TAG_STRIP_BYTE_COUNTS, TAG_STRIP_OFFSETS, TAG_SUB_IFDS
+from rawpreview import extract_preview, list_previews
+
+TAG_NEW_SUBFILE_TYPE = 0x00FE
+
+
+def fake_jpeg(sof: int, width: int, height: int) -> bytes:
+    # SOI, a frame header with the given SOF marker, EOI: enough for the marker walk
+    frame = struct.pack(">BHHB", 8, height, width, 3) + bytes(9)
+    return b"\xff\xd8" + struct.pack(">BBH", 0xFF, sof, 2 + len(frame)) + frame + b"\xff\xd9"
+
+
+def ifd(entries: List[Tuple[int, int, int]], next_ifd: int = 0) -> bytes:
+    # (tag, type, single value) entries; LONG values only
+    out = struct.pack("<H", len(entries))
+    for tag, typ, value in sorted(entries):
+        out += struct.pack("<HHII", tag, typ, 1, value)
+    return out + struct.pack("<I", next_ifd)
+
+
+def ifd_size(count: int) -> int:
+    return 2 + 12 * count + 4
+
+
+def write_dng(path: Path, preview: bytes, raw: bytes, orientation: int = 6) -> None:
+    # IFD0 (orientation, two SubIFDs) -> a JPEG preview and the lossless raw
+    # image, both Compression=7 strips, the way DNG writers lay them out
+    ifd0_at = 8
+    sub_array_at = ifd0_at + ifd_size(2)
+    preview_ifd_at = sub_array_at + 8
+    raw_ifd_at = preview_ifd_at + ifd_size(4)
+    preview_at = raw_ifd_at + ifd_size(4)
+    raw_at = preview_at + len(preview)
+    header = b"II" + struct.pack("<HI", 42, ifd0_at)
+    # SubIFDs with two values: the entry points at the offset array
+    ifd0 = struct.pack("<H", 2)
+    ifd0 += struct.pack("<HHII", TAG_ORIENTATION, 3, 1, orientation)
+    ifd0 += struct.pack("<HHII", TAG_SUB_IFDS, 4, 2, sub_array_at) + struct.pack("<I", 0)
+    sub_array = struct.pack("<II", preview_ifd_at, raw_ifd_at)
+    preview_ifd = ifd(
+        [
+            (TAG_NEW_SUBFILE_TYPE, 4, 1),
+            (TAG_COMPRESSION, 3, 7),
+            (TAG_STRIP_OFFSETS, 4, preview_at),
+            (TAG_STRIP_BYTE_COUNTS, 4, len(preview)),
+        ]
+    )
+    raw_ifd = ifd(
+        [
+            (TAG_NEW_SUBFILE_TYPE, 4, 0),
+            (TAG_COMPRESSION, 3, 7),
+            (TAG_STRIP_OFFSETS, 4, raw_at),
+            (TAG_STRIP_BYTE_COUNTS, 4, len(raw)),
+        ]
+    )
+    path.write_bytes(header + ifd0 + sub_array + preview_ifd + raw_ifd + preview + raw)
+
+
+def test_dng_preview_with_compression_7(tmp_path):
+    path = tmp_path / "shot.dng"
+    preview = fake_jpeg(0xC0, 1024, 683)
+    write_dng(path, preview, fake_jpeg(0xC3, 6000, 4000))
+    found = extract_preview(path)
+    assert found is not None
+    assert (found.width, found.height, found.orientation) == (1024, 683, 6)
+    assert found.data == preview
+
+
+def test_lossless_raw_strip_is_not_a_preview(tmp_path):
+    path = tmp_path / "shot.dng"
+    write_dng(path, fake_jpeg(0xC2, 256, 171), fake_jpeg(0xC3, 6000, 4000))
+    assert [(c.width, c.height) for c in list_previews(path)] == [(256, 171)]
+    path = tmp_path / "raw_only.dng"
+    write_dng(path, b"not a jpeg", fake_jpeg(0xC3, 6000, 4000))
+    assert extract_preview(path) is None
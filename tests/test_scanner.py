@@ -0,0 +1,78 @@
+import os
+from pathlib import Path
+
+from catalog import Catalog
+from scanner import MediaScanner
+
+
+def touch(path: Path, mtime_ns: int = 1_000_000_000_000_000_000) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"x")
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def scan(root: Path, catalog: Catalog) -> MediaScanner:
+    scanner = MediaScanner(root, catalog=catalog).start()
+    assert scanner.wait_done(10)
+    return scanner
+
+
+def test_inventory_update_touches_only_rescanned_folders(tmp_path):
+    root = tmp_path / "media"
+    for day in ("day1", "day2"):
+        for i in range(3):
+            touch(root / day / f"img_{i}.jpg")
+    catalog = Catalog(tmp_path / "catalog.sqlite3")
+    scanner = scan(root, catalog)
+    calls = []
+    update = catalog.update_inventory
+    catalog.update_inventory = lambda *args: (calls.append(args), update(*args))
+
+    touch(root / "day2" / "img_9.jpg")
+    (root / "day2" / "img_0.jpg").unlink()
+    # A new folder: its parent's mtime moves too
+    touch(root / "day3" / "img_0.jpg")
+    os.utime(root / "day2", ns=(2, 2))
+    assert scanner.refresh()
+
+    (_, dir_mtimes, removed_dirs, rows, removed), = calls
+    # day1 was not rescanned, so its mtime is not rewritten
+    assert set(dir_mtimes) == {str(root), str(root / "day2"), str(root / "day3")}
+    assert dir_mtimes[str(root / "day2")] == 2
+    assert removed_dirs == []
+    assert sorted(row[0] for row in rows) == ["day2/img_1.jpg", "day2/img_2.jpg", "day2/img_9.jpg", "day3/img_0.jpg"]
+    assert removed == ["day2/img_0.jpg"]
+
+    # Nothing changed: nothing written
+    calls.clear()
+    assert not scanner.refresh()
+    assert calls == []
+
+    dirs, rows = catalog.load_inventory(str(root))
+    assert str(root / "day2") in dirs and dirs[str(root / "day2")] == 2
+    assert "day2/img_0.jpg" not in {row.name for row in rows}
+
+
+def test_reopened_scanner_keeps_order_across_removals(tmp_path):
+    root = tmp_path / "media"
+    for i in range(4):
+        touch(root / f"img_{i}.jpg")
+    catalog = Catalog(tmp_path / "catalog.sqlite3")
+    first = scan(root, catalog)
+    (root / "img_1.jpg").unlink()
+    touch(root / "img_0a.jpg")
+    os.utime(root, ns=(3, 3))
+    first.refresh()
+    expected = [p for p in first.order if p.exists()]
+    assert expected[-1].name == "img_0a.jpg"
+
+    # Seeded from the catalog; files added afterwards still go to the end
+    touch(root / "img_00.jpg")
+    os.utime(root, ns=(4, 4))
+    second = scan(root, catalog)
+    assert second.order == expected + [root / "img_00.jpg"]
+    touch(root / "img_000.jpg")
+    os.utime(root, ns=(5, 5))
+    second.refresh()
+    third = scan(root, catalog)
+    assert third.order == second.order[: len(expected)] + [root / "img_00.jpg", root / "img_000.jpg"]
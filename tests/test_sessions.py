@@ -0,0 +1,107 @@
+import pytest
+
+from catalog import Catalog
+from decisions import DISCARD, KEEP
+from journal import SESSION_VERSION, SessionJournal
+from sessions import Shard, assign_shards, load_journal_session, load_shards
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return SessionJournal(tmp_path / "session_state.json", tmp_path / "session_log.jsonl")
+
+
+def snapshot(session):
+    keep, discard = session.decisions.to_lists()
+    return {
+        "version": SESSION_VERSION,
+        "source_dir": session.source_dir,
+        "mode": session.mode,
+        "idx": session.idx,
+        "mantener": keep,
+        "desechar": discard,
+        "history": session.history,
+    }
+
+
+def test_journal_replay_and_undo(journal):
+    journal.append({"op": "right", "name": "a.jpg", "idx": 0})
+    journal.append({"op": "left", "name": "b.jpg", "idx": 1})
+    # Back to b.jpg and change the decision, then undo that change
+    journal.append({"op": "right", "name": "b.jpg", "idx": 1})
+    journal.append({"op": "undo"})
+    journal.append({"op": "meta", "mode": "move"})
+    session = load_journal_session(SessionJournal(journal.snapshot_path, journal.log_path))
+    assert sorted(session.decisions.items()) == [("a.jpg", KEEP), ("b.jpg", DISCARD)]
+    assert (session.idx, session.mode) == (1, "move")
+    assert [entry[:2] for entry in session.history] == [("right", "a.jpg"), ("left", "b.jpg")]
+
+
+def test_compaction_keeps_state_and_refuses_stale_snapshots(journal):
+    journal.append({"op": "right", "name": "a.jpg", "idx": 0})
+    journal.append({"op": "left", "name": "b.jpg", "idx": 1})
+    session = load_journal_session(SessionJournal(journal.snapshot_path, journal.log_path))
+    seen = journal.seq
+
+    # Another tab appends after this one read the log
+    other = SessionJournal(journal.snapshot_path, journal.log_path)
+    other.append({"op": "right", "name": "c.jpg", "idx": 2})
+    assert not journal.compact(snapshot(session), seen)
+    snap, records = journal.tail(seen)
+    assert snap is None and [r["name"] for r in records] == ["c.jpg"]
+
+    session = load_journal_session(SessionJournal(journal.snapshot_path, journal.log_path))
+    assert journal.compact(snapshot(session), journal.seq)
+    assert not journal.log_path.exists()
+    # A tab that was behind gets the snapshot back instead of the compacted records
+    snap, records = other.tail(0)
+    assert snap["seq"] == 3 and records == []
+
+    reloaded = load_journal_session(SessionJournal(journal.snapshot_path, journal.log_path))
+    assert sorted(reloaded.decisions.items()) == [("a.jpg", KEEP), ("b.jpg", DISCARD), ("c.jpg", KEEP)]
+    assert reloaded.idx == 3 and len(reloaded.history) == 3
+    # Sequence numbers carry on after the snapshot, and undo reaches into it
+    assert journal.append({"op": "undo"}) == 4
+    reloaded = load_journal_session(SessionJournal(journal.snapshot_path, journal.log_path))
+    assert "c.jpg" not in reloaded.decisions and reloaded.idx == 2
+
+
+def test_torn_log_tail_is_dropped(journal):
+    journal.append({"op": "right", "name": "a.jpg", "idx": 0})
+    with journal.log_path.open("a", encoding="utf-8") as f:
+        f.write('{"seq":2,"op":"left","na')
+    fresh = SessionJournal(journal.snapshot_path, journal.log_path)
+    session = load_journal_session(fresh)
+    assert list(session.decisions.items()) == [("a.jpg", KEEP)]
+    assert fresh.append({"op": "left", "name": "b.jpg", "idx": 1}) == 2
+    assert load_journal_session(SessionJournal(journal.snapshot_path, journal.log_path)).decisions.get("b.jpg") == DISCARD
+
+
+def test_catalog_undo_removes_only_its_own_history_row(tmp_path):
+    catalog = Catalog(tmp_path / "catalog.sqlite3")
+    seq_a, _ = catalog.record_decision("media", "copy", "right", "a.jpg", KEEP, 0, None)
+    # Two tabs: the second decides b.jpg after the first changed its mind on a.jpg
+    seq_a2, _ = catalog.record_decision("media", "copy", "left", "a.jpg", DISCARD, 0, KEEP)
+    seq_b, version = catalog.record_decision("media", "copy", "right", "b.jpg", KEEP, 1, None)
+
+    assert catalog.record_undo("media", "copy", "a.jpg", 0, KEEP, seq=seq_a2) == version + 1
+    session = catalog.load_session()
+    assert sorted((name, decision) for name, decision, _ in session.decisions) == [("a.jpg", KEEP), ("b.jpg", KEEP)]
+    assert session.history_seqs == [seq_a, seq_b]
+    assert session.idx == 0
+    assert dict((name, idx) for name, _, idx in session.decisions)["a.jpg"] == 0
+
+    catalog.record_undo("media", "copy", "b.jpg", 1, None, seq=seq_b)
+    session = catalog.load_session()
+    assert [(name, decision) for name, decision, _ in session.decisions] == [("a.jpg", KEEP)]
+    assert session.history == [("right", "a.jpg", 0, None)]
+    assert catalog.session_version() == session.version == version + 2
+
+
+def test_shards_match_the_folder_however_it_is_spelled(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "media").mkdir()
+    assign_shards("./media", ["a.jpg", "b.jpg", "c.jpg"], ["ana", "luis"])
+    assert load_shards("media") == load_shards(str(tmp_path / "media"))
+    assert load_shards("media")["luis"] == Shard(2, 3, 3, "c.jpg")
+    assert load_shards("other") == {}
@@ -0,0 +1,80 @@
+import json
+
+from plan import PlanEntry
+import transfer
+from transfer import COPY_HARDLINK, TransferEngine, extra_bytes
+
+
+def entries_for(tmp_path, names):
+    src_dir = tmp_path / "media"
+    src_dir.mkdir(exist_ok=True)
+    entries = []
+    for name in names:
+        (src_dir / name).write_bytes(name.encode())
+        entries.append(PlanEntry(src_dir / name, tmp_path / "keep" / name, len(name)))
+    return entries
+
+
+def test_copy_resumes_after_an_interruption(tmp_path):
+    entries = entries_for(tmp_path, ["a.jpg", "b.jpg", "c.jpg"])
+    journal_dir = tmp_path / "transfers"
+    first = TransferEngine(entries, "copy", workers=2, journal_dir=journal_dir).run()
+    assert (len(first.done), first.resumed, first.failed) == (3, 0, [])
+
+    # Crashed mid-copy of c.jpg: only its "start" survived, and the partial file is gone
+    records = [json.loads(line) for line in first.journal.read_text(encoding="utf-8").splitlines()]
+    records = [r for r in records if not (r["op"] == "done" and r["src"] == str(entries[2].src))]
+    first.journal.write_text("".join(json.dumps(r) + "\n" for r in records), encoding="utf-8")
+    (tmp_path / "keep" / "c.jpg").unlink()
+    second = TransferEngine(entries, "copy", workers=2, journal_dir=journal_dir).run()
+    assert (len(second.done), second.resumed, second.failed) == (3, 2, [])
+    assert second.plan_id == first.plan_id
+    assert (tmp_path / "keep" / "c.jpg").read_bytes() == b"c.jpg"
+    # Resumed into the same names, no "c (1).jpg"
+    assert sorted(p.name for p in (tmp_path / "keep").iterdir()) == ["a.jpg", "b.jpg", "c.jpg"]
+
+
+def test_missing_source_fails_alone(tmp_path):
+    entries = entries_for(tmp_path, ["a.jpg", "b.jpg"])
+    entries[1].src.unlink()
+    result = TransferEngine(entries, "copy", journal_dir=tmp_path / "transfers").run()
+    assert [src.name for src, _ in result.done] == ["a.jpg"]
+    assert [src.name for src, _ in result.failed] == ["b.jpg"]
+
+
+def test_linked_entries_point_at_the_placed_copy(tmp_path):
+    entries = entries_for(tmp_path, ["a.jpg", "b.jpg"])
+    entries[1] = entries[1]._replace(link=entries[0].src)
+    result = TransferEngine(entries, "copy", journal_dir=tmp_path / "transfers").run()
+    assert result.methods.get(COPY_HARDLINK) == 1
+    assert (tmp_path / "keep" / "b.jpg").samefile(tmp_path / "keep" / "a.jpg")
+
+
+def test_new_decisions_do_not_copy_placed_files_again(tmp_path):
+    entries = entries_for(tmp_path, ["a1.jpg", "a2.jpg", "a3.jpg"])
+    journal_dir = tmp_path / "transfers"
+    TransferEngine(entries[:2], "copy", journal_dir=journal_dir).run()
+    result = TransferEngine(entries, "copy", journal_dir=journal_dir).run()
+    assert (len(result.done), result.resumed) == (3, 2)
+    assert sorted(p.name for p in (tmp_path / "keep").iterdir()) == ["a1.jpg", "a2.jpg", "a3.jpg"]
+
+
+def test_identical_destination_counts_as_done_without_a_journal(tmp_path):
+    entries = entries_for(tmp_path, ["a.jpg", "b.jpg"])
+    TransferEngine(entries, "copy", journal_dir=tmp_path / "transfers").run()
+    # Same name, different file: a real collision still gets a new name
+    (tmp_path / "keep" / "b.jpg").write_bytes(b"other")
+    result = TransferEngine(entries, "copy", journal_dir=tmp_path / "elsewhere").run()
+    assert result.resumed == 1
+    assert sorted(p.name for p in (tmp_path / "keep").iterdir()) == ["a.jpg", "b.jpg", "b_1.jpg"]
+
+
+def test_disk_impact_is_an_upper_bound_until_a_copy_tries_links(tmp_path, monkeypatch):
+    monkeypatch.setattr(transfer, "_support", {})
+    entries = entries_for(tmp_path, ["a.jpg", "b.jpg"])
+    (tmp_path / "keep").mkdir()
+    # Estimating alone writes nothing next to the destination
+    assert extra_bytes(entries, COPY_HARDLINK) == (10, False)
+    assert list((tmp_path / "keep").iterdir()) == []
+    TransferEngine(entries[:1], "copy", journal_dir=tmp_path / "transfers", strategy=COPY_HARDLINK).run()
+    assert extra_bytes(entries, COPY_HARDLINK) == (0, True)
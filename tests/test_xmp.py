@@ -0,0 +1,68 @@
+import os
+from pathlib import Path
+
+from decisions import DISCARD, KEEP
+from tools import MediaIndex
+from xmp import SIDECAR_FULL, XMP_PAYLOADS, SidecarManifest, export_sidecars
+
+
+def library(root: Path) -> MediaIndex:
+    root.mkdir()
+    for name in ("a.jpg", "a.cr2", "b.jpg", "c.jpg"):
+        (root / name).write_bytes(b"x")
+    return MediaIndex.build(root)
+
+
+def export(index, decisions, tmp_path, **kwargs):
+    manifest = SidecarManifest(tmp_path / "manifest.json")
+    return export_sidecars(index, decisions, manifest, workers=2, **kwargs)
+
+
+def test_incremental_export(tmp_path):
+    root = tmp_path / "media"
+    index = library(root)
+    report = export(index, [("a.jpg", KEEP), ("b.jpg", DISCARD)], tmp_path)
+    # a.jpg and a.cr2 share a.xmp in the default style
+    assert (report.written, report.unchanged, report.removed) == (2, 0, 0)
+    assert (root / "a.xmp").read_bytes() == XMP_PAYLOADS[KEEP]
+    assert (root / "b.xmp").read_bytes() == XMP_PAYLOADS[DISCARD]
+
+    mtime = (root / "a.xmp").stat().st_mtime_ns
+    report = export(index, [("a.jpg", KEEP), ("b.jpg", KEEP)], tmp_path)
+    assert (report.written, report.unchanged, report.removed) == (1, 1, 0)
+    assert (root / "a.xmp").stat().st_mtime_ns == mtime
+    assert (root / "b.xmp").read_bytes() == XMP_PAYLOADS[KEEP]
+
+    # b.jpg is no longer decided: the sidecar we wrote goes away
+    report = export(index, [("a.jpg", KEEP)], tmp_path)
+    assert (report.written, report.unchanged, report.removed) == (0, 1, 1)
+    assert not (root / "b.xmp").exists()
+
+
+def test_full_style_writes_one_sidecar_per_file(tmp_path):
+    root = tmp_path / "media"
+    index = library(root)
+    report = export(index, [("a.jpg", DISCARD)], tmp_path, style=SIDECAR_FULL)
+    assert report.written == 2
+    assert (root / "a.jpg.xmp").exists() and (root / "a.cr2.xmp").exists()
+
+
+def test_foreign_sidecars_are_left_alone(tmp_path):
+    root = tmp_path / "media"
+    index = library(root)
+    (root / "c.xmp").write_bytes(b"<from another tool/>")
+    report = export(index, [("b.jpg", KEEP), ("c.jpg", KEEP)], tmp_path)
+    assert report.foreign == [root / "c.xmp"]
+    assert (root / "c.xmp").read_bytes() == b"<from another tool/>"
+
+    # Edited by another tool after we wrote it, then undecided: kept and reported
+    (root / "b.xmp").write_bytes(b"<edited/>")
+    os.utime(root / "b.xmp", ns=(1, 1))
+    report = export(index, [], tmp_path)
+    assert report.removed == 0
+    assert report.foreign == [root / "b.xmp"]
+    assert (root / "b.xmp").read_bytes() == b"<edited/>"
+
+    report = export(index, [("c.jpg", KEEP)], tmp_path, force=True)
+    assert report.written == 1
+    assert (root / "c.xmp").read_bytes() == XMP_PAYLOADS[KEEP]